@@ -0,0 +1,150 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record where the time and space of building a .par file went.
+
+The report is a JSON object:
+
+    {
+      "phases": [{"name": ..., "wall_seconds": ..., "cpu_seconds": ...}],
+      "entries": [{"path": ..., "size": ..., "compressed_size": ...,
+                   "compress_type": ..., "read_seconds": ...,
+                   "write_seconds": ...}],
+      "by_directory": {directory: totals},
+      "by_import_root": {import root: totals},
+      "total": totals
+    }
+
+Entries are listed in the order they are stored.  Each of the totals
+is {"entries": ..., "size": ..., "compressed_size": ..., "ratio": ...},
+where ratio is compressed_size / size.  Files at the top level of the
+archive are rolled up under '.'.
+"""
+
+import contextlib
+import io
+import json
+import os
+import timeit
+import zipfile
+
+_compress_type_names = {
+    zipfile.ZIP_STORED: 'stored',
+    zipfile.ZIP_DEFLATED: 'deflated',
+}
+
+
+def _cpu_seconds():
+    """Return user plus system CPU time of this process"""
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _new_totals():
+    return {'entries': 0, 'size': 0, 'compressed_size': 0}
+
+
+def _add_to_totals(totals, entry):
+    totals['entries'] += 1
+    totals['size'] += entry['size']
+    totals['compressed_size'] += entry['compressed_size']
+
+
+def _finish_totals(totals):
+    size = totals['size']
+    totals['ratio'] = (round(float(totals['compressed_size']) / size, 4)
+                       if size else 1.0)
+    return totals
+
+
+def _import_root_of(stored_path, import_roots):
+    """Return the longest import root containing stored_path, else '.'"""
+    best = '.'
+    for import_root in import_roots:
+        if (stored_path.startswith(import_root + '/') and
+                (best == '.' or len(import_root) > len(best))):
+            best = import_root
+    return best
+
+
+class BuildReport(object):
+    """Timings and sizes collected while building a .par file."""
+
+    def __init__(self):
+        self.phases = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as one phase of the build"""
+        wall_start = timeit.default_timer()
+        cpu_start = _cpu_seconds()
+        try:
+            yield
+        finally:
+            self.phases.append({
+                'name': name,
+                'wall_seconds': round(timeit.default_timer() - wall_start, 6),
+                'cpu_seconds': round(_cpu_seconds() - cpu_start, 6),
+            })
+
+    def generate(self, stored_items, import_roots):
+        """Return the report as a dict.
+
+        Args:
+            stored_items: List of (stored path, StoredResource), in the
+                order they were stored
+            import_roots: Directories inside the archive on sys.path
+        """
+        entries = []
+        by_directory = {}
+        by_import_root = {}
+        total = _new_totals()
+        for stored_path, resource in stored_items:
+            zipinfo = resource.zipinfo
+            entry = {
+                'path': stored_path,
+                'size': zipinfo.file_size,
+                'compressed_size': zipinfo.compress_size,
+                'compress_type': _compress_type_names.get(
+                    zipinfo.compress_type, str(zipinfo.compress_type)),
+                'read_seconds': round(resource.read_seconds, 6),
+                'write_seconds': round(resource.write_seconds, 6),
+            }
+            entries.append(entry)
+            directory = (stored_path.split('/', 1)[0]
+                         if '/' in stored_path else '.')
+            _add_to_totals(by_directory.setdefault(directory, _new_totals()),
+                           entry)
+            import_root = _import_root_of(stored_path, import_roots)
+            _add_to_totals(
+                by_import_root.setdefault(import_root, _new_totals()), entry)
+            _add_to_totals(total, entry)
+
+        return {
+            'phases': self.phases,
+            'entries': entries,
+            'by_directory': dict((key, _finish_totals(value))
+                                 for key, value in by_directory.items()),
+            'by_import_root': dict((key, _finish_totals(value))
+                                   for key, value in by_import_root.items()),
+            'total': _finish_totals(total),
+        }
+
+    def write(self, filename, stored_items, import_roots):
+        """Write the report to a file as JSON, see generate()"""
+        report = self.generate(stored_items, import_roots)
+        content = json.dumps(report, indent=2, sort_keys=True,
+                             separators=(',', ': '))
+        with io.open(filename, 'wt', encoding='utf8') as f:
+            f.write(u'%s\n' % content)
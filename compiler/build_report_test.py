@@ -0,0 +1,95 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import unittest
+import zipfile
+
+from subpar.compiler import build_report
+from subpar.compiler import stored_resource
+from subpar.compiler import test_utils
+
+
+class BuildReportTest(unittest.TestCase):
+
+    def _store(self, items):
+        """Store resources in a zip file, and return (path, resource)"""
+        tmpdir = test_utils.mkdtemp()
+        zip_filename = os.path.join(tmpdir, 'report_test.zip')
+        stored_items = []
+        with zipfile.ZipFile(zip_filename, 'w') as z:
+            for stored_path, content, compress_type in items:
+                resource = stored_resource.StoredContent(
+                    stored_path, (1980, 1, 1, 0, 0, 0), content)
+                resource.zipinfo.compress_type = compress_type
+                resource.store(z)
+                stored_items.append((stored_path, resource))
+        return stored_items
+
+    def test_phase(self):
+        report = build_report.BuildReport()
+        with report.phase('one'):
+            pass
+        with self.assertRaises(ValueError):
+            with report.phase('two'):
+                raise ValueError()
+        self.assertEqual([phase['name'] for phase in report.phases],
+                         ['one', 'two'])
+        for phase in report.phases:
+            self.assertGreaterEqual(phase['wall_seconds'], 0)
+            self.assertGreaterEqual(phase['cpu_seconds'], 0)
+
+    def test_generate(self):
+        stored_items = self._store([
+            ('__main__.py', b'main', zipfile.ZIP_STORED),
+            ('ws/a.py', b'a' * 1000, zipfile.ZIP_DEFLATED),
+            ('ws/lib/b.py', b'b' * 100, zipfile.ZIP_STORED),
+            ('ext/c.txt', b'', zipfile.ZIP_STORED),
+        ])
+        report = build_report.BuildReport().generate(
+            stored_items, ['ws', 'ws/lib'])
+        self.assertEqual([entry['path'] for entry in report['entries']],
+                         ['__main__.py', 'ws/a.py', 'ws/lib/b.py',
+                          'ext/c.txt'])
+        a = report['entries'][1]
+        self.assertEqual(a['size'], 1000)
+        self.assertLess(a['compressed_size'], 1000)
+        self.assertEqual(a['compress_type'], 'deflated')
+        self.assertEqual(report['entries'][0]['compress_type'], 'stored')
+        self.assertEqual(sorted(report['by_directory']), ['.', 'ext', 'ws'])
+        self.assertEqual(report['by_directory']['ws']['entries'], 2)
+        self.assertEqual(report['by_directory']['ws']['size'], 1100)
+        self.assertEqual(report['by_directory']['ext']['ratio'], 1.0)
+        by_import_root = report['by_import_root']
+        self.assertEqual(sorted(by_import_root), ['.', 'ws', 'ws/lib'])
+        self.assertEqual(by_import_root['.']['entries'], 2)
+        self.assertEqual(by_import_root['ws/lib']['size'], 100)
+        self.assertEqual(by_import_root['ws/lib']['ratio'], 1.0)
+        self.assertEqual(report['total']['entries'], 4)
+        self.assertEqual(report['total']['size'], 1104)
+
+    def test_write(self):
+        stored_items = self._store([('a.py', b'a', zipfile.ZIP_STORED)])
+        tmpdir = test_utils.mkdtemp()
+        filename = os.path.join(tmpdir, 'report.json')
+        build_report.BuildReport().write(filename, stored_items, [])
+        with open(filename) as f:
+            report = json.load(f)
+        self.assertEqual(report['entries'][0]['path'], 'a.py')
+        self.assertEqual(report['phases'], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
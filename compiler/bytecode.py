@@ -0,0 +1,123 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compile Python sources to .pyc files for storing in a .par file.
+
+This script is run directly by the interpreter the .par file will run
+under, which may not be the one running the rest of the compiler, so
+it must not import anything from subpar.
+
+Usage:
+    bytecode.py [--optimize=N] [--timestamp=SECONDS] @ARGS_FILE
+    bytecode.py [--optimize=N] [--timestamp=SECONDS] SRC DFILE OUT ...
+
+Each (SRC, DFILE, OUT) triple compiles the source file SRC to OUT,
+with DFILE as the filename recorded in the code.
+
+zipimport looks for 'module.pyc' next to 'module.py' in the archive,
+and uses it if the .pyc was written by the same Python version.  On
+Python 3.7 and up we write unchecked hash-based .pyc files (PEP 552),
+which are always used.  Otherwise, the .pyc records TIMESTAMP as the
+source's modification time, which zipimport compares with the
+timestamp of the .py entry in the archive.  If they don't match, the
+source is compiled at import time instead, just as without a .pyc.
+
+A source that can't be compiled by this interpreter gets an empty
+output file, which the compiler leaves out of the .par file.
+"""
+
+import marshal
+import struct
+import sys
+
+# Default timestamp, see subpar/compiler/cli.py
+_default_timestamp = 315532800
+
+
+def _magic():
+    """Return the .pyc magic number of this interpreter"""
+    try:
+        import importlib.util
+        return importlib.util.MAGIC_NUMBER
+    except (ImportError, AttributeError):
+        import imp  # pylint: disable=deprecated-module
+        return imp.get_magic()
+
+
+def compile_source(source, dfile, optimize, timestamp):
+    """Return the contents of a .pyc file for some source.
+
+    Args:
+        source: Python source code as bytes
+        dfile: Filename to record in code objects
+        optimize: Optimization level, like the -O flag, or -1 for the
+            level of this interpreter
+        timestamp: Source modification time to record, if not writing
+            a hash-based .pyc
+
+    Raises:
+        SyntaxError, ValueError, TypeError
+    """
+    if sys.version_info[0] < 3:
+        code = compile(source, dfile, 'exec', 0, True)
+    else:
+        code = compile(source, dfile, 'exec', dont_inherit=True,
+                       optimize=optimize)
+    data = marshal.dumps(code)
+    if sys.version_info >= (3, 7):
+        import importlib.util
+        # Flags: hash based, don't check source
+        header = struct.pack('<I', 0b01) + importlib.util.source_hash(source)
+    elif sys.version_info >= (3, 3):
+        header = struct.pack('<II', timestamp & 0xFFFFFFFF,
+                             len(source) & 0xFFFFFFFF)
+    else:
+        header = struct.pack('<I', timestamp & 0xFFFFFFFF)
+    return _magic() + header + data
+
+
+def main(argv):
+    optimize = -1
+    timestamp = _default_timestamp
+    args = []
+    for arg in argv[1:]:
+        if arg.startswith('--optimize='):
+            optimize = int(arg[len('--optimize='):])
+        elif arg.startswith('--timestamp='):
+            timestamp = int(arg[len('--timestamp='):])
+        elif arg.startswith('@'):
+            with open(arg[1:]) as args_file:
+                args.extend(line.rstrip('\n') for line in args_file)
+        else:
+            args.append(arg)
+    if len(args) % 3:
+        sys.stderr.write('Expected SRC DFILE OUT triples, got %r\n' % args)
+        return 2
+
+    for i in range(0, len(args), 3):
+        src, dfile, out = args[i:i + 3]
+        with open(src, 'rb') as f:
+            source = f.read()
+        try:
+            pyc = compile_source(source, dfile, optimize, timestamp)
+        except (SyntaxError, ValueError, TypeError) as e:
+            sys.stderr.write('Not compiling %s: %s\n' % (src, e))
+            pyc = b''
+        with open(out, 'wb') as f:
+            f.write(pyc)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
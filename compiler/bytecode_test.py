@@ -0,0 +1,72 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import marshal
+import os
+import sys
+import unittest
+
+from subpar.compiler import bytecode
+from subpar.compiler import test_utils
+
+
+# Magic number plus flags and hash, mtime and size, or mtime
+if sys.version_info >= (3, 7):
+    _header_size = 16
+elif sys.version_info >= (3, 3):
+    _header_size = 12
+else:
+    _header_size = 8
+
+
+class BytecodeTest(unittest.TestCase):
+
+    def test_compile_source(self):
+        pyc = bytecode.compile_source(b'x = 1\n', 'foo/bar.py', -1, 1234)
+        self.assertEqual(pyc[:4], bytecode._magic())
+        code = marshal.loads(pyc[_header_size:])
+        self.assertEqual(code.co_filename, 'foo/bar.py')
+        namespace = {}
+        exec(code, namespace)
+        self.assertEqual(namespace['x'], 1)
+
+    def test_compile_source_optimize(self):
+        if sys.version_info[0] < 3:
+            return
+        source = b'assert False\n'
+        pyc = bytecode.compile_source(source, 'foo.py', 1, 0)
+        exec(marshal.loads(pyc[_header_size:]), {})
+
+    def test_main(self):
+        tmpdir = test_utils.mkdtemp()
+        good = test_utils.temp_file(b'x = 1\n', suffix='.py')
+        bad = test_utils.temp_file(b'x = (\n', suffix='.py')
+        good_out = os.path.join(tmpdir, 'good.pyc')
+        bad_out = os.path.join(tmpdir, 'bad.pyc')
+        args_file = test_utils.temp_file(
+            ('%s\nbad.py\n%s\n' % (bad.name, bad_out)).encode('utf8'))
+        status = bytecode.main([
+            'bytecode.py', '--optimize=2', '--timestamp=0',
+            good.name, 'good.py', good_out, '@' + args_file.name])
+        self.assertEqual(status, 0)
+        with open(good_out, 'rb') as f:
+            self.assertEqual(f.read()[:4], bytecode._magic())
+        self.assertEqual(os.path.getsize(bad_out), 0)
+
+    def test_main_bad_args(self):
+        self.assertEqual(bytecode.main(['bytecode.py', 'foo.py']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
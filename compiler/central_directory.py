@@ -0,0 +1,243 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read the central directory of a zip file, quickly.
+
+zipfile.ZipFile builds a ZipInfo object for every entry, which takes
+seconds for archives with hundreds of thousands of entries.  Here we
+read the whole central directory with one read() call and keep only
+the fields needed to analyze an archive.
+
+Data before the start of the zip file, like the interpreter line of a
+.par file, is allowed.  Offsets returned are from the start of the
+file.
+
+See: http://www.pkware.com/documents/casestudies/APPNOTE.TXT
+"""
+
+import collections
+import os
+import struct
+import zipfile
+import zlib
+
+from subpar.compiler import error
+
+# End of central directory record, see APPNOTE.TXT section 4.3.16
+_eocd_format = '<4s4H2LH'
+_eocd_size = struct.calcsize(_eocd_format)
+_eocd_signature = b'PK\x05\x06'
+# Maximum length of the zip file comment
+_max_comment = 0xFFFF
+
+# Zip64 end of central directory locator and record, sections 4.3.14
+# and 4.3.15
+_zip64_locator_format = '<4sLQL'
+_zip64_locator_size = struct.calcsize(_zip64_locator_format)
+_zip64_locator_signature = b'PK\x06\x07'
+_zip64_eocd_format = '<4sQ2H2L4Q'
+_zip64_eocd_size = struct.calcsize(_zip64_eocd_format)
+_zip64_eocd_signature = b'PK\x06\x06'
+_zip64_extra_id = 0x0001
+
+# Central directory file header, section 4.3.12.  Only the fields we
+# need are unpacked: signature, flags, compression, CRC, compressed
+# size, file size, name length, extra length, comment length and local
+# header offset.
+_central_header = struct.Struct('<4s4xHH4xLLLHHH8xL')
+_central_header_signature = b'PK\x01\x02'
+
+# Local file header, section 4.3.7
+_local_header_format = '<4s5H3L2H'
+_local_header_size = struct.calcsize(_local_header_format)
+_local_header_signature = b'PK\x03\x04'
+
+_flag_utf8 = 0x800
+
+Entry = collections.namedtuple('Entry', [
+    'filename',
+    'compress_type',
+    'crc',
+    'compress_size',
+    'file_size',
+    'header_offset',
+])
+
+
+def _find_eocd(f, file_size):
+    """Return (offset, fields) of the end of central directory record"""
+    tail_size = min(file_size, _eocd_size + _max_comment)
+    f.seek(file_size - tail_size)
+    tail = f.read(tail_size)
+    pos = tail.rfind(_eocd_signature)
+    while pos >= 0:
+        if pos + _eocd_size <= len(tail):
+            fields = struct.unpack_from(_eocd_format, tail, pos)
+            # The comment must run exactly to the end of the file
+            if pos + _eocd_size + fields[7] == len(tail):
+                return file_size - tail_size + pos, fields
+        pos = tail.rfind(_eocd_signature, 0, pos)
+    raise error.Error('Not a zip file')
+
+
+def _read_zip64_eocd(f, eocd_offset):
+    """Return (offset, count, size, cd offset) from zip64 records, or None"""
+    locator_offset = eocd_offset - _zip64_locator_size
+    if locator_offset < 0:
+        return None
+    f.seek(locator_offset)
+    locator = f.read(_zip64_locator_size)
+    if locator[:4] != _zip64_locator_signature:
+        return None
+    # The record offset is relative to the start of the zip data, so
+    # find the record just before the locator instead.
+    record_offset = locator_offset - _zip64_eocd_size
+    f.seek(record_offset)
+    record = f.read(_zip64_eocd_size)
+    if (len(record) != _zip64_eocd_size or
+            record[:4] != _zip64_eocd_signature):
+        raise error.Error('Bad zip64 end of central directory record')
+    fields = struct.unpack(_zip64_eocd_format, record)
+    return record_offset, fields[7], fields[8], fields[9]
+
+
+def _zip64_values(extra, values):
+    """Replace 0xFFFFFFFF values with those in a zip64 extra field.
+
+    Args:
+        extra: The extra field of a central directory header
+        values: [file_size, compress_size, header_offset]
+    """
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, data_size = struct.unpack_from('<2H', extra, pos)
+        pos += 4
+        if header_id == _zip64_extra_id:
+            field_pos = pos
+            for i, value in enumerate(values):
+                if value == 0xFFFFFFFF:
+                    values[i] = struct.unpack_from('<Q', extra, field_pos)[0]
+                    field_pos += 8
+            break
+        pos += data_size
+    return values
+
+
+def locate(f):
+    """Find the central directory of a zip file.
+
+    Args:
+        f: Zip file opened for binary reading
+
+    Returns:
+        (offset, size, entry count, zip data offset), where offsets
+        are from the start of the file, and zip data offset is the
+        length of whatever precedes the zip data.
+
+    Raises:
+        Error, IOError
+    """
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    eocd_offset, eocd = _find_eocd(f, file_size)
+    count, cd_size, cd_offset = eocd[4], eocd[5], eocd[6]
+    cd_end = eocd_offset
+    zip64 = _read_zip64_eocd(f, eocd_offset)
+    if zip64 is not None:
+        cd_end, count, cd_size, cd_offset = zip64
+    # Offsets in the zip file are relative to the start of the zip
+    # data, which may follow something else.
+    cd_start = cd_end - cd_size
+    concat = cd_start - cd_offset
+    if cd_start < 0 or concat < 0:
+        raise error.Error('Bad central directory offset')
+    return cd_start, cd_size, count, concat
+
+
+def read(f):
+    """Read the entries of a zip file.
+
+    Args:
+        f: Zip file opened for binary reading
+
+    Returns:
+        A list of Entry, in central directory order
+
+    Raises:
+        Error, IOError
+    """
+    cd_start, cd_size, count, concat = locate(f)
+    f.seek(cd_start)
+    data = f.read(cd_size)
+    if len(data) != cd_size:
+        raise error.Error('Truncated central directory')
+
+    # This loop is the slow part for large archives, so avoid
+    # attribute lookups and function calls where possible.
+    entries = []
+    append = entries.append
+    unpack_from = _central_header.unpack_from
+    header_size = _central_header.size
+    new_entry = tuple.__new__
+    pos = 0
+    for _ in range(count):
+        try:
+            (signature, flags, compress_type, crc, compress_size, file_size,
+             name_size, extra_size, comment_size,
+             header_offset) = unpack_from(data, pos)
+        except struct.error:
+            signature = None
+        if signature != _central_header_signature:
+            raise error.Error('Bad central directory entry at offset %d' %
+                              (cd_start + pos))
+        pos += header_size
+        name = data[pos:pos + name_size]
+        pos += name_size
+        try:
+            # Much faster than cp437, and the same for ASCII names
+            filename = name.decode('ascii')
+        except UnicodeDecodeError:
+            filename = name.decode('utf-8' if flags & _flag_utf8 else 'cp437')
+        if 0xFFFFFFFF in (compress_size, file_size, header_offset):
+            file_size, compress_size, header_offset = _zip64_values(
+                data[pos:pos + extra_size],
+                [file_size, compress_size, header_offset])
+        pos += extra_size + comment_size
+        append(new_entry(Entry, (filename, compress_type, crc, compress_size,
+                                 file_size, header_offset + concat)))
+    return entries
+
+
+def read_entry(f, entry):
+    """Return the uncompressed content of one entry as bytes.
+
+    Only stored and deflated entries are supported.
+
+    Raises:
+        Error, IOError
+    """
+    f.seek(entry.header_offset)
+    header = f.read(_local_header_size)
+    if (len(header) != _local_header_size or
+            header[:4] != _local_header_signature):
+        raise error.Error('Bad local header for [%s]' % entry.filename)
+    fields = struct.unpack(_local_header_format, header)
+    f.seek(fields[9] + fields[10], os.SEEK_CUR)
+    data = f.read(entry.compress_size)
+    if entry.compress_type == zipfile.ZIP_DEFLATED:
+        return zlib.decompress(data, -15)
+    elif entry.compress_type == zipfile.ZIP_STORED:
+        return data
+    raise error.Error('Unsupported compression type %d for [%s]' % (
+        entry.compress_type, entry.filename))
@@ -0,0 +1,108 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import sys
+import unittest
+import zipfile
+
+from subpar.compiler import central_directory
+from subpar.compiler import error
+from subpar.compiler import test_utils
+
+
+class CentralDirectoryTest(unittest.TestCase):
+
+    def _make_zip(self, prefix=b'', comment=b'', **kwargs):
+        buf = io.BytesIO()
+        buf.write(prefix)
+        z = zipfile.ZipFile(buf, 'w', **kwargs)
+        z.writestr('a.txt', b'a' * 100)
+        info = zipfile.ZipInfo('dir/b.py')
+        info.compress_type = zipfile.ZIP_DEFLATED
+        z.writestr(info, b'b' * 1000)
+        z.writestr(u'dir/\xe9.txt', b'')
+        z.comment = comment
+        z.close()
+        return buf
+
+    def _check(self, buf):
+        entries = central_directory.read(buf)
+        buf.seek(0)
+        z = zipfile.ZipFile(buf)
+        self.assertEqual([e.filename for e in entries], z.namelist())
+        for entry, info in zip(entries, z.infolist()):
+            self.assertEqual(entry.crc, info.CRC)
+            self.assertEqual(entry.file_size, info.file_size)
+            self.assertEqual(entry.compress_size, info.compress_size)
+            self.assertEqual(entry.compress_type, info.compress_type)
+            self.assertEqual(central_directory.read_entry(buf, entry),
+                             z.read(info))
+        z.close()
+        return entries
+
+    def test_read(self):
+        entries = self._check(self._make_zip())
+        self.assertEqual(entries[1].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertLess(entries[1].compress_size, 1000)
+
+    def test_read_with_prefix(self):
+        entries = self._check(self._make_zip(prefix=b'#!/usr/bin/python\n'))
+        self.assertEqual(entries[0].header_offset, len('#!/usr/bin/python\n'))
+
+    def test_locate(self):
+        prefix = b'#!/usr/bin/python\n'
+        buf = self._make_zip(prefix=prefix)
+        cd_start, cd_size, count, _ = central_directory.locate(buf)
+        self.assertEqual(count, 3)
+        buf.seek(cd_start)
+        self.assertEqual(buf.read(4), b'PK\x01\x02')
+        buf.seek(cd_start + cd_size)
+        self.assertEqual(buf.read(4), b'PK\x05\x06')
+
+    def test_read_with_comment(self):
+        self._check(self._make_zip(comment=b'a comment'))
+        # Not something zipfile can read, but unambiguous
+        buf = self._make_zip(comment=b'PK\x05\x06 comment')
+        self.assertEqual(len(central_directory.read(buf)), 3)
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'needs force_zip64')
+    def test_read_zip64(self):
+        buf = io.BytesIO()
+        buf.write(b'#!/usr/bin/python\n')
+        z = zipfile.ZipFile(buf, 'w', allowZip64=True)
+        # Force zip64 records for a small file
+        for i in range(3):
+            with z.open('f%d' % i, 'w', force_zip64=True) as f:
+                f.write(b'x' * i)
+        z.close()
+        self._check(buf)
+
+    def test_read_par(self):
+        par_filename = os.path.join(test_utils.mkdtemp(), 'test.par')
+        with open(par_filename, 'wb') as f:
+            f.write(self._make_zip(prefix=b'#!/usr/bin/python\n').getvalue())
+        with open(par_filename, 'rb') as f:
+            self.assertEqual(len(central_directory.read(f)), 3)
+
+    def test_read_not_a_zip(self):
+        with self.assertRaises(error.Error):
+            central_directory.read(io.BytesIO(b'not a zip file' * 10))
+        with self.assertRaises(error.Error):
+            central_directory.read(io.BytesIO(b''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -34,35 +34,74 @@ def bool_from_string(raw_value):
             'Value must be True or False, got %r instead.' % raw_value)
 
 
+def zip_input_from_string(raw_value):
+    """Parse a PREFIX=PATH command line argument"""
+    prefix, sep, path = raw_value.partition('=')
+    if not sep or not path:
+        raise argparse.ArgumentTypeError(
+            'Value must be PREFIX=PATH, got %r instead.' % raw_value)
+    return prefix.strip('/'), path
+
+
 def make_command_line_parser():
     """Return an object that can parse this program's command line"""
     parser = argparse.ArgumentParser(
-        description='Subpar Python Executable Builder')
+        description='Subpar Python Executable Builder',
+        fromfile_prefix_chars='@')
 
     parser.add_argument(
         'main_filename',
-        help='Python source file to use as main entry point')
+        help='Python source file to use as main entry point.  Required ' +
+        'unless --fragment_only is given.',
+        nargs='?')
 
     parser.add_argument(
         '--manifest_file',
         help='File listing all files to be included in this parfile. This is ' +
         'typically generated by bazel in a target\'s .runfiles_manifest file.',
         required=True)
+    parser.add_argument(
+        '--extra_manifest_file',
+        help='File listing more files to include, in the same format as ' +
+        '--manifest_file, such as .pyc files built separately.  Its ' +
+        'entries take precedence.  May be repeated.',
+        action='append',
+        default=[],
+        dest='extra_manifest_files')
     parser.add_argument(
         '--manifest_root',
         help='Root directory of all relative paths in manifest file.',
         default=os.getcwd())
+    parser.add_argument(
+        '--workspace_name',
+        help='Name of the main Bazel workspace.  If set, the manifest ' +
+        'file lists runfiles short paths, which are mapped to paths ' +
+        'under the workspace name, and the main entry point must be ' +
+        'listed in it.')
     parser.add_argument(
         '--output_par',
         help='Filename of generated par file.',
         required=True)
     parser.add_argument(
         '--stub_file',
-        help='Read imports and interpreter path from the specified stub file',
-        required=True)
+        help='Read imports and interpreter path from the specified stub ' +
+        'file.  Required unless --fragment_only or --interpreter is given.')
     parser.add_argument(
         '--interpreter',
         help='Interpreter to use instead of determining it from the stub file')
+    parser.add_argument(
+        '--interpreter_flag',
+        help='Command line flag to run the interpreter with, such as ' +
+        '-S or -E.  May be repeated.  Give as --interpreter_flag=-S.',
+        action='append',
+        default=[],
+        dest='interpreter_flags')
+    parser.add_argument(
+        '--create_init',
+        help='Add an empty __init__.py to every directory of Python ' +
+        'files that lacks one, like Bazel does for runfiles?',
+        type=bool_from_string,
+        default=False)
     # The default timestamp is "Jan 1 1980 00:00:00 utc", which is the
     # earliest time that can be stored in a zip file.
     #
@@ -93,6 +132,165 @@ def make_command_line_parser():
         action='append',
         default=[],
         dest='import_roots')
+    parser.add_argument(
+        '--layout_profile',
+        help='File listing stored paths in the order they were first ' +
+        'accessed during a training run.  These entries are placed ' +
+        'contiguously at the start of the archive, and read ahead ' +
+        'sequentially at startup.')
+    parser.add_argument(
+        '--prune_imports',
+        help='Leave out Python modules that can\'t be imported starting ' +
+        'from the main entry point and the --keep_module roots?',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--keep_module',
+        help='Module imported dynamically, which is kept along with ' +
+        'everything it imports when pruning.  A name ending in .* means ' +
+        'every module in that package.  May be repeated.',
+        action='append',
+        default=[],
+        dest='keep_modules')
+    parser.add_argument(
+        '--prune_report',
+        help='File to write the list of kept and dropped Python modules to')
+    parser.add_argument(
+        '--strip_elf',
+        help='Remove debugging information from ELF shared libraries ' +
+        'and executables?',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--strip_tool',
+        help='Path to a `strip` program to use with --strip_elf, instead ' +
+        'of the built-in implementation')
+    parser.add_argument(
+        '--elf_debug_dir',
+        help='Directory to write the debugging information removed by ' +
+        '--strip_elf to, as <stored path>.debug files')
+    parser.add_argument(
+        '--minify_sources',
+        help='Remove comments, docstrings and assert statements from ' +
+        'Python sources, like running under python -OO?',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--keep_docstrings',
+        help='Stored path, or directory prefix, of Python sources whose ' +
+        'docstrings are used at runtime, and must be kept when ' +
+        'minifying.  May be repeated.',
+        action='append',
+        default=[])
+    parser.add_argument(
+        '--minify_report',
+        help='File to write the bytes saved by minifying, per package, to')
+    parser.add_argument(
+        '--pyc_interpreter',
+        help='Interpreter that compiled the .pyc files listed by ' +
+        '--extra_manifest_file.  With --minify_sources, those of ' +
+        'minified sources are compiled again by it, from the minified ' +
+        'source.  Otherwise they are left out.')
+    parser.add_argument(
+        '--pyc_optimize',
+        help='Optimization level for --pyc_interpreter, like the -O flag',
+        type=int,
+        default=-1)
+    parser.add_argument(
+        '--build_report',
+        help='File to write a JSON report of entry sizes and compiler ' +
+        'timings to')
+    parser.add_argument(
+        '--dependency_archive',
+        help='Write files from other workspaces than the main one to ' +
+        'this separate archive, which the .par file loads from its own ' +
+        'directory at runtime')
+    parser.add_argument(
+        '--dedup_content',
+        help='Store files with identical content once, and make the ' +
+        'other paths aliases of it at runtime',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--verify_archive',
+        help='After writing the output, check that every path reads ' +
+        'back with the right content through zipfile and zipimport',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--zygote',
+        help='Run the .par file in a resident process that already has ' +
+        'its modules imported, started by the first run',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--bytecode_cache',
+        help='Keep modules compiled from source at runtime in a ' +
+        'per-user cache directory, for later runs',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--freeze_modules',
+        help='Store the code objects of pure Python modules in one ' +
+        'entry, which is loaded once at startup and imported from',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--frozen_module',
+        help='Module or package to freeze with --freeze_modules, ' +
+        'instead of all of them.  May be repeated.',
+        action='append',
+        default=[],
+        dest='frozen_modules')
+    parser.add_argument(
+        '--prefetch_module',
+        help='Module or package to load in the background at startup, ' +
+        'before it is imported.  May be repeated.',
+        action='append',
+        default=[],
+        dest='prefetch_modules')
+    parser.add_argument(
+        '--lazy_import_package',
+        help='Module or package to import lazily, running each module ' +
+        'only when one of its attributes is first used.  May be repeated.',
+        action='append',
+        default=[],
+        dest='lazy_import_packages')
+    parser.add_argument(
+        '--prefetch_profile',
+        help='Also load the modules imported in the --layout_profile ' +
+        'in the background at startup, in the order they were imported',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--dev_launcher',
+        help='Write a script that runs the main entry point from the ' +
+        'runfiles tree next to it, instead of a .par file?',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--fragment_only',
+        help='Write a plain zip file holding only the manifest\'s files, ' +
+        'to be passed to later runs with --fragment?',
+        type=bool_from_string,
+        default=False)
+    parser.add_argument(
+        '--fragment',
+        help='Zip file made with --fragment_only.  Manifest files found ' +
+        'in it are copied from it as is, instead of being read from ' +
+        'disk.  May be repeated.',
+        action='append',
+        default=[],
+        dest='fragments')
+    parser.add_argument(
+        '--zip_input',
+        help='PREFIX=PATH of a wheel or zip file whose entries are stored ' +
+        'under the directory PREFIX, copied as is without ' +
+        'recompressing them.  May be repeated.',
+        action='append',
+        default=[],
+        type=zip_input_from_string,
+        dest='zip_inputs')
     return parser
 
 
@@ -155,12 +353,61 @@ def main(argv):
     parser = make_command_line_parser()
     args = parser.parse_args(argv[1:])
 
-    # Parse interpreter from stub file that's not available in Starlark
-    interpreter = parse_stub(args.stub_file)
-
+    if args.fragment_only:
+        fragment = python_archive.PythonArchive(
+            main_filename=None,
+            import_roots=args.import_roots,
+            interpreter=None,
+            output_filename=args.output_par,
+            manifest_filename=args.manifest_file,
+            manifest_root=args.manifest_root,
+            workspace_name=args.workspace_name,
+            timestamp=args.timestamp,
+            zip_safe=args.zip_safe,
+        )
+        fragment.create_fragment()
+        return
+    if not args.main_filename:
+        parser.error('the following arguments are required: main_filename')
     if args.interpreter:
         interpreter = args.interpreter
+    elif args.stub_file:
+        # Parse interpreter from stub file that's not available in Starlark
+        interpreter = parse_stub(args.stub_file)
+    else:
+        parser.error('one of the arguments --stub_file --interpreter is ' +
+                     'required')
 
+    options = python_archive.Options(
+        layout_profile_filename=args.layout_profile,
+        prune_imports=args.prune_imports,
+        keep_modules=args.keep_modules,
+        prune_report_filename=args.prune_report,
+        strip_elf=args.strip_elf,
+        strip_tool=args.strip_tool,
+        elf_debug_dir=args.elf_debug_dir,
+        minify_sources=args.minify_sources,
+        keep_docstrings=args.keep_docstrings,
+        minify_report_filename=args.minify_report,
+        pyc_interpreter=args.pyc_interpreter,
+        pyc_optimize=args.pyc_optimize,
+        fragment_filenames=args.fragments,
+        zip_inputs=args.zip_inputs,
+        extra_manifest_filenames=args.extra_manifest_files,
+        create_init=args.create_init,
+        build_report_filename=args.build_report,
+        dedup_content=args.dedup_content,
+        verify_archive=args.verify_archive,
+        dependency_filename=args.dependency_archive,
+        interpreter_flags=args.interpreter_flags,
+        zygote=args.zygote,
+        freeze_modules=args.freeze_modules,
+        frozen_modules=args.frozen_modules,
+        bytecode_cache=args.bytecode_cache,
+        prefetch_modules=args.prefetch_modules,
+        prefetch_profile=args.prefetch_profile,
+        lazy_import_packages=args.lazy_import_packages,
+    )
     par = python_archive.PythonArchive(
         main_filename=args.main_filename,
         import_roots=args.import_roots,
@@ -168,7 +415,12 @@ def main(argv):
         output_filename=args.output_par,
         manifest_filename=args.manifest_file,
         manifest_root=args.manifest_root,
+        workspace_name=args.workspace_name,
         timestamp=args.timestamp,
         zip_safe=args.zip_safe,
+        options=options,
     )
-    par.create()
+    if args.dev_launcher:
+        par.create_dev_launcher()
+    else:
+        par.create()
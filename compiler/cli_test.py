@@ -30,6 +30,16 @@ class CliTest(unittest.TestCase):
         with self.assertRaises(argparse.ArgumentTypeError):
             cli.bool_from_string('Yes')
 
+    def test_zip_input_from_string(self):
+        self.assertEqual(cli.zip_input_from_string('pypi__six=a/six.whl'),
+                         ('pypi__six', 'a/six.whl'))
+        self.assertEqual(cli.zip_input_from_string('=a/b.zip'),
+                         ('', 'a/b.zip'))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cli.zip_input_from_string('a/six.whl')
+        with self.assertRaises(argparse.ArgumentTypeError):
+            cli.zip_input_from_string('pypi__six=')
+
     def test_make_command_line_parser(self):
         parser = cli.make_command_line_parser()
         args = parser.parse_args([
@@ -49,6 +59,20 @@ class CliTest(unittest.TestCase):
         self.assertEqual(args.zip_safe, False)
         self.assertEqual(args.import_roots, ['root1', 'root2'])
         self.assertEqual(args.main_filename, 'foo')
+        self.assertEqual(args.extra_manifest_files, [])
+        self.assertEqual(args.create_init, False)
+        self.assertEqual(args.dedup_content, False)
+        self.assertEqual(args.verify_archive, False)
+        self.assertEqual(args.dependency_archive, None)
+        self.assertEqual(args.interpreter_flags, [])
+        self.assertEqual(args.zygote, False)
+        self.assertEqual(args.freeze_modules, False)
+        self.assertEqual(args.frozen_modules, [])
+        self.assertEqual(args.bytecode_cache, False)
+        self.assertEqual(args.prefetch_modules, [])
+        self.assertEqual(args.prefetch_profile, False)
+        self.assertEqual(args.lazy_import_packages, [])
+        self.assertEqual(args.dev_launcher, False)
 
     def test_make_command_line_parser_for_interprerter(self):
         parser = cli.make_command_line_parser()
@@ -63,6 +87,207 @@ class CliTest(unittest.TestCase):
         ])
         self.assertEqual(args.interpreter, 'foobar')
 
+    def test_make_command_line_parser_without_stub(self):
+        parser = cli.make_command_line_parser()
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--zip_safe=False',
+            '--interpreter=/usr/bin/python3',
+            '--create_init=True',
+            '--dedup_content=True',
+            '--verify_archive=True',
+            '--dependency_archive=deps.par',
+            '--interpreter_flag=-S',
+            '--interpreter_flag=-X',
+            '--interpreter_flag=frozen_modules=on',
+            '--zygote=True',
+            '--freeze_modules=True',
+            '--frozen_module=pkg',
+            '--frozen_module=other.mod',
+            '--bytecode_cache=True',
+            '--prefetch_module=pkg.sub',
+            '--prefetch_profile=True',
+            '--lazy_import_package=big',
+            '--dev_launcher=True',
+            'foo',
+        ])
+        self.assertEqual(args.stub_file, None)
+        self.assertEqual(args.interpreter, '/usr/bin/python3')
+        self.assertEqual(args.create_init, True)
+        self.assertEqual(args.dedup_content, True)
+        self.assertEqual(args.verify_archive, True)
+        self.assertEqual(args.dependency_archive, 'deps.par')
+        self.assertEqual(args.interpreter_flags,
+                         ['-S', '-X', 'frozen_modules=on'])
+        self.assertEqual(args.zygote, True)
+        self.assertEqual(args.freeze_modules, True)
+        self.assertEqual(args.frozen_modules, ['pkg', 'other.mod'])
+        self.assertEqual(args.bytecode_cache, True)
+        self.assertEqual(args.prefetch_modules, ['pkg.sub'])
+        self.assertEqual(args.prefetch_profile, True)
+        self.assertEqual(args.lazy_import_packages, ['big'])
+        self.assertEqual(args.dev_launcher, True)
+
+    def test_make_command_line_parser_from_param_file(self):
+        parser = cli.make_command_line_parser()
+        params = (b'--manifest_file\nbar\n--output_par\nbaz\n' +
+                  b'--stub_file\nquux\n--workspace_name\nwwwww\n' +
+                  b'--zip_safe\nTrue\n--import_root\nroot1\n')
+        with test_utils.temp_file(params) as param_file:
+            args = parser.parse_args(['@' + param_file.name, 'foo'])
+        self.assertEqual(args.manifest_file, 'bar')
+        self.assertEqual(args.output_par, 'baz')
+        self.assertEqual(args.workspace_name, 'wwwww')
+        self.assertEqual(args.import_roots, ['root1'])
+        self.assertEqual(args.main_filename, 'foo')
+
+    def test_make_command_line_parser_for_fragments(self):
+        parser = cli.make_command_line_parser()
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--zip_safe=True',
+            '--fragment_only=True',
+        ])
+        self.assertEqual(args.fragment_only, True)
+        self.assertEqual(args.main_filename, None)
+        self.assertEqual(args.stub_file, None)
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=True',
+            '--fragment=a.zip',
+            '--fragment=b.zip',
+            'foo',
+        ])
+        self.assertEqual(args.fragment_only, False)
+        self.assertEqual(args.fragments, ['a.zip', 'b.zip'])
+
+    def test_make_command_line_parser_for_layout_profile(self):
+        parser = cli.make_command_line_parser()
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            'foo',
+        ])
+        self.assertEqual(args.layout_profile, None)
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            '--layout_profile=profile.txt',
+            'foo',
+        ])
+        self.assertEqual(args.layout_profile, 'profile.txt')
+
+    def test_make_command_line_parser_for_prune_imports(self):
+        parser = cli.make_command_line_parser()
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            'foo',
+        ])
+        self.assertEqual(args.prune_imports, False)
+        self.assertEqual(args.keep_modules, [])
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            '--prune_imports=True',
+            '--keep_module=a.b',
+            '--keep_module=c.*',
+            '--prune_report=report.txt',
+            'foo',
+        ])
+        self.assertEqual(args.prune_imports, True)
+        self.assertEqual(args.keep_modules, ['a.b', 'c.*'])
+        self.assertEqual(args.prune_report, 'report.txt')
+
+    def test_make_command_line_parser_for_strip_elf(self):
+        parser = cli.make_command_line_parser()
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            'foo',
+        ])
+        self.assertEqual(args.strip_elf, False)
+        self.assertEqual(args.strip_tool, None)
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            '--strip_elf=True',
+            '--strip_tool=/usr/bin/strip',
+            '--elf_debug_dir=debug',
+            'foo',
+        ])
+        self.assertEqual(args.strip_elf, True)
+        self.assertEqual(args.strip_tool, '/usr/bin/strip')
+        self.assertEqual(args.elf_debug_dir, 'debug')
+
+    def test_make_command_line_parser_for_minify_sources(self):
+        parser = cli.make_command_line_parser()
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            'foo',
+        ])
+        self.assertEqual(args.minify_sources, False)
+        self.assertEqual(args.keep_docstrings, [])
+        self.assertEqual(args.pyc_interpreter, None)
+        self.assertEqual(args.pyc_optimize, -1)
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            '--minify_sources=True',
+            '--keep_docstrings=ws/docopt',
+            '--keep_docstrings=ws/grammar.py',
+            '--minify_report=report.txt',
+            '--pyc_interpreter=/usr/bin/python3',
+            '--pyc_optimize=2',
+            'foo',
+        ])
+        self.assertEqual(args.minify_sources, True)
+        self.assertEqual(args.keep_docstrings, ['ws/docopt', 'ws/grammar.py'])
+        self.assertEqual(args.minify_report, 'report.txt')
+        self.assertEqual(args.pyc_interpreter, '/usr/bin/python3')
+        self.assertEqual(args.pyc_optimize, 2)
+
+    def test_make_command_line_parser_for_build_report(self):
+        parser = cli.make_command_line_parser()
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            'foo',
+        ])
+        self.assertEqual(args.build_report, None)
+        args = parser.parse_args([
+            '--manifest_file=bar',
+            '--output_par=baz',
+            '--stub_file=quux',
+            '--zip_safe=False',
+            '--build_report=report.json',
+            'foo',
+        ])
+        self.assertEqual(args.build_report, 'report.json')
+
     def test_stub(self):
         valid_cases = [
             # Absolute path to interpreter
@@ -0,0 +1,275 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Make and apply patches between two versions of a .par file.
+
+.par files are built deterministically, so an entry that didn't
+change between two builds has exactly the same local header and
+compressed data in both.  We split the new file at entry boundaries,
+and each piece found anywhere in the old file is copied from it
+instead of being stored in the patch.  Everything else, including the
+central directory, is stored in the patch, compressed.
+
+The patch format is:
+
+    magic
+    SHA-256 of the old file, SHA-256 of the new file
+    size of the new file, number of operations
+    operations, each either
+      'C' offset length: copy bytes from the old file
+      'D' length compressed_length data: zlib compressed new bytes
+
+Applying a patch checks the digest of the old file first, and of the
+result before moving it into place, so the output is either
+byte-identical to the new file or not written at all.
+"""
+
+import argparse
+import collections
+import hashlib
+import os
+import struct
+import sys
+import tempfile
+import zlib
+
+from subpar.compiler import central_directory
+from subpar.compiler import error
+from subpar.compiler import python_archive
+
+_magic = b'SUBPAR-DELTA-1\n'
+_header = struct.Struct('<32s32sQQ')
+_copy_op = b'C'
+_data_op = b'D'
+_op_args = struct.Struct('<QQ')
+
+# Bytes to read at a time when hashing and copying
+_chunk_size = 1 << 20
+
+DiffStats = collections.namedtuple('DiffStats', [
+    'new_size',
+    'copied_size',
+    'patch_size',
+])
+
+
+def _copy_range(src, offset, length, write):
+    """Pass length bytes of src, starting at offset, to write()"""
+    src.seek(offset)
+    while length:
+        chunk = src.read(min(length, _chunk_size))
+        if not chunk:
+            raise error.Error('Unexpected end of file at offset %d' % (
+                src.tell()))
+        write(chunk)
+        length -= len(chunk)
+
+
+def _file_digest(f):
+    """Return the SHA-256 digest of a whole file"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    digest = hashlib.sha256()
+    _copy_range(f, 0, size, digest.update)
+    return digest.digest()
+
+
+def split(f):
+    """Split a .par file into pieces that change together.
+
+    Each piece is the data before the zip file, the local header and
+    data of one entry, or the central directory through the end of
+    the file.
+
+    Returns:
+        List of (offset, length), in file order
+
+    Raises:
+        Error, IOError
+    """
+    cd_start = central_directory.locate(f)[0]
+    boundaries = set(entry.header_offset
+                     for entry in central_directory.read(f))
+    f.seek(0, os.SEEK_END)
+    boundaries.update([0, cd_start, f.tell()])
+    boundaries = sorted(boundaries)
+    return [(start, end - start)
+            for start, end in zip(boundaries, boundaries[1:])]
+
+
+def _piece_digests(f, pieces):
+    for offset, length in pieces:
+        digest = hashlib.sha256()
+        _copy_range(f, offset, length, digest.update)
+        yield digest.digest()
+
+
+def _plan(old_file, new_file):
+    """Return a list of (old offset or None, new offset, length).
+
+    Pieces of the new file found in the old one have an old offset,
+    and adjacent pieces that are also adjacent in the old file are
+    merged.
+    """
+    old_offsets = {}
+    old_pieces = split(old_file)
+    for (offset, length), digest in zip(
+            old_pieces, _piece_digests(old_file, old_pieces)):
+        old_offsets.setdefault((digest, length), offset)
+
+    plan = []
+    new_pieces = split(new_file)
+    for (offset, length), digest in zip(
+            new_pieces, _piece_digests(new_file, new_pieces)):
+        old_offset = old_offsets.get((digest, length))
+        if plan and old_offset is not None and plan[-1][0] is not None:
+            last_old, last_new, last_length = plan[-1]
+            if last_old + last_length == old_offset:
+                plan[-1] = (last_old, last_new, last_length + length)
+                continue
+        plan.append((old_offset, offset, length))
+    return plan
+
+
+def diff(old_filename, new_filename, patch_filename):
+    """Write a patch that turns one .par file into another.
+
+    Returns:
+        DiffStats
+
+    Raises:
+        Error, IOError
+    """
+    with open(old_filename, 'rb') as old_file, \
+            open(new_filename, 'rb') as new_file, \
+            open(patch_filename, 'wb') as patch:
+        plan = _plan(old_file, new_file)
+        new_file.seek(0, os.SEEK_END)
+        new_size = new_file.tell()
+        patch.write(_magic)
+        patch.write(_header.pack(_file_digest(old_file),
+                                 _file_digest(new_file), new_size,
+                                 len(plan)))
+        copied_size = 0
+        for old_offset, new_offset, length in plan:
+            if old_offset is not None:
+                patch.write(_copy_op + _op_args.pack(old_offset, length))
+                copied_size += length
+            else:
+                new_file.seek(new_offset)
+                data = zlib.compress(new_file.read(length), 9)
+                patch.write(_data_op + _op_args.pack(length, len(data)))
+                patch.write(data)
+        return DiffStats(new_size, copied_size, patch.tell())
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise error.Error('Patch is truncated')
+    return data
+
+
+def apply_patch(old_filename, patch_filename, output_filename):
+    """Rebuild the new .par file from the old one and a patch.
+
+    The output is written to a temporary file, and only moved to
+    output_filename once its digest matches the one in the patch.
+
+    Raises:
+        Error, IOError
+    """
+    with open(old_filename, 'rb') as old_file, \
+            open(patch_filename, 'rb') as patch:
+        if patch.read(len(_magic)) != _magic:
+            raise error.Error('Not a .par patch: %s' % patch_filename)
+        old_digest, new_digest, new_size, op_count = _header.unpack(
+            _read_exactly(patch, _header.size))
+        if _file_digest(old_file) != old_digest:
+            raise error.Error('%s is not the file this patch was made from' %
+                              old_filename)
+
+        output_dir = os.path.dirname(os.path.abspath(output_filename))
+        output = tempfile.NamedTemporaryFile(dir=output_dir, delete=False)
+        try:
+            digest = hashlib.sha256()
+
+            def write(data):
+                output.write(data)
+                digest.update(data)
+
+            for _ in range(op_count):
+                op = _read_exactly(patch, 1)
+                first, second = _op_args.unpack(
+                    _read_exactly(patch, _op_args.size))
+                if op == _copy_op:
+                    _copy_range(old_file, first, second, write)
+                elif op == _data_op:
+                    data = zlib.decompress(_read_exactly(patch, second))
+                    if len(data) != first:
+                        raise error.Error('Patch is corrupt')
+                    write(data)
+                else:
+                    raise error.Error('Patch is corrupt')
+            size = output.tell()
+            output.close()
+            if size != new_size or digest.digest() != new_digest:
+                raise error.Error(
+                    'Patched file does not match the digest in the patch')
+            os.chmod(output.name, 0o0755)
+            # Python 2 doesn't have os.replace, see
+            # PythonArchive.create_final_from_temp()
+            os.rename(output.name, output_filename)
+        finally:
+            output.close()
+            python_archive.remove_if_present(output.name)
+
+
+def make_command_line_parser():
+    """Return an object that can parse this program's command line"""
+    parser = argparse.ArgumentParser(
+        description='Make or apply a patch between two .par files')
+    subparsers = parser.add_subparsers(dest='command')
+    diff_parser = subparsers.add_parser(
+        'diff', help='Write a patch from OLD to NEW')
+    diff_parser.add_argument('old', help='Previous version of the .par')
+    diff_parser.add_argument('new', help='New version of the .par')
+    diff_parser.add_argument('patch', help='Patch file to write')
+    apply_parser = subparsers.add_parser(
+        'apply', help='Rebuild NEW from OLD and a patch')
+    apply_parser.add_argument('old', help='Previous version of the .par')
+    apply_parser.add_argument('patch', help='Patch file made by diff')
+    apply_parser.add_argument('new', help='.par file to write')
+    return parser
+
+
+def main(argv):
+    """Command line interface to make and apply .par patches"""
+    parser = make_command_line_parser()
+    args = parser.parse_args(argv[1:])
+    try:
+        if args.command == 'diff':
+            stats = diff(args.old, args.new, args.patch)
+            sys.stdout.write(
+                'Copied %d of %d bytes from %s, patch is %d bytes\n' % (
+                    stats.copied_size, stats.new_size, args.old,
+                    stats.patch_size))
+        elif args.command == 'apply':
+            apply_patch(args.old, args.patch, args.new)
+        else:
+            parser.error('a command is required')
+    except (error.Error, IOError, OSError) as e:
+        sys.stderr.write('%s\n' % e)
+        return 1
+    return 0
@@ -0,0 +1,134 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+import zipfile
+
+from subpar.compiler import delta
+from subpar.compiler import error
+from subpar.compiler import test_utils
+
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = test_utils.mkdtemp()
+        self.old_filename = self._make_par('old.par', {
+            'a.py': b'a = 1\n' * 1000,
+            'b.py': b'b = 1\n' * 1000,
+            'c.py': b'c = 1\n' * 1000,
+        })
+        self.new_filename = self._make_par('new.par', {
+            'a.py': b'a = 1\n' * 1000,
+            'b.py': b'b = 2\n' * 1000,
+            'c.py': b'c = 1\n' * 1000,
+            'd.py': b'd = 1\n',
+        })
+        self.patch_filename = os.path.join(self.tmpdir, 'new.patch')
+        self.output_filename = os.path.join(self.tmpdir, 'output.par')
+
+    def _make_par(self, name, contents):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'wb') as f:
+            f.write(b'#!/usr/bin/env python\n')
+            z = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+            for stored_path in sorted(contents):
+                info = zipfile.ZipInfo(stored_path, (1980, 1, 1, 0, 0, 0))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                z.writestr(info, contents[stored_path])
+            z.close()
+        return filename
+
+    def _read(self, filename):
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def test_split(self):
+        with open(self.old_filename, 'rb') as f:
+            pieces = delta.split(f)
+        self.assertEqual(len(pieces), 5)
+        self.assertEqual(pieces[0], (0, len(b'#!/usr/bin/env python\n')))
+        for (offset, length), (next_offset, _) in zip(pieces, pieces[1:]):
+            self.assertEqual(offset + length, next_offset)
+        self.assertEqual(sum(length for _, length in pieces),
+                         os.path.getsize(self.old_filename))
+
+    def test_diff_and_apply(self):
+        stats = delta.diff(self.old_filename, self.new_filename,
+                           self.patch_filename)
+        new_content = self._read(self.new_filename)
+        self.assertEqual(stats.new_size, len(new_content))
+        self.assertGreater(stats.copied_size, 0)
+        self.assertEqual(stats.patch_size,
+                         os.path.getsize(self.patch_filename))
+        delta.apply_patch(self.old_filename, self.patch_filename,
+                          self.output_filename)
+        self.assertEqual(self._read(self.output_filename), new_content)
+        self.assertTrue(os.access(self.output_filename, os.X_OK))
+
+    def test_diff_identical(self):
+        stats = delta.diff(self.old_filename, self.old_filename,
+                           self.patch_filename)
+        self.assertEqual(stats.copied_size, stats.new_size)
+        delta.apply_patch(self.old_filename, self.patch_filename,
+                          self.output_filename)
+        self.assertEqual(self._read(self.output_filename),
+                         self._read(self.old_filename))
+
+    def test_apply_wrong_old_file(self):
+        delta.diff(self.old_filename, self.new_filename, self.patch_filename)
+        with self.assertRaises(error.Error):
+            delta.apply_patch(self.new_filename, self.patch_filename,
+                              self.output_filename)
+        self.assertFalse(os.path.exists(self.output_filename))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['new.par', 'new.patch', 'old.par'])
+
+    def test_apply_corrupt_patch(self):
+        delta.diff(self.old_filename, self.new_filename, self.patch_filename)
+        content = bytearray(self._read(self.patch_filename))
+        # Point the first copy at the wrong place in the old file
+        first_op = len(b'SUBPAR-DELTA-1\n') + 32 + 32 + 8 + 8
+        self.assertEqual(content[first_op:first_op + 1], b'C')
+        content[first_op + 1] += 1
+        with open(self.patch_filename, 'wb') as f:
+            f.write(bytes(content))
+        with self.assertRaises(error.Error):
+            delta.apply_patch(self.old_filename, self.patch_filename,
+                              self.output_filename)
+        self.assertFalse(os.path.exists(self.output_filename))
+
+        with open(self.patch_filename, 'wb') as f:
+            f.write(b'not a patch')
+        with self.assertRaises(error.Error):
+            delta.apply_patch(self.old_filename, self.patch_filename,
+                              self.output_filename)
+
+    def test_main(self):
+        self.assertEqual(delta.main([
+            'par_delta', 'diff', self.old_filename, self.new_filename,
+            self.patch_filename]), 0)
+        self.assertEqual(delta.main([
+            'par_delta', 'apply', self.old_filename, self.patch_filename,
+            self.output_filename]), 0)
+        self.assertEqual(self._read(self.output_filename),
+                         self._read(self.new_filename))
+        self.assertEqual(delta.main([
+            'par_delta', 'apply', self.new_filename, self.patch_filename,
+            self.output_filename]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,341 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remove debugging information from ELF shared libraries and executables.
+
+This is roughly equivalent to `strip --strip-debug` and
+`objcopy --only-keep-debug`, implemented in pure Python so that it
+works without binutils.  Only the layout that linkers actually produce
+is handled: the debug sections must not be part of any loadable
+segment.  Anything unusual is left alone.
+
+See: http://refspecs.linuxbase.org/elf/gabi4+/contents.html
+"""
+
+import struct
+
+_ELF_MAGIC = b'\x7fELF'
+
+# e_ident[EI_CLASS]
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+# e_ident[EI_DATA]
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+# e_type
+_ET_EXEC = 2
+_ET_DYN = 3
+# sh_type
+_SHT_SYMTAB = 2
+_SHT_STRTAB = 3
+_SHT_RELA = 4
+_SHT_NOTE = 7
+_SHT_NOBITS = 8
+_SHT_REL = 9
+_SHT_DYNSYM = 11
+_SHT_SYMTAB_SHNDX = 18
+# sh_flags
+_SHF_ALLOC = 0x2
+_SHF_INFO_LINK = 0x40
+# Section indices at or above this are special
+_SHN_LORESERVE = 0xff00
+
+# struct formats, without byte order, indexed by ELF class
+_ehdr_formats = {
+    _ELFCLASS32: '16sHHIIIIIHHHHHH',
+    _ELFCLASS64: '16sHHIQQQIHHHHHH',
+}
+_phdr_formats = {
+    # p_type, p_offset, p_vaddr, p_paddr, p_filesz, ...
+    _ELFCLASS32: 'IIIIIIII',
+    # p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, ...
+    _ELFCLASS64: 'IIQQQQQQ',
+}
+_shdr_formats = {
+    _ELFCLASS32: 'IIIIIIIIII',
+    _ELFCLASS64: 'IIQQQQIIQQ',
+}
+# Offset and struct format of st_shndx within a symbol table entry
+_sym_shndx = {
+    _ELFCLASS32: (14, 'H'),
+    _ELFCLASS64: (6, 'H'),
+}
+
+
+def is_elf(content):
+    """Return True if content looks like an ELF file"""
+    return content[:4] == _ELF_MAGIC
+
+
+def _is_debug_section(name, flags):
+    return ((name.startswith(b'.debug') or name.startswith(b'.zdebug')) and
+            not flags & _SHF_ALLOC)
+
+
+class _Section(object):
+    """One entry of the section header table"""
+
+    def __init__(self, fields):
+        (self.name_offset, self.type, self.flags, self.addr, self.offset,
+         self.size, self.link, self.info, self.addralign,
+         self.entsize) = fields
+        self.name = b''
+
+    def fields(self):
+        return (self.name_offset, self.type, self.flags, self.addr,
+                self.offset, self.size, self.link, self.info,
+                self.addralign, self.entsize)
+
+    def data(self, content):
+        if self.type == _SHT_NOBITS:
+            return b''
+        return content[self.offset:self.offset + self.size]
+
+
+class _Layout(object):
+    """Headers of an ELF file, and the sections to strip from it"""
+
+    def __init__(self, elf_class, order, ehdr, sections, removed,
+                 fixed_end):
+        self.elf_class = elf_class
+        self.order = order
+        self.ehdr_format = order + _ehdr_formats[elf_class]
+        self.shdr_format = order + _shdr_formats[elf_class]
+        # List of ELF header fields
+        self.ehdr = ehdr
+        # List of _Section
+        self.sections = sections
+        # Set of indices of debug sections
+        self.removed = removed
+        # End of the ELF header, program headers and loadable segments
+        self.fixed_end = fixed_end
+
+    def symbols(self, content, section):
+        """Yield (offset in section, st_shndx) for each symbol"""
+        sym_offset, sym_format = _sym_shndx[self.elf_class]
+        data = section.data(content)
+        entsize = section.entsize
+        if not entsize:
+            return
+        for pos in range(0, len(data) - entsize + 1, entsize):
+            shndx = struct.unpack_from(self.order + sym_format, data,
+                                       pos + sym_offset)[0]
+            yield pos, shndx
+
+    def finish(self, output):
+        """Append the section header table, and update the ELF header"""
+        align = 4 if self.elf_class == _ELFCLASS32 else 8
+        output.extend(b'\0' * (-len(output) % align))
+        self.ehdr[6] = len(output)
+        for section in self.sections:
+            output.extend(struct.pack(self.shdr_format, *section.fields()))
+        struct.pack_into(self.ehdr_format, output, 0, *self.ehdr)
+        return bytes(output)
+
+
+def _read_layout(content):
+    """Return the _Layout of an ELF file, or None if it isn't supported"""
+    if not is_elf(content) or len(content) < 64:
+        return None
+    elf_class = ord(content[4:5])
+    elf_data = ord(content[5:6])
+    if elf_class not in _ehdr_formats or elf_data not in (
+            _ELFDATA2LSB, _ELFDATA2MSB):
+        return None
+    order = '<' if elf_data == _ELFDATA2LSB else '>'
+    ehdr_format = order + _ehdr_formats[elf_class]
+    ehdr = list(struct.unpack_from(ehdr_format, content, 0))
+    (e_type, e_phoff, e_shoff, e_ehsize, e_phentsize, e_phnum, e_shentsize,
+     e_shnum, e_shstrndx) = (ehdr[1], ehdr[5], ehdr[6], ehdr[8], ehdr[9],
+                             ehdr[10], ehdr[11], ehdr[12], ehdr[13])
+    if e_type not in (_ET_EXEC, _ET_DYN):
+        return None
+    shdr_format = order + _shdr_formats[elf_class]
+    if (e_shoff == 0 or e_shnum == 0 or e_shnum >= _SHN_LORESERVE or
+            e_shstrndx == 0 or e_shstrndx >= e_shnum or
+            e_shentsize != struct.calcsize(shdr_format) or
+            e_shoff + e_shnum * e_shentsize > len(content)):
+        return None
+
+    # Read section headers and names
+    sections = [
+        _Section(struct.unpack_from(shdr_format, content,
+                                    e_shoff + i * e_shentsize))
+        for i in range(e_shnum)]
+    shstrtab = sections[e_shstrndx].data(content)
+    for section in sections:
+        end = shstrtab.find(b'\0', section.name_offset)
+        section.name = shstrtab[section.name_offset:end]
+        if section.type == _SHT_SYMTAB_SHNDX:
+            return None
+
+    # Choose sections to remove
+    removed = set(i for i, section in enumerate(sections)
+                  if i and _is_debug_section(section.name, section.flags))
+    for i, section in enumerate(sections):
+        if (section.type in (_SHT_REL, _SHT_RELA) and
+                section.info in removed and not section.flags & _SHF_ALLOC):
+            removed.add(i)
+    if not removed:
+        return None
+
+    # Everything up to the end of the last loadable segment stays
+    # exactly where it is.
+    fixed_end = max(e_ehsize, e_phoff + e_phnum * e_phentsize)
+    phdr_format = order + _phdr_formats[elf_class]
+    for i in range(e_phnum):
+        phdr = struct.unpack_from(phdr_format, content,
+                                  e_phoff + i * e_phentsize)
+        if elf_class == _ELFCLASS32:
+            p_offset, p_filesz = phdr[1], phdr[4]
+        else:
+            p_offset, p_filesz = phdr[2], phdr[5]
+        fixed_end = max(fixed_end, p_offset + p_filesz)
+    for i, section in enumerate(sections):
+        if i and section.offset < fixed_end:
+            if i in removed:
+                return None
+            if section.type != _SHT_NOBITS:
+                fixed_end = max(fixed_end, section.offset + section.size)
+    return _Layout(elf_class, order, ehdr, sections, removed, fixed_end)
+
+
+def strip_debug(content):
+    """Remove debug sections from an ELF file.
+
+    Symbols defined in the removed sections are removed from .symtab.
+
+    Args:
+        content: Bytes of an ELF file
+
+    Returns:
+        Stripped ELF file as bytes, or None if there was nothing to
+        remove or the file layout isn't supported.
+    """
+    layout = _read_layout(content)
+    if layout is None:
+        return None
+    sections = layout.sections
+    removed = layout.removed
+    fixed_end = layout.fixed_end
+
+    # Map old section indices to new ones
+    new_index = {}
+    for i in range(len(sections)):
+        if i not in removed:
+            new_index[i] = len(new_index)
+
+    def remap(index):
+        if index == 0 or index >= _SHN_LORESERVE:
+            return index
+        return new_index.get(index, 0)
+
+    # Symbols in .dynsym are in a loadable segment, so can't be
+    # rewritten.  Give up if any of them would need to be.
+    for section in sections:
+        if section.type == _SHT_DYNSYM:
+            for _, shndx in layout.symbols(content, section):
+                if remap(shndx) != shndx:
+                    return None
+
+    # Drop symbols of removed sections from .symtab.  That renumbers
+    # the symbols after them, so no remaining relocations may refer
+    # to it.
+    sym_offset, sym_format = _sym_shndx[layout.elf_class]
+    sym_format = layout.order + sym_format
+    symtabs = {}
+    for i, section in enumerate(sections):
+        if section.type != _SHT_SYMTAB or i in removed:
+            continue
+        data = section.data(content)
+        kept = bytearray()
+        local_count = 0
+        for pos, shndx in layout.symbols(content, section):
+            if shndx in removed:
+                continue
+            symbol = bytearray(data[pos:pos + section.entsize])
+            struct.pack_into(sym_format, symbol, sym_offset, remap(shndx))
+            kept.extend(symbol)
+            if pos // section.entsize < section.info:
+                local_count += 1
+        if len(kept) != len(data) and any(
+                other.type in (_SHT_REL, _SHT_RELA) and other.link == i
+                for j, other in enumerate(sections) if j not in removed):
+            return None
+        symtabs[i] = bytes(kept)
+        section.size = len(kept)
+        section.info = local_count
+
+    # Lay out the remaining sections after the fixed part
+    output = bytearray(content[:fixed_end])
+    for i, section in sorted(enumerate(sections), key=lambda s: s[1].offset):
+        if i == 0 or i in removed or section.offset < fixed_end:
+            continue
+        data = symtabs.get(i)
+        if data is None:
+            data = section.data(content)
+        if section.addralign > 1:
+            output.extend(b'\0' * (-len(output) % section.addralign))
+        section.offset = len(output)
+        output.extend(data)
+
+    # Write the new section header table
+    for section in sections:
+        section.link = remap(section.link)
+        if (section.type in (_SHT_REL, _SHT_RELA) or
+                section.flags & _SHF_INFO_LINK):
+            section.info = remap(section.info)
+    layout.sections = [section for i, section in enumerate(sections)
+                       if i not in removed]
+    layout.ehdr[12] = len(new_index)
+    layout.ehdr[13] = new_index[layout.ehdr[13]]
+    return layout.finish(output)
+
+
+def keep_debug(content):
+    """Return only the debugging information of an ELF file.
+
+    Like `objcopy --only-keep-debug`, the result has the same headers
+    and sections as the file, but only the data of the debug
+    sections, symbol and string tables and notes, such as the build
+    id.  The other sections become SHT_NOBITS.  Debuggers read it as
+    a separate debug file for the stripped one.
+
+    Args:
+        content: Bytes of an ELF file
+
+    Returns:
+        Bytes of the debug file, or None where strip_debug() would
+        return None.
+    """
+    layout = _read_layout(content)
+    if layout is None:
+        return None
+    ehdr = layout.ehdr
+    output = bytearray(content[:max(ehdr[8], ehdr[5] + ehdr[9] * ehdr[10])])
+    for i, section in sorted(enumerate(layout.sections),
+                             key=lambda s: s[1].offset):
+        if i == 0 or section.type == _SHT_NOBITS:
+            continue
+        if i in layout.removed or section.type in (
+                _SHT_SYMTAB, _SHT_STRTAB, _SHT_NOTE):
+            if section.addralign > 1:
+                output.extend(b'\0' * (-len(output) % section.addralign))
+            data = section.data(content)
+            section.offset = len(output)
+            output.extend(data)
+        else:
+            section.type = _SHT_NOBITS
+            section.offset = len(output)
+    return layout.finish(output)
@@ -0,0 +1,123 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import struct
+import unittest
+
+from subpar.compiler import elf
+from subpar.compiler import test_utils
+
+
+def _read_sections(content):
+    """Return a list of (name, type, data, link, info) for each section"""
+    is64 = content[4:5] == b'\x02'
+    order = '<' if content[5:6] == b'\x01' else '>'
+    ehdr_format = order + ('16sHHIQQQIHHHHHH' if is64 else '16sHHIIIIIHHHHHH')
+    shdr_format = order + ('IIQQQQIIQQ' if is64 else 'IIIIIIIIII')
+    ehdr = struct.unpack_from(ehdr_format, content, 0)
+    shoff, shentsize, shnum, shstrndx = ehdr[6], ehdr[11], ehdr[12], ehdr[13]
+    headers = [struct.unpack_from(shdr_format, content, shoff + i * shentsize)
+               for i in range(shnum)]
+    strtab_header = headers[shstrndx]
+    shstrtab = content[strtab_header[4]:strtab_header[4] + strtab_header[5]]
+    sections = []
+    for header in headers:
+        name = shstrtab[header[0]:shstrtab.find(b'\0', header[0])]
+        data = content[header[4]:header[4] + header[5]]
+        sections.append((name, header[1], data, header[6], header[7]))
+    return sections
+
+
+class ElfTest(unittest.TestCase):
+
+    def test_is_elf(self):
+        self.assertTrue(elf.is_elf(test_utils.make_elf(2, '<')))
+        self.assertFalse(elf.is_elf(b''))
+        self.assertFalse(elf.is_elf(b'#!/bin/sh\n'))
+
+    def _check_strip_debug(self, elf_class, order):
+        content = test_utils.make_elf(elf_class, order)
+        before = _read_sections(content)
+        self.assertEqual(before[2][0], b'.debug_info')
+
+        stripped = elf.strip_debug(content)
+        self.assertLess(len(stripped), len(content))
+        after = _read_sections(stripped)
+        names = [section[0] for section in after]
+        self.assertEqual(
+            names, [b'', b'.text', b'.symtab', b'.strtab', b'.shstrtab'])
+        # The loadable part of the file is untouched, apart from the
+        # section header fields of the ELF header
+        text = test_utils.ELF_TEXT
+        text_end = content.find(text) + len(text)
+        self.assertEqual(stripped[64:text_end], content[64:text_end])
+        self.assertEqual(after[1][2], text)
+        # .symtab links to .strtab at its new index
+        symtab = after[2]
+        self.assertEqual(symtab[3], 3)
+        # Symbol in .text stays, symbol in .debug_info is dropped, and
+        # the count of local symbols with it
+        entsize = len(before[4][2]) // 3
+        self.assertEqual(len(symtab[2]), 2 * entsize)
+        shndx_offset = 6 if elf_class == 2 else 14
+        shndxs = [struct.unpack_from(order + 'H', symtab[2],
+                                     i * entsize + shndx_offset)[0]
+                  for i in range(2)]
+        self.assertEqual(shndxs, [0, 1])
+        self.assertEqual(symtab[4], 2)
+        # Nothing left to do the second time
+        self.assertEqual(elf.strip_debug(stripped), None)
+
+    def test_strip_debug(self):
+        self._check_strip_debug(2, '<')
+        self._check_strip_debug(2, '>')
+        self._check_strip_debug(1, '<')
+        self._check_strip_debug(1, '>')
+
+    def _check_keep_debug(self, elf_class, order):
+        content = test_utils.make_elf(elf_class, order)
+        before = _read_sections(content)
+        debug = elf.keep_debug(content)
+        after = _read_sections(debug)
+        # Same sections, at the same indices
+        self.assertEqual([section[0] for section in after],
+                         [section[0] for section in before])
+        # Code is left out, debug sections and symbols are kept
+        self.assertNotIn(test_utils.ELF_TEXT, debug)
+        self.assertEqual(after[1][1], 8)
+        for i in (2, 3, 4, 5, 6):
+            self.assertEqual(after[i][1:], before[i][1:])
+        self.assertEqual(after[2][2], test_utils.ELF_DEBUG_INFO)
+
+    def test_keep_debug(self):
+        self._check_keep_debug(2, '<')
+        self._check_keep_debug(2, '>')
+        self._check_keep_debug(1, '<')
+        self._check_keep_debug(1, '>')
+        self.assertEqual(elf.keep_debug(b'\0' * 100), None)
+
+    def test_strip_debug_unsupported(self):
+        # Not ELF
+        self.assertEqual(elf.strip_debug(b'\0' * 100), None)
+        # Truncated
+        content = test_utils.make_elf(2, '<')
+        self.assertEqual(elf.strip_debug(content[:200]), None)
+        # Relocatable object files are left alone
+        relocatable = bytearray(content)
+        struct.pack_into('<H', relocatable, 16, 1)
+        self.assertEqual(elf.strip_debug(bytes(relocatable)), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
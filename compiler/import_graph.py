@@ -0,0 +1,265 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Find the Python modules in a .par file that can actually be imported.
+
+We parse every bundled Python source file, collect the modules it
+imports, and follow those imports starting from __main__.py and any
+declared dynamic-import roots.  Modules that are never reached can be
+left out of the archive.
+
+The analysis is deliberately conservative:
+
+* Every import statement counts, including ones inside functions and
+  try/except blocks.
+* `importlib.import_module()` and `__import__()` calls with a string
+  literal argument count as imports.
+* `from package import *` reaches every direct submodule of package.
+* A module name that can be found under more than one import root
+  reaches all of the candidate files.
+* Files that aren't Python source, and sources that have no module
+  name under any import root, are never dropped.
+
+Imports computed at runtime can't be seen, so modules loaded that way
+must be declared as roots.
+"""
+
+import ast
+import re
+
+# Fallback for sources that the compiling interpreter can't parse
+_import_regex = re.compile(r"""
+    ^\s*
+    (?:
+        from\s+(?P<from>[.\w]+)\s+import\s+
+        (?P<names>\([^)]*\)|(?:\\\r?\n|[^#\r\n])+) |
+        import\s+(?P<imports>(?:\\\r?\n|[^#\r\n])+)
+    )""", re.MULTILINE | re.VERBOSE)
+_identifier_regex = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_dynamic_import_functions = ('import_module', '__import__')
+
+
+def module_name(stored_path, import_root):
+    """Return (module name, is_package) for a source file, or None.
+
+    Args:
+        stored_path: Path of a .py file inside the archive
+        import_root: Directory inside the archive, '' for the top level
+    """
+    if not stored_path.endswith('.py'):
+        return None
+    if import_root:
+        if not stored_path.startswith(import_root + '/'):
+            return None
+        stored_path = stored_path[len(import_root) + 1:]
+    parts = stored_path[:-len('.py')].split('/')
+    is_package = parts[-1] == '__init__'
+    if is_package:
+        parts = parts[:-1]
+    if not parts or not all(_identifier_regex.match(p) for p in parts):
+        return None
+    return '.'.join(parts), is_package
+
+
+def _parents(name):
+    """Yield name and every enclosing package name of a dotted name."""
+    parts = name.split('.')
+    for i in range(1, len(parts) + 1):
+        yield '.'.join(parts[:i])
+
+
+def _resolve_relative(module, is_package, level, name):
+    """Resolve a relative import like `from ..name import x`"""
+    package = module.split('.') if is_package else module.split('.')[:-1]
+    if level > 1:
+        package = package[:-(level - 1)]
+    if name:
+        package.append(name)
+    return '.'.join(package)
+
+
+def _imports_from_ast(tree, module, is_package):
+    """Return (imported module names, star-imported package names)"""
+    imports = set()
+    star_imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.add(alias.name)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = _resolve_relative(
+                    module, is_package, node.level, node.module)
+            else:
+                base = node.module
+            if not base:
+                continue
+            imports.add(base)
+            for alias in node.names:
+                if alias.name == '*':
+                    star_imports.add(base)
+                else:
+                    imports.add(base + '.' + alias.name)
+        elif isinstance(node, ast.Call) and node.args:
+            func = node.func
+            func_name = (getattr(func, 'attr', None) or
+                         getattr(func, 'id', None))
+            if func_name in _dynamic_import_functions:
+                name = _string_literal(node.args[0])
+                if name:
+                    imports.add(name)
+    return imports, star_imports
+
+
+def _string_literal(node):
+    """Return the value of a string literal node, else None"""
+    node_type = type(node).__name__
+    if node_type == 'Constant':
+        value = node.value
+    elif node_type == 'Str':
+        value = node.s
+    else:
+        return None
+    return value if isinstance(value, str) else None
+
+
+def _first_word(text):
+    """Return the module name from text like ' (foo as bar'"""
+    words = text.strip('()\\ \t\r\n').split()
+    return words[0] if words else ''
+
+
+def _imports_from_regex(source, module, is_package):
+    """Like _imports_from_ast(), for sources we can't parse"""
+    imports = set()
+    star_imports = set()
+    for match in _import_regex.finditer(source):
+        if match.group('from'):
+            base = match.group('from')
+            level = len(base) - len(base.lstrip('.'))
+            if level:
+                base = _resolve_relative(
+                    module, is_package, level, base.lstrip('.'))
+            if not base:
+                continue
+            imports.add(base)
+            for name in match.group('names').split(','):
+                name = _first_word(name)
+                if name == '*':
+                    star_imports.add(base)
+                elif name:
+                    imports.add(base + '.' + name)
+        else:
+            for name in match.group('imports').split(','):
+                name = _first_word(name)
+                if name:
+                    imports.add(name)
+    return imports, star_imports
+
+
+def find_imports(source, module, is_package):
+    """Find the modules imported by some Python source.
+
+    Args:
+        source: Python source code as bytes
+        module: Dotted name of the module
+        is_package: True if the source is a package's __init__.py
+
+    Returns:
+        (set of module names, set of star-imported package names)
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError, TypeError, RuntimeError):
+        # We don't know the encoding, see PythonArchive.generate_main()
+        text = source.decode('latin-1')
+        return _imports_from_regex(text, module, is_package)
+    return _imports_from_ast(tree, module, is_package)
+
+
+class ImportGraph(object):
+    """Import relationships between the Python sources in an archive.
+
+    Args:
+        sources: dict of stored_path to a function returning the
+            content of that file as bytes
+        import_roots: List of directories inside the archive that are
+            added to sys.path at runtime, not including the top level
+    """
+
+    def __init__(self, sources, import_roots):
+        # Module name to list of stored paths
+        self.modules = {}
+        # Stored path to (module name, is_package) for each stored path
+        self.names = {}
+        for stored_path in sorted(sources):
+            for import_root in [''] + list(import_roots):
+                name_info = module_name(stored_path, import_root)
+                if name_info is None:
+                    continue
+                self.modules.setdefault(name_info[0], []).append(stored_path)
+                # The first import root that matches defines the
+                # name used to resolve relative imports.
+                self.names.setdefault(stored_path, name_info)
+        self.sources = sources
+
+    def _submodules(self, package):
+        prefix = package + '.'
+        return [name for name in self.modules
+                if name.startswith(prefix) and '.' not in name[len(prefix):]]
+
+    def reachable(self, root_paths, root_modules):
+        """Return the set of stored paths reachable from the given roots.
+
+        Args:
+            root_paths: Stored paths of sources that are always run,
+                like __main__.py
+            root_modules: Module names that are imported dynamically.
+                A name ending in '.*' means every module in that
+                package.
+        """
+        reached_paths = set()
+        pending_paths = list(root_paths)
+        pending_names = []
+        for root_module in root_modules:
+            if root_module.endswith('.*'):
+                prefix = root_module[:-len('*')]
+                pending_names.append(prefix[:-1])
+                pending_names.extend(
+                    name for name in self.modules if name.startswith(prefix))
+            else:
+                pending_names.append(root_module)
+
+        while pending_paths or pending_names:
+            while pending_names:
+                name = pending_names.pop()
+                for parent in _parents(name):
+                    for stored_path in self.modules.get(parent, []):
+                        if stored_path not in reached_paths:
+                            pending_paths.append(stored_path)
+            if not pending_paths:
+                continue
+            stored_path = pending_paths.pop()
+            if stored_path in reached_paths:
+                continue
+            reached_paths.add(stored_path)
+
+            module, is_package = self.names.get(
+                stored_path, (stored_path[:-len('.py')], False))
+            imports, star_imports = find_imports(
+                self.sources[stored_path](), module, is_package)
+            pending_names.extend(imports)
+            for package in star_imports:
+                pending_names.extend(self._submodules(package))
+        return reached_paths
@@ -0,0 +1,97 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from subpar.compiler import import_graph
+
+
+class ImportGraphTest(unittest.TestCase):
+
+    def test_module_name(self):
+        cases = [
+            ('foo.py', '', ('foo', False)),
+            ('foo/__init__.py', '', ('foo', True)),
+            ('ws/foo/bar.py', 'ws', ('foo.bar', False)),
+            ('ws/foo/bar.py', '', ('ws.foo.bar', False)),
+            ('ws/foo/bar.py', 'other', None),
+            ('ws/foo/bar.txt', 'ws', None),
+            ('ws/foo-1.0/bar.py', 'ws', None),
+            ('ws/__init__.py', 'ws', None),
+        ]
+        for stored_path, import_root, expected in cases:
+            self.assertEqual(
+                import_graph.module_name(stored_path, import_root), expected,
+                (stored_path, import_root))
+
+    def test_find_imports(self):
+        source = b'''
+import a, b.c as d
+from e import f, g as h
+from .i import j
+from .. import k
+from l import *
+import importlib
+importlib.import_module('m.n')
+def func():
+    import o
+'''
+        imports, star_imports = import_graph.find_imports(
+            source, 'p.q.r', False)
+        self.assertEqual(imports, set([
+            'a', 'b.c', 'e', 'e.f', 'e.g', 'p.q.i', 'p.q.i.j', 'p', 'p.k',
+            'l', 'importlib', 'm.n', 'o']))
+        self.assertEqual(star_imports, set(['l']))
+
+    def test_find_imports_package(self):
+        imports, _ = import_graph.find_imports(
+            b'from . import a\n', 'p.q', True)
+        self.assertEqual(imports, set(['p.q', 'p.q.a']))
+
+    def test_find_imports_syntax_error(self):
+        source = b'''
+import a, b.c as d
+from e import (f,
+    g)
+print "not valid python 3" if True else ``
+'''
+        imports, _ = import_graph.find_imports(source, 'p', False)
+        self.assertEqual(imports, set(['a', 'b.c', 'e', 'e.f', 'e.g']))
+
+    def test_reachable(self):
+        sources = {
+            '__main__.py': b'import ws_lib.used\n',
+            'ws/ws_lib/__init__.py': b'',
+            'ws/ws_lib/used.py': b'from . import helper\n',
+            'ws/ws_lib/helper.py': b'',
+            'ws/ws_lib/unused.py': b'import ws_lib.unused_helper\n',
+            'ws/ws_lib/unused_helper.py': b'',
+            'ws/plugins/__init__.py': b'',
+            'ws/plugins/plugin_a.py': b'',
+            'ws/dynamic.py': b'',
+        }
+        graph = import_graph.ImportGraph(
+            dict((k, lambda v=v: v) for k, v in sources.items()), ['ws'])
+        self.assertEqual(
+            graph.reachable(['__main__.py'], []),
+            set(['__main__.py', 'ws/ws_lib/__init__.py', 'ws/ws_lib/used.py',
+                 'ws/ws_lib/helper.py']))
+        self.assertEqual(
+            graph.reachable([], ['dynamic', 'plugins.*']),
+            set(['ws/dynamic.py', 'ws/plugins/__init__.py',
+                 'ws/plugins/plugin_a.py']))
+
+
+if __name__ == '__main__':
+    unittest.main()
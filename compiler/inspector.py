@@ -0,0 +1,278 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Show what takes up space in an existing .par file.
+
+Only the central directory and __main__.py are read, so this is fast
+even for very large archives, and nothing is extracted.
+"""
+
+import argparse
+import ast
+import collections
+import heapq
+import operator
+import re
+import sys
+
+from subpar.compiler import central_directory
+from subpar.compiler import error
+
+# Line of __main__.py holding the runtime settings, see
+# PythonArchive.generate_boilerplate()
+_setup_prefix = '_.setup('
+
+# Start of a .par file whose interpreter needs several arguments, see
+# python_archive.generate_bootstrap()
+_shell_bootstrap_line = b'#!/bin/sh'
+_shell_exec_regex = re.compile(br'^exec (.*) "\$0" "\$@"$')
+
+# Entries to list for each group of duplicates
+_max_group_entries = 5
+
+
+def read_interpreter(f):
+    """Return the interpreter command that runs a .par, or None"""
+    f.seek(0)
+    first_line = f.readline(4096)
+    if not first_line.startswith(b'#!'):
+        return None
+    if first_line.rstrip() == _shell_bootstrap_line:
+        match = _shell_exec_regex.match(f.readline(4096))
+        if match:
+            return match.group(1).decode('latin-1')
+    return first_line[2:].strip().decode('latin-1')
+
+
+def parse_setup_args(main_content):
+    """Return the keyword arguments of the boilerplate's setup() call.
+
+    Args:
+        main_content: Content of __main__.py as bytes
+
+    Returns:
+        dict of argument name to value, or None if there's no
+        boilerplate
+    """
+    text = main_content.decode('latin-1')
+    for line in text.splitlines():
+        if not line.startswith(_setup_prefix):
+            continue
+        try:
+            call = ast.parse(line.strip()).body[0].value
+            return dict((keyword.arg, ast.literal_eval(keyword.value))
+                        for keyword in call.keywords)
+        except (SyntaxError, ValueError, AttributeError, IndexError):
+            return None
+    return None
+
+
+def _ratio(compress_size, file_size):
+    return float(compress_size) / file_size if file_size else 1.0
+
+
+def size_tree(entries, depth):
+    """Sum entry sizes by directory.
+
+    Args:
+        entries: List of central_directory.Entry
+        depth: Number of directory levels to report
+
+    Returns:
+        dict of directory path to [entry count, size, compressed size].
+        '' is the whole archive.
+    """
+    # Sum by directory first, since there are far fewer of them
+    by_directory = {}
+    for filename, _, _, compress_size, file_size, _ in entries:
+        directory = filename.rpartition('/')[0]
+        totals = by_directory.get(directory)
+        if totals is None:
+            totals = by_directory[directory] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += file_size
+        totals[2] += compress_size
+
+    tree = {}
+    for directory, (count, size, compress_size) in by_directory.items():
+        parts = directory.split('/')[:depth] if directory else []
+        for i in range(len(parts) + 1):
+            key = '/'.join(parts[:i])
+            totals = tree.get(key)
+            if totals is None:
+                totals = tree[key] = [0, 0, 0]
+            totals[0] += count
+            totals[1] += size
+            totals[2] += compress_size
+    return tree
+
+
+def largest_entries(entries, count):
+    """Return the count largest entries, by uncompressed size"""
+    largest = heapq.nlargest(count, entries,
+                             key=operator.attrgetter('file_size'))
+    return sorted(largest, key=lambda e: (-e.file_size, e.filename))
+
+
+def duplicate_groups(entries):
+    """Find entries that likely have identical content.
+
+    Entries are grouped by CRC and size, so this may rarely report
+    entries that are actually different.  Empty files are ignored.
+
+    Returns:
+        List of lists of entries, most wasted space first
+    """
+    counts = collections.Counter(zip(
+        map(operator.attrgetter('crc'), entries),
+        map(operator.attrgetter('file_size'), entries)))
+    groups = {}
+    for entry in entries:
+        key = (entry[2], entry[4])
+        if counts[key] > 1 and key[1]:
+            groups.setdefault(key, []).append(entry)
+    return sorted(groups.values(), key=lambda group: (
+        -(len(group) - 1) * group[0].compress_size, group[0].filename))
+
+
+def _format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            break
+        size /= 1024.0
+    if unit == 'B':
+        return '%d B' % size
+    return '%.1f %s' % (size, unit)
+
+
+def _print_tree(out, tree, min_fraction):
+    total_size = tree[''][1] or 1
+    children = {}
+    for key in tree:
+        if key:
+            parent = key.rsplit('/', 1)[0] if '/' in key else ''
+            children.setdefault(parent, []).append(key)
+
+    def visit(key, indent):
+        count, size, compress_size = tree[key]
+        name = key.rsplit('/', 1)[-1] if key else '(all)'
+        out.write('%10s %10s %5.1f%% %8d  %s%s\n' % (
+            _format_size(size), _format_size(compress_size),
+            100 * _ratio(compress_size, size), count, '  ' * indent, name))
+        for child in sorted(children.get(key, []),
+                            key=lambda k: (-tree[k][1], k)):
+            if float(tree[child][1]) / total_size >= min_fraction:
+                visit(child, indent + 1)
+
+    out.write('%10s %10s %6s %8s  %s\n' % (
+        'size', 'stored', 'ratio', 'entries', 'directory'))
+    visit('', 0)
+
+
+def inspect(filename, out, depth=2, top=20, min_fraction=0.01):
+    """Print a summary of a .par file.
+
+    Raises:
+        Error, IOError
+    """
+    with open(filename, 'rb') as f:
+        interpreter = read_interpreter(f)
+        entries = central_directory.read(f)
+        main_entry = None
+        for entry in entries:
+            if entry.filename == '__main__.py':
+                main_entry = entry
+                break
+        setup_args = None
+        if main_entry is not None:
+            setup_args = parse_setup_args(
+                central_directory.read_entry(f, main_entry))
+
+    out.write('%s\n' % filename)
+    out.write('  interpreter: %s\n' % interpreter)
+    if setup_args is None:
+        out.write('  no subpar boilerplate in __main__.py\n')
+    else:
+        for name in sorted(setup_args):
+            out.write('  %s: %r\n' % (name, setup_args[name]))
+    file_size = sum(map(operator.attrgetter('file_size'), entries))
+    compress_size = sum(map(operator.attrgetter('compress_size'), entries))
+    out.write('  %d entries, %s, stored in %s (%.1f%%)\n' % (
+        len(entries), _format_size(file_size), _format_size(compress_size),
+        100 * _ratio(compress_size, file_size)))
+
+    out.write('\nSize by directory:\n')
+    _print_tree(out, size_tree(entries, depth), min_fraction)
+
+    out.write('\nLargest entries:\n')
+    for entry in largest_entries(entries, top):
+        out.write('%10s %10s %5.1f%%  %s\n' % (
+            _format_size(entry.file_size), _format_size(entry.compress_size),
+            100 * _ratio(entry.compress_size, entry.file_size),
+            entry.filename))
+
+    out.write('\nDuplicate content:\n')
+    groups = duplicate_groups(entries)
+    if not groups:
+        out.write('  none\n')
+    for group in groups[:top]:
+        wasted = (len(group) - 1) * group[0].compress_size
+        out.write('  %d copies of %s, %s wasted:\n' % (
+            len(group), _format_size(group[0].file_size),
+            _format_size(wasted)))
+        for entry in group[:_max_group_entries]:
+            out.write('    %s\n' % entry.filename)
+        if len(group) > _max_group_entries:
+            out.write('    ... and %d more\n' % (
+                len(group) - _max_group_entries))
+    if len(groups) > top:
+        out.write('  ... and %d more groups\n' % (len(groups) - top))
+
+
+def make_command_line_parser():
+    """Return an object that can parse this program's command line"""
+    parser = argparse.ArgumentParser(
+        description='Show what takes up space in a .par file')
+    parser.add_argument(
+        'par_filename',
+        help='.par file to inspect')
+    parser.add_argument(
+        '--depth',
+        help='Number of directory levels to show sizes for',
+        type=int,
+        default=2)
+    parser.add_argument(
+        '--top',
+        help='Number of largest entries and duplicate groups to show',
+        type=int,
+        default=20)
+    parser.add_argument(
+        '--min_fraction',
+        help='Hide directories smaller than this fraction of the total',
+        type=float,
+        default=0.01)
+    return parser
+
+
+def main(argv):
+    """Command line interface to inspect a .par file"""
+    parser = make_command_line_parser()
+    args = parser.parse_args(argv[1:])
+    try:
+        inspect(args.par_filename, sys.stdout, depth=args.depth,
+                top=args.top, min_fraction=args.min_fraction)
+    except (error.Error, IOError) as e:
+        sys.stderr.write('%s: %s\n' % (args.par_filename, e))
+        return 1
+    return 0
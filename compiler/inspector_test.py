@@ -0,0 +1,116 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import unittest
+import zipfile
+
+from subpar.compiler import central_directory
+from subpar.compiler import inspector
+from subpar.compiler import test_utils
+
+_main = b'''\
+from __future__ import print_function
+# Boilerplate added by subpar/compiler/python_archive.py
+from subpar.runtime import support as _
+_.setup(import_roots=['ws', 'ws/lib'], zip_safe=True)
+del _
+# End boilerplate
+print('hello')
+'''
+
+
+class _Output(object):
+    """Collects text written, on both Python 2 and 3"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+
+class InspectorTest(unittest.TestCase):
+
+    def _make_par(self):
+        par_filename = os.path.join(test_utils.mkdtemp(), 'test.par')
+        with open(par_filename, 'wb') as f:
+            f.write(b'#!/usr/bin/env python3\n')
+            z = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+            z.writestr('__main__.py', _main)
+            z.writestr('ws/lib/big.py', b'x = 1\n' * 1000)
+            z.writestr('ws/lib/copy1.dat', b'same' * 10)
+            z.writestr('ws/other/copy2.dat', b'same' * 10)
+            z.writestr('ws/lib/__init__.py', b'')
+            z.writestr('ws/other/__init__.py', b'')
+            z.close()
+        return par_filename
+
+    def test_parse_setup_args(self):
+        self.assertEqual(inspector.parse_setup_args(_main), {
+            'import_roots': ['ws', 'ws/lib'],
+            'zip_safe': True,
+        })
+        self.assertEqual(inspector.parse_setup_args(b'print(1)\n'), None)
+        self.assertEqual(inspector.parse_setup_args(b'_.setup(x=f())\n'),
+                         None)
+
+    def test_read_interpreter(self):
+        self.assertEqual(inspector.read_interpreter(
+            io.BytesIO(b'#!/usr/bin/python -S\nPK')), '/usr/bin/python -S')
+        self.assertEqual(inspector.read_interpreter(io.BytesIO(b'PK')), None)
+        self.assertEqual(inspector.read_interpreter(io.BytesIO(
+            b'#!/bin/sh\nexec /usr/bin/env python3 -S -E "$0" "$@"\nPK')),
+            '/usr/bin/env python3 -S -E')
+
+    def test_analysis(self):
+        with open(self._make_par(), 'rb') as f:
+            entries = central_directory.read(f)
+        tree = inspector.size_tree(entries, 1)
+        self.assertEqual(sorted(tree), ['', 'ws'])
+        self.assertEqual(tree['ws'][0], 5)
+        tree = inspector.size_tree(entries, 2)
+        self.assertEqual(sorted(tree), ['', 'ws', 'ws/lib', 'ws/other'])
+        self.assertEqual(tree['ws/lib'][:2], [3, 6040])
+        self.assertEqual(tree[''][0], 6)
+
+        largest = inspector.largest_entries(entries, 2)
+        self.assertEqual([e.filename for e in largest],
+                         ['ws/lib/big.py', '__main__.py'])
+
+        groups = inspector.duplicate_groups(entries)
+        self.assertEqual([[e.filename for e in group] for group in groups],
+                         [['ws/lib/copy1.dat', 'ws/other/copy2.dat']])
+
+    def test_inspect(self):
+        par_filename = self._make_par()
+        out = _Output()
+        inspector.inspect(par_filename, out)
+        output = ''.join(out.parts)
+        self.assertIn('interpreter: /usr/bin/env python3\n', output)
+        self.assertIn("import_roots: ['ws', 'ws/lib']\n", output)
+        self.assertIn('zip_safe: True\n', output)
+        self.assertIn('6 entries', output)
+        self.assertIn('  ws/lib/big.py\n', output)
+        self.assertIn('2 copies of 40 B', output)
+
+    def test_main(self):
+        self.assertEqual(inspector.main(
+            ['inspect_par', os.path.join(test_utils.mkdtemp(), 'missing')]),
+            1)
+
+
+if __name__ == '__main__':
+    unittest.main()
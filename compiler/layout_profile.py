@@ -0,0 +1,55 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Read layout profiles.
+
+A layout profile lists the stored paths of a .par file in the order
+they were first accessed during a training run, one per line.  Blank
+lines and lines starting with '#' are ignored.
+
+The stored path is the last space-separated field of each line, so
+an access trace written by the runtime (see
+subpar/runtime/access_trace.py) can be used as a profile directly.
+
+We assume layout profiles are utf-8 encoded.
+
+"""
+import io
+
+
+def parse(profile_filename):
+    """Parse a layout profile.
+
+    Args:
+        profile_filename: Path to profile file
+
+    Returns:
+        list of stored_paths, in first-access order, without duplicates
+
+    Raises:
+        IOError, SystemError
+
+    """
+    stored_paths = []
+    seen = set()
+    with io.open(profile_filename, 'rt', encoding='utf8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            stored_path = line.split(' ')[-1]
+            if stored_path not in seen:
+                seen.add(stored_path)
+                stored_paths.append(stored_path)
+    return stored_paths
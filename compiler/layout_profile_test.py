@@ -0,0 +1,64 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from subpar.compiler import layout_profile
+from subpar.compiler import test_utils
+
+
+class LayoutProfileTest(unittest.TestCase):
+
+    def test_parse(self):
+        content = (
+            b'# comment\n' +
+            b'__main__.py\n' +
+            b'\n' +
+            b'subpar/runtime/support.py\n' +
+            # Repeated access
+            b'__main__.py\n' +
+            b'  ccccc/ddddd.py  \n'
+        )
+        expected = [
+            '__main__.py',
+            'subpar/runtime/support.py',
+            'ccccc/ddddd.py',
+        ]
+        with test_utils.temp_file(content) as t:
+            self.assertEqual(layout_profile.parse(t.name), expected)
+
+    def test_parse_access_trace(self):
+        content = (
+            b'# subpar access trace for /tmp/foo.par\n' +
+            b'0.000000 import __main__.py\n' +
+            b'0.001000 import ccccc/__init__.py\n' +
+            b'0.002000 data ccccc/data.txt\n' +
+            b'0.003000 data ccccc/data.txt\n' +
+            b'# untouched 10 8 ccccc/eeeee.py\n'
+        )
+        expected = [
+            '__main__.py',
+            'ccccc/__init__.py',
+            'ccccc/data.txt',
+        ]
+        with test_utils.temp_file(content) as t:
+            self.assertEqual(layout_profile.parse(t.name), expected)
+
+    def test_parse_empty(self):
+        with test_utils.temp_file(b'') as t:
+            self.assertEqual(layout_profile.parse(t.name), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
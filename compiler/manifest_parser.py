@@ -25,11 +25,34 @@ import io
 from subpar.compiler import error
 
 
-def parse(manifest_filename):
+def stored_path_for(short_path, workspace_name):
+    """Return the path in the .par file for a runfiles short path.
+
+    Files from the main workspace are stored under the workspace name,
+    and files from external workspaces under their own workspace name.
+    """
+    if short_path.startswith('../'):
+        # External workspace, for example
+        # '../protobuf/python/google/protobuf/any_pb2.py'
+        return short_path[len('../'):]
+    elif short_path.startswith('external/'):
+        # External workspace, for example
+        # 'external/protobuf/python/__init__.py'
+        return short_path[len('external/'):]
+    else:
+        # Main workspace, for example 'mypackage/main.py'
+        return workspace_name + '/' + short_path
+
+
+def parse(manifest_filename, workspace_name=None):
     """Parse a Bazel manifest file.
 
     Args:
         manifest_filename: Path to file created by Bazel
+        workspace_name: If set, the manifest lists runfiles short
+            paths rather than stored paths, and a path listed more
+            than once takes the last value given.  See
+            stored_path_for().
 
     Returns:
         dictionary: key is stored_path, value is local_path.
@@ -64,8 +87,10 @@ def parse(manifest_filename):
                 raise error.Error('Syntax error at line %d in [%s]: %s' %
                                   (lineno, manifest_filename, repr(line)))
 
+            if workspace_name is not None:
+                stored_path = stored_path_for(stored_path, workspace_name)
             # Ensure no collisions
-            if stored_path in manifest:
+            elif stored_path in manifest:
                 raise error.Error(
                     ('Configuration error at line %d in [%s]: file [%s] '
                      'specified more than once') %
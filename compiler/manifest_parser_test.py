@@ -39,6 +39,25 @@ class ManifestTest(unittest.TestCase):
             manifest = manifest_parser.parse(t.name)
             self.assertEqual(manifest, expected)
 
+    def test_parse_manifest_workspace_name(self):
+        valid = (
+            b'ccccc/__init__.py\n' +
+            b'ccccc/ddddd.py bazel-out/bin/ccccc/ddddd.py\n' +
+            b'../protobuf/python/__init__.py\n' +
+            b'external/six/six.py external/six/six.py\n' +
+            # Repeated name, later entries win
+            b'ccccc/__init__.py ccccc/__init__.py\n'
+        )
+        expected = {
+            'wwwww/ccccc/__init__.py': 'ccccc/__init__.py',
+            'wwwww/ccccc/ddddd.py': 'bazel-out/bin/ccccc/ddddd.py',
+            'protobuf/python/__init__.py': None,
+            'six/six.py': 'external/six/six.py',
+        }
+        with test_utils.temp_file(valid) as t:
+            manifest = manifest_parser.parse(t.name, workspace_name='wwwww')
+            self.assertEqual(manifest, expected)
+
     def test_parse_manifest_invalid(self):
         invalids = [
             # Repeated name
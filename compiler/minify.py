@@ -0,0 +1,202 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Remove comments, docstrings and assert statements from Python source.
+
+The result behaves like the original run under `python -OO`.  Every
+line stays where it was, so line numbers in tracebacks are unchanged.
+
+We work on tokens rather than a syntax tree, so that sources written
+for a different Python version than the one running the compiler can
+still be handled.  Only simple, unambiguous cases are rewritten:
+
+* Comments are removed, except a #! line and the encoding declaration.
+* A docstring is removed when it is the first statement of a module,
+  or of a class or function whose body starts on a new line.  Inside a
+  class or function, it is replaced by `pass`.
+* An assert statement is replaced by `pass` when it is a logical line
+  by itself.
+
+Docstrings are kept in any file that mentions `__doc__`.  Some code
+reads docstrings of other modules (e.g. docopt, PLY grammars), so
+those must be listed explicitly by the caller.
+
+If the source can't be tokenized, or the result fails to parse where
+the original didn't, the original source is returned unchanged.
+"""
+
+import ast
+import functools
+import re
+import tokenize
+
+# See https://www.python.org/dev/peps/pep-0263/
+_encoding_regex = re.compile(r'^[ \t\f]*#.*?coding[:=][ \t]*[-\w.]+')
+
+# Tokens that don't start a statement
+_structural_tokens = (tokenize.NL, tokenize.COMMENT, tokenize.INDENT,
+                      tokenize.DEDENT)
+
+
+def _is_kept_comment(token_string, row):
+    """Return True for a #! line or an encoding declaration"""
+    if row == 1 and token_string.startswith('#!'):
+        return True
+    return row <= 2 and _encoding_regex.match(token_string) is not None
+
+
+def _logical_lines(tokens):
+    """Split tokens into logical lines.
+
+    Yields:
+        (indented, statement_tokens), where indented is True if the
+        line starts a new indented block, and statement_tokens are the
+        line's tokens without the final NEWLINE.
+    """
+    indented = False
+    statement = []
+    for token in tokens:
+        token_type = token[0]
+        if token_type == tokenize.INDENT:
+            indented = True
+        elif token_type == tokenize.NEWLINE:
+            if statement:
+                yield indented, statement
+            indented = False
+            statement = []
+        elif token_type not in _structural_tokens + (tokenize.ENDMARKER,):
+            statement.append(token)
+
+
+def _is_block_header(statement):
+    """Return True for a `def` or `class` line ending in ':'"""
+    names = [token[1] for token in statement[:2]]
+    return ((names[0] in ('def', 'class') or names == ['async', 'def']) and
+            statement[-1][1] == ':')
+
+
+def _is_plain_string(token):
+    """Return True for a string literal that isn't an f-string"""
+    if token[0] != tokenize.STRING:
+        return False
+    prefix = token[1][:token[1].find(token[1][-1])]
+    return 'f' not in prefix.lower()
+
+
+def _has_semicolon(statement):
+    depth = 0
+    for token in statement:
+        if token[0] == tokenize.OP:
+            if token[1] in '([{':
+                depth += 1
+            elif token[1] in ')]}':
+                depth -= 1
+            elif token[1] == ';' and depth == 0:
+                return True
+    return False
+
+
+def _find_edits(tokens, keep_docstrings):
+    """Return a list of ((start_row, start_col), (end_row, end_col),
+    replacement) for the parts of the source to rewrite."""
+    edits = []
+    for token in tokens:
+        if token[0] == tokenize.COMMENT and not _is_kept_comment(
+                token[1], token[2][0]):
+            edits.append((token[2], token[3], ''))
+
+    at_module_start = True
+    after_header = False
+    for indented, statement in _logical_lines(tokens):
+        start, end = statement[0][2], statement[-1][3]
+        if _has_semicolon(statement):
+            pass
+        elif (not keep_docstrings and
+              all(_is_plain_string(token) for token in statement)):
+            if at_module_start:
+                edits.append((start, end, ''))
+            elif after_header and indented:
+                edits.append((start, end, 'pass'))
+        elif statement[0][1] == 'assert':
+            edits.append((start, end, 'pass'))
+        at_module_start = False
+        after_header = _is_block_header(statement)
+    return edits
+
+
+def _apply_edits(lines, edits):
+    """Apply edits to a list of lines, keeping line breaks"""
+    for start, end, replacement in sorted(edits, reverse=True):
+        (start_row, start_col), (end_row, end_col) = start, end
+        first = lines[start_row - 1]
+        last = lines[end_row - 1]
+        # Keep line structure, so that line numbers don't change
+        lines[start_row - 1] = (first[:start_col] + replacement +
+                                last[end_col:])
+        for row in range(start_row, end_row):
+            ending = lines[row][len(lines[row].rstrip('\r\n')):]
+            lines[row] = ending
+    return lines
+
+
+def _strip_trailing_whitespace(line):
+    stripped = line.rstrip('\r\n')
+    return stripped.rstrip(' \t\f') + line[len(stripped):]
+
+
+def minify(source, keep_docstrings=False):
+    """Remove comments, docstrings and asserts from Python source.
+
+    Args:
+        source: Python source code as bytes, in unknown encoding
+        keep_docstrings: If True, only remove comments and asserts
+
+    Returns:
+        The rewritten source as bytes, or the original source if it
+        couldn't be rewritten safely.
+    """
+    # We don't know the encoding, see PythonArchive.generate_main()
+    text = source.decode('latin-1')
+    if '__doc__' in text:
+        keep_docstrings = True
+    lines = text.splitlines(True)
+    readline = functools.partial(next, iter(lines), '')
+    try:
+        tokens = list(tokenize.generate_tokens(readline))
+    except (tokenize.TokenError, SyntaxError):
+        return source
+    if any(token[0] == tokenize.ERRORTOKEN for token in tokens):
+        return source
+
+    edits = _find_edits(tokens, keep_docstrings)
+    if not edits:
+        return source
+    new_lines = _apply_edits(list(lines), edits)
+    rows = set(row for start, end, _ in edits
+               for row in range(start[0], end[0] + 1))
+    for row in rows:
+        new_lines[row - 1] = _strip_trailing_whitespace(new_lines[row - 1])
+    result = ''.join(new_lines).encode('latin-1')
+
+    # Double check, without paying to parse the original unless needed
+    try:
+        ast.parse(result)
+    except (SyntaxError, ValueError, TypeError):
+        try:
+            ast.parse(source)
+        except (SyntaxError, ValueError, TypeError):
+            # Not for this Python version, so trust the tokens
+            return result
+        return source
+    return result
@@ -0,0 +1,127 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from subpar.compiler import minify
+
+
+class MinifyTest(unittest.TestCase):
+
+    def test_minify(self):
+        source = b'''#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Module docstring.
+
+More.
+"""
+from __future__ import print_function  # Comment
+
+import os
+
+
+class A(object):
+    """Only a docstring"""
+
+
+class B(object):
+    'Docstring'
+    x = 1  # Comment
+
+    def f(self, a,  # Comment
+          b):
+        """Docstring"""
+        assert a, (
+            'message')
+        return a
+
+
+def g(): "One-liner"
+
+s = """# Not a comment
+"""
+'''
+        expected = b'''#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+
+
+from __future__ import print_function
+
+import os
+
+
+class A(object):
+    pass
+
+
+class B(object):
+    pass
+    x = 1
+
+    def f(self, a,
+          b):
+        pass
+        pass
+
+        return a
+
+
+def g(): "One-liner"
+
+s = """# Not a comment
+"""
+'''
+        self.assertEqual(minify.minify(source), expected)
+
+    def test_minify_keep_docstrings(self):
+        source = b'def f():\n    """Doc"""\n    assert f  # Comment\n'
+        self.assertEqual(minify.minify(source, keep_docstrings=True),
+                         b'def f():\n    """Doc"""\n    pass\n')
+        # Anything mentioning __doc__ keeps its docstrings
+        source = b'"""Usage: foo"""\nprint(__doc__)\n'
+        self.assertEqual(minify.minify(source), source)
+
+    def test_minify_unsafe(self):
+        cases = [
+            # Assert shares a line with another statement
+            b'assert True; x = 1\n',
+            # Not a docstring
+            b'x = 1\n"""String"""\n',
+            b'def f():\n    x = 1\n    "String"\n',
+            b'def f():\n    f"{x}"\n',
+        ]
+        for source in cases:
+            self.assertEqual(minify.minify(source), source)
+
+    def test_minify_invalid(self):
+        cases = [
+            # Can't be tokenized
+            b'x = (\n',
+            b'"""Unterminated\n',
+            b'x = $\n',
+        ]
+        for source in cases:
+            self.assertEqual(minify.minify(source), source)
+
+    def test_minify_latin1(self):
+        # Bytes in an unknown encoding are preserved
+        source = b'# -*- coding: latin-1 -*-\n"""\xe9"""\nx = "\xe9"  # \xe9\n'
+        self.assertEqual(minify.minify(source),
+                         b'# -*- coding: latin-1 -*-\n\nx = "\xe9"\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -29,30 +29,104 @@ See also https://www.python.org/dev/peps/pep-0441/
 """
 
 from datetime import datetime
+import collections
 import contextlib
 import errno
+import hashlib
 import io
+import json
 import logging
 import os
 import pkgutil
+import posixpath
 import re
+import shlex
+import shutil
+import struct
+import subprocess
 import sys
 import tempfile
 import zipfile
+import zipimport
 
+from subpar.compiler import build_report
+from subpar.compiler import bytecode
 from subpar.compiler import error
+from subpar.compiler import import_graph
+from subpar.compiler import layout_profile
 from subpar.compiler import manifest_parser
 from subpar.compiler import stored_resource
 
+try:
+    from shlex import quote as shell_quote
+except ImportError:
+    from pipes import quote as shell_quote  # Python 2
+
 # Boilerplate code added to __main__.py
 _boilerplate_template = """\
 # Boilerplate added by subpar/compiler/python_archive.py
 from %(runtime_package)s import support as _
-_.setup(import_roots=%(import_roots)s, zip_safe=%(zip_safe)s)
+_.setup(%(setup_args)s)
 del _
 # End boilerplate
 """
 
+# Start of a .par file whose interpreter needs more than one argument.
+# The interpreter skips everything before the zip data.
+_shell_bootstrap_template = """\
+#!/bin/sh
+exec %(command)s "$0" "$@"
+"""
+
+# Start of a development launcher whose interpreter needs more than
+# one argument.  The second line is a string to Python.
+_script_shell_bootstrap_template = """\
+#!/bin/sh
+''''exec %(command)s "$0" "$@" #'''
+"""
+
+# Script written instead of a .par file, see create_dev_launcher().
+# Its only global besides the usual ones is _subpar_launch, like the
+# boilerplate in __main__.py leaves none.
+_dev_launcher_template = """\
+%(bootstrap)s# Development launcher, see subpar/compiler/python_archive.py
+
+
+def _subpar_launch():
+    import os
+    import sys
+    script = os.path.abspath(__file__)
+    candidates = [os.path.realpath(script) + '.runfiles',
+                  script + '.runfiles',
+                  os.environ.get('RUNFILES_DIR', '')]
+    # Or the runfiles tree of another program we are part of
+    directory = os.path.dirname(script)
+    while directory != os.path.dirname(directory):
+        if directory.endswith('.runfiles'):
+            candidates.append(directory)
+            break
+        directory = os.path.dirname(directory)
+    for root in candidates:
+        if root and os.path.isfile(os.path.join(root, %(main)r)):
+            break
+    else:
+        sys.exit('%%s: runfiles not found' %% script)
+    # Processes started by multiprocessing already have the sys.path
+    # of their parent
+    if sys.path[0] != root:
+        sys.path[0:1] = [root] + [os.path.join(root, import_root)
+                                  for import_root in %(import_roots)r]
+    from %(runtime_package)s import support
+    support._installed = True
+    support.setup(%(setup_args)s)
+    filename = os.path.join(root, %(main)r)
+    with open(filename, 'rb') as f:
+        return compile(f.read(), filename, 'exec')
+
+
+exec(_subpar_launch())
+"""
+
 # Boilerplate must be after the last __future__ import.  See
 # https://docs.python.org/2/reference/simple_stmts.html#future
 _boilerplate_insertion_regex = re.compile('''(?sx)
@@ -74,13 +148,18 @@ _boilerplate_insertion_regex = re.compile('''(?sx)
 (?P<after>.*)
 ''')
 
+# Files in a wheel that an installer puts in site-packages
+_wheel_lib_regex = re.compile(
+    r'^[^/]+\.data/(purelib|platlib)/(?P<name>.+)$')
+
 # Fully qualified names of subpar packages
 _subpar_package = 'subpar'
 _compiler_package = _subpar_package + '.compiler'
 _runtime_package = _subpar_package + '.runtime'
 
 # List of files from the runtime package to include in every .par file
-_runtime_support_files = ['support.py']
+_runtime_support_files = [
+    'access_trace.py', 'install.py', 'support.py', 'zygote.py']
 
 # List of zero-length files to include in every .par file
 _runtime_init_files = [
@@ -88,6 +167,72 @@ _runtime_init_files = [
     'subpar/runtime/__init__.py',
 ]
 
+# Paths with duplicate content, see deduplicate()
+_alias_table = 'subpar/runtime/aliases.txt'
+
+# Code objects of bundled modules, see freeze_modules()
+_frozen_bundle = 'subpar/runtime/frozen_code.bin'
+_frozen_bundle_magic = b'SUBPAR-FROZEN-1\n'
+
+# Modules for the runtime to load in the background, see
+# add_prefetch_list()
+_prefetch_list = 'subpar/runtime/prefetch.txt'
+
+# Size of the header of .pyc files written by bytecode.py, for the
+# Python versions that can use a frozen bundle
+_pyc_header_size = 16
+
+# Digest of a dependency archive, see write_dependency_archive()
+_dependency_digest_entry = 'subpar/runtime/dependency_digest.txt'
+
+
+# Optional features of a PythonArchive, with their defaults.  See the
+# flags of cli.py for what each does.
+_option_defaults = [
+    ('layout_profile_filename', None),
+    ('prune_imports', False),
+    ('keep_modules', ()),
+    ('prune_report_filename', None),
+    ('strip_elf', False),
+    ('strip_tool', None),
+    ('elf_debug_dir', None),
+    ('minify_sources', False),
+    ('keep_docstrings', ()),
+    ('minify_report_filename', None),
+    # Interpreter and -O level that .pyc files of extra manifests were
+    # compiled with, see recompile_minified()
+    ('pyc_interpreter', None),
+    ('pyc_optimize', -1),
+    ('fragment_filenames', ()),
+    # List of (stored directory, zip filename)
+    ('zip_inputs', ()),
+    ('extra_manifest_filenames', ()),
+    ('create_init', False),
+    ('build_report_filename', None),
+    ('dedup_content', False),
+    ('verify_archive', False),
+    # Archive to move files from other workspaces to, if any
+    ('dependency_filename', None),
+    ('interpreter_flags', ()),
+    ('zygote', False),
+    ('freeze_modules', False),
+    # Modules and packages to freeze, all if empty
+    ('frozen_modules', ()),
+    ('bytecode_cache', False),
+    # Modules and packages to prefetch, and whether to prefetch those
+    # in the layout profile too
+    ('prefetch_modules', ()),
+    ('prefetch_profile', False),
+    # Modules and packages for the runtime to import lazily
+    ('lazy_import_packages', ()),
+]
+
+# Every option not given is off
+Options = collections.namedtuple(
+    'Options', [name for name, _ in _option_defaults])
+Options.__new__.__defaults__ = tuple(
+    default for _, default in _option_defaults)
+
 
 class PythonArchive(object):
     """Contains all the necessary information to generate a .par file"""
@@ -102,6 +247,8 @@ class PythonArchive(object):
                  output_filename,
                  timestamp,
                  zip_safe,
+                 workspace_name=None,
+                 options=None,
                  ):
         self.main_filename = main_filename
 
@@ -109,11 +256,17 @@ class PythonArchive(object):
         self.interpreter = interpreter
         self.manifest_filename = manifest_filename
         self.manifest_root = manifest_root
+        self.workspace_name = workspace_name
         self.output_filename = output_filename
         # Convert to the format ZipInfo expects
         t = datetime.utcfromtimestamp(timestamp)
         self.timestamp_tuple = t.timetuple()[0:6]
+        self.timestamp = timestamp
         self.zip_safe = zip_safe
+        # Stored paths to place first in the archive, in access order
+        self.hot_paths = []
+        # Optional features
+        self.options = options if options is not None else Options()
 
         self.compression = zipfile.ZIP_DEFLATED
 
@@ -127,26 +280,172 @@ class PythonArchive(object):
         logging.info('Making parfile [%s]...', self.output_filename)
         remove_if_present(self.output_filename)
 
+        report = build_report.BuildReport()
+
         # Assemble list of files to include
-        logging.debug('Compiling file list from [%s]', self.manifest_filename)
-        manifest = manifest_parser.parse(self.manifest_filename)
+        with report.phase('parse'):
+            manifest = self.parse_manifests()
+            if self.options.layout_profile_filename:
+                logging.debug('Reading layout profile from [%s]',
+                              self.options.layout_profile_filename)
+                self.hot_paths = layout_profile.parse(
+                    self.options.layout_profile_filename)
+
+        with report.phase('scan'):
+            # Validate manifest and add various extra files to the list
+            stored_resources = self.scan_manifest(manifest)
+
+            # Drop modules that can never be imported
+            if self.options.prune_imports:
+                import_roots = self.compute_import_roots(manifest)
+                stored_resources = self.prune_unreachable(
+                    stored_resources, import_roots)
+                # The readahead region may have ended at a dropped entry
+                stored_resources['__main__.py'] = self.generate_main(
+                    self.main_filename,
+                    self.generate_boilerplate(
+                        import_roots,
+                        self.compute_readahead_until(stored_resources)))
+
+            # Bytecode must be compiled from the source that is stored
+            if self.options.minify_sources:
+                self.recompile_minified(stored_resources)
+
+        # Leave dependencies to an archive of their own
+        if self.options.dependency_filename:
+            with report.phase('dependencies'):
+                self.split_dependencies(
+                    stored_resources, self.compute_import_roots(manifest))
+
+        # Bundle code objects into one entry
+        if self.options.freeze_modules:
+            with report.phase('freeze'):
+                self.write_frozen_bundle(
+                    stored_resources, self.compute_import_roots(manifest))
+
+        # List modules to load in the background
+        if self.options.prefetch_modules or self.options.prefetch_profile:
+            with report.phase('prefetch'):
+                self.add_prefetch_list(
+                    stored_resources, self.compute_import_roots(manifest))
 
-        # Validate manifest and add various extra files to the list
-        stored_resources = self.scan_manifest(manifest)
+        # Store identical files once
+        aliases = {}
+        if self.options.dedup_content:
+            with report.phase('dedup'):
+                aliases = self.deduplicate(
+                    stored_resources, self.compute_import_roots(manifest))
 
         # Create parfile in temporary file
         temp_parfile = self.create_temp_parfile()
         try:
-            logging.debug('Writing parfile to temp file [%s]...',
-                          temp_parfile.name)
-            self.write_bootstrap(temp_parfile)
+            with report.phase('write'):
+                logging.debug('Writing parfile to temp file [%s]...',
+                              temp_parfile.name)
+                self.write_bootstrap(temp_parfile)
+                self.write_zip_data(temp_parfile, stored_resources)
+                temp_parfile.close()
+            if self.options.verify_archive:
+                with report.phase('verify'):
+                    self.verify(temp_parfile.name, stored_resources, aliases)
+            if self.options.minify_sources:
+                self.report_minified(stored_resources)
+            # Flushed and closed tempfile, may now rename it safely
+            with report.phase('rename'):
+                self.create_final_from_temp(temp_parfile.name)
+        finally:
+            remove_if_present(temp_parfile.name)
+        if self.options.build_report_filename:
+            logging.debug('Writing build report to [%s]',
+                          self.options.build_report_filename)
+            report.write(self.options.build_report_filename,
+                         self.order_resources(stored_resources),
+                         self.compute_import_roots(manifest))
+        logging.info('Success!')
+
+    def parse_manifests(self):
+        """Return the manifest, with any extra manifests merged in"""
+        logging.debug('Compiling file list from [%s]', self.manifest_filename)
+        manifest = manifest_parser.parse(self.manifest_filename,
+                                         self.workspace_name)
+        for extra_manifest_filename in self.options.extra_manifest_filenames:
+            logging.debug('Adding files from [%s]', extra_manifest_filename)
+            manifest.update(manifest_parser.parse(extra_manifest_filename,
+                                                  self.workspace_name))
+        if self.options.create_init:
+            self.add_init_files(manifest)
+        if (self.workspace_name is not None and
+                self.main_filename not in manifest.values()):
+            raise error.Error(
+                'Main entry point [%s] not listed in srcs' %
+                self.main_filename)
+        return manifest
+
+    def create_fragment(self):
+        """Create a fragment to pass to a later create() call.
+
+        The output is a plain zip file holding just the entries of the
+        manifest, with no interpreter line, runtime support files or
+        __main__.py.
+
+        Raises:
+            Error, IOError, SystemError
+        """
+        logging.info('Making fragment [%s]...', self.output_filename)
+        remove_if_present(self.output_filename)
+        manifest = manifest_parser.parse(self.manifest_filename,
+                                         self.workspace_name)
+        stored_resources = self.scan_manifest_entries(manifest)
+
+        temp_parfile = self.create_temp_parfile()
+        try:
             self.write_zip_data(temp_parfile, stored_resources)
             temp_parfile.close()
-            # Flushed and closed tempfile, may now rename it safely
+            os.rename(temp_parfile.name, self.output_filename)
+        finally:
+            remove_if_present(temp_parfile.name)
+
+    def create_dev_launcher(self):
+        """Create a script that runs the program from its runfiles.
+
+        This is written instead of a .par file, for a quicker edit and
+        run cycle.  The script finds the runfiles tree Bazel builds
+        next to it, which has the same layout as a .par file.  It sets
+        up sys.path the same way, calls setup() with the same
+        arguments, then runs the main entry point from that tree.
+        Only the manifests are read, so the script doesn't change when
+        the content of other files does.
+
+        Raises:
+            Error, IOError
+        """
+        logging.info('Making development launcher [%s]...',
+                     self.output_filename)
+        remove_if_present(self.output_filename)
+        manifest = self.parse_manifests()
+        main_paths = sorted(
+            stored_path for stored_path, local_path in manifest.items()
+            if local_path == self.main_filename)
+        if not main_paths:
+            raise error.Error('Main entry point [%s] not listed in [%s]' % (
+                self.main_filename, self.manifest_filename))
+        import_roots = self.compute_import_roots(manifest)
+        launcher = _dev_launcher_template % {
+            'bootstrap': generate_script_bootstrap(
+                self.interpreter, self.options.interpreter_flags),
+            'main': str(main_paths[0]),
+            'import_roots': [str(root) for root in import_roots],
+            'runtime_package': _runtime_package,
+            'setup_args': self.generate_setup_args(import_roots),
+        }
+
+        temp_parfile = self.create_temp_parfile()
+        try:
+            temp_parfile.write(launcher.encode('utf8'))
+            temp_parfile.close()
             self.create_final_from_temp(temp_parfile.name)
         finally:
             remove_if_present(temp_parfile.name)
-        logging.info('Success!')
 
     def create_temp_parfile(self):
         """Create the first part of a parfile.
@@ -158,23 +457,56 @@ class PythonArchive(object):
         output_dir = os.path.dirname(self.output_filename)
         return tempfile.NamedTemporaryFile(dir=output_dir, delete=False)
 
-    def generate_boilerplate(self, import_roots):
+    def generate_boilerplate(self, import_roots, readahead_until=None,
+                             dependency_archives=()):
         """Generate boilerplate to be insert into __main__.py
 
         We don't know the encoding of the main source file, so
         require that the template be pure ascii, which we can safely
         insert.
 
+        Args:
+            import_roots: List of import roots to add to sys.path
+            readahead_until: Stored path of the last entry in the hot
+                region at the start of the archive, or None
+            dependency_archives: List of (filename, digest, import
+                roots) of archives holding the rest of the files
+
         Returns:
             A string containing only ascii characters
         """
         boilerplate_contents = _boilerplate_template % {
             'runtime_package': _runtime_package,
-            'import_roots': str(import_roots),
-            'zip_safe': self.zip_safe,
+            'setup_args': self.generate_setup_args(
+                import_roots, readahead_until, dependency_archives),
         }
         return boilerplate_contents.encode('ascii').decode('ascii')
 
+    def generate_setup_args(self, import_roots, readahead_until=None,
+                            dependency_archives=()):
+        """Return the arguments of the support.setup() call, as code.
+
+        See generate_boilerplate() for the arguments.
+        """
+        setup_args = [
+            'import_roots=%s' % str(import_roots),
+            'zip_safe=%s' % self.zip_safe,
+        ]
+        if readahead_until is not None:
+            setup_args.append('readahead_until=%r' % str(readahead_until))
+        if dependency_archives:
+            setup_args.append('dependency_archives=%r' % [
+                (str(filename), str(digest), [str(root) for root in roots])
+                for filename, digest, roots in dependency_archives])
+        if self.options.zygote:
+            setup_args.append('zygote=True')
+        if self.options.bytecode_cache:
+            setup_args.append('bytecode_cache=True')
+        if self.options.lazy_import_packages:
+            setup_args.append('lazy_imports=%r' % [
+                str(name) for name in self.options.lazy_import_packages])
+        return ', '.join(setup_args)
+
     def generate_main(self, main_filename, boilerplate_contents):
         """Generate the contents of the __main__.py file
 
@@ -206,13 +538,31 @@ class PythonArchive(object):
         return stored_resource.StoredContent(
             '__main__.py', self.timestamp_tuple, encoded_content)
 
-    def scan_manifest(self, manifest):
-        """Return a dict of StoredResources based on an input manifest.
+    def add_init_files(self, manifest):
+        """Add missing __init__.py files to a manifest.
 
-        Returns:
-            A dict of store_filename to StoredResource
+        This is what Bazel does for a py_binary's runfiles, see
+        --incompatible_default_to_explicit_init_py.  Every directory
+        holding a .py or .so file, and every directory above it, gets
+        an empty __init__.py.  The top-level directory of the main
+        workspace doesn't, so neither does the top of the archive.
         """
+        init_files = set()
+        for stored_path in manifest:
+            if not stored_path.endswith(('.py', '.so')):
+                continue
+            parts = stored_path.split('/')[:-1]
+            main_workspace = (self.workspace_name is not None and
+                              parts[:1] == [self.workspace_name])
+            first = 2 if main_workspace else 1
+            for i in range(first, len(parts) + 1):
+                init_files.add('/'.join(parts[:i] + ['__init__.py']))
+        for init_file in init_files:
+            if init_file not in manifest:
+                manifest[init_file] = None
 
+    def compute_import_roots(self, manifest):
+        """Return the list of import roots to add to sys.path at runtime"""
         # Extend the list of import roots to include workspace roots
         top_roots = set()
         for stored_path in manifest.keys():
@@ -220,32 +570,195 @@ class PythonArchive(object):
                 top_dir = stored_path.split('/', 1)[0]
                 if top_dir not in top_roots:
                     top_roots.add(top_dir)
-        import_roots = list(self.import_roots) + sorted(top_roots)
+        # and the directories zip inputs are stored under, which may be
+        # nested
+        top_roots.update(
+            prefix for prefix, _ in self.options.zip_inputs if prefix)
+        return list(self.import_roots) + sorted(top_roots)
 
-        # Include some files that every .par file needs at runtime
-        stored_resources = {}
-        for support_file in _runtime_support_files:
-            resource = fetch_support_file(support_file, self.timestamp_tuple)
-            stored_filename = resource.zipinfo.filename
-            stored_resources[stored_filename] = resource
+    def scan_manifest_entries(self, manifest):
+        """Return a dict of StoredResources for the entries of a manifest.
 
-        # Scan manifest
+        Unlike scan_manifest(), nothing else is added.
+        """
+        stored_resources = {}
         for stored_path, local_path in manifest.items():
             if local_path is None:
                 stored_resources[stored_path] = stored_resource.EmptyFile(
                     stored_path, self.timestamp_tuple)
+            elif (stored_path.endswith('.pyc') and
+                  os.path.getsize(local_path) == 0):
+                # See bytecode.py.  An empty .pyc would break imports.
+                logging.debug('Skipping empty bytecode file [%s]',
+                              local_path)
+            elif self.options.minify_sources and stored_path.endswith('.py'):
+                stored_resources[stored_path] = stored_resource.MinifiedFile(
+                    stored_path, self.timestamp_tuple, local_path,
+                    keep_docstrings=self.should_keep_docstrings(stored_path))
+            elif self.options.strip_elf:
+                stored_resources[stored_path] = stored_resource.StrippedFile(
+                    stored_path, self.timestamp_tuple, local_path,
+                    strip_tool=self.options.strip_tool,
+                    debug_dir=self.options.elf_debug_dir)
             else:
                 stored_resources[stored_path] = stored_resource.StoredFile(
                     stored_path, self.timestamp_tuple, local_path)
+        return stored_resources
 
-        # Copy main entry point to well-known name
-        if '__main__.py' in stored_resources:
-            raise error.Error(
-                ('Configuration error for [%s]: Manifest file included a '
-                 'file named __main__.py, which is not allowed') %
-                self.manifest_filename)
-        stored_resources['__main__.py'] = self.generate_main(
-            self.main_filename, self.generate_boilerplate(import_roots))
+    def recompile_minified(self, stored_resources):
+        """Compile .pyc files of minified sources again.
+
+        .pyc files from extra manifests are compiled from the original
+        sources, see bytecode.py, so they don't match minified ones.
+        They are compiled again by pyc_interpreter, from the stored
+        source.  Without a pyc_interpreter, they are left out, and
+        zipimport compiles the source instead.
+
+        Raises:
+            Error, IOError
+        """
+        pairs = sorted(
+            (stored_path, stored_path + 'c')
+            for stored_path, resource in stored_resources.items()
+            if (isinstance(resource, stored_resource.MinifiedFile) and
+                stored_path + 'c' in stored_resources))
+        if not pairs:
+            return
+        if not self.options.pyc_interpreter:
+            logging.info('Leaving out %d .pyc files of minified sources',
+                         len(pairs))
+            for _, pyc_path in pairs:
+                del stored_resources[pyc_path]
+            return
+
+        logging.debug('Compiling %d minified sources with [%s]',
+                      len(pairs), self.options.pyc_interpreter)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # bytecode.py imports nothing from subpar, so it runs from
+            # anywhere
+            script = os.path.join(temp_dir, 'bytecode.py')
+            with open(script, 'wb') as f:
+                f.write(pkgutil.get_data(_subpar_package,
+                                         'compiler/bytecode.py'))
+            args = []
+            for i, (source_path, _) in enumerate(pairs):
+                temp_source = os.path.join(temp_dir, '%d.py' % i)
+                with open(temp_source, 'wb') as f:
+                    f.write(stored_resources[source_path].read())
+                args.extend([temp_source, source_path, temp_source + 'c'])
+            args_filename = os.path.join(temp_dir, 'args')
+            with io.open(args_filename, 'wt', encoding='utf8') as f:
+                f.write(u''.join(u'%s\n' % arg for arg in args))
+            try:
+                subprocess.check_call([
+                    self.options.pyc_interpreter, script,
+                    '--optimize=%d' % self.options.pyc_optimize,
+                    '--timestamp=%d' % self.timestamp,
+                    '@' + args_filename])
+            except (OSError, subprocess.CalledProcessError) as e:
+                raise error.Error(
+                    'Failed to compile minified sources with [%s]: %s' % (
+                        self.options.pyc_interpreter, e))
+            for i, (_, pyc_path) in enumerate(pairs):
+                with open(os.path.join(temp_dir, '%d.pyc' % i), 'rb') as f:
+                    content = f.read()
+                if content:
+                    stored_resources[pyc_path] = (
+                        stored_resource.StoredContent(
+                            pyc_path, self.timestamp_tuple, content))
+                else:
+                    # See bytecode.py.  An empty .pyc would break imports.
+                    del stored_resources[pyc_path]
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def use_fragments(self, stored_resources):
+        """Take manifest entries from fragments instead of local files.
+
+        A fragment is a zip file, built with create_fragment(), that
+        holds some of the manifest's files under their stored paths.
+        Entries are copied from fragments without recompressing them.
+        Only plain files are replaced, so that files that would be
+        rewritten on the way into the archive are still rewritten.
+        Fragment entries that aren't in the manifest are ignored.
+        """
+        replaced = 0
+        for fragment_filename in self.options.fragment_filenames:
+            logging.debug('Reading fragment [%s]', fragment_filename)
+            with contextlib.closing(zipfile.ZipFile(fragment_filename)) as z:
+                zipinfos = z.infolist()
+            for zipinfo in zipinfos:
+                resource = stored_resources.get(zipinfo.filename)
+                if type(resource) is not stored_resource.StoredFile:
+                    continue
+                stored_resources[zipinfo.filename] = (
+                    stored_resource.StoredZipEntry(
+                        zipinfo.filename, self.timestamp_tuple,
+                        fragment_filename, zipinfo))
+                replaced += 1
+        logging.debug('Using %d entries from %d fragments', replaced,
+                      len(self.options.fragment_filenames))
+
+    def add_zip_input(self, stored_resources, prefix, zip_filename):
+        """Add the entries of a zip file or wheel under a directory.
+
+        Entries are copied without recompressing them.  For wheels,
+        the contents of the <name>.data/purelib and platlib
+        directories go at the top, like an installer would put them.
+        Files listed in the manifest take precedence.
+
+        Raises:
+            Error: Two zip inputs have a file with the same name
+        """
+        logging.debug('Adding entries of [%s] under [%s]', zip_filename,
+                      prefix)
+        with contextlib.closing(zipfile.ZipFile(zip_filename)) as z:
+            zipinfos = z.infolist()
+        is_wheel = zip_filename.endswith('.whl')
+        for zipinfo in zipinfos:
+            name = zipinfo.filename
+            if name.endswith('/'):
+                continue
+            if is_wheel:
+                match = _wheel_lib_regex.match(name)
+                if match:
+                    name = match.group('name')
+            stored_path = posixpath.join(prefix, name)
+            existing = stored_resources.get(stored_path)
+            if isinstance(existing, stored_resource.StoredZipEntry):
+                raise error.Error(
+                    ('Configuration error: [%s] is in both [%s] and [%s]') %
+                    (stored_path, existing.zip_filename, zip_filename))
+            elif existing is not None:
+                logging.debug('Skipping zip entry already present [%s]',
+                              stored_path)
+                continue
+            stored_resources[stored_path] = stored_resource.StoredZipEntry(
+                stored_path, self.timestamp_tuple, zip_filename, zipinfo)
+
+    def scan_manifest(self, manifest):
+        """Return a dict of StoredResources based on an input manifest.
+
+        Returns:
+            A dict of store_filename to StoredResource
+        """
+
+        import_roots = self.compute_import_roots(manifest)
+
+        # Include some files that every .par file needs at runtime
+        stored_resources = {}
+        for support_file in _runtime_support_files:
+            resource = fetch_support_file(support_file, self.timestamp_tuple)
+            stored_filename = resource.zipinfo.filename
+            stored_resources[stored_filename] = resource
+
+        # Scan manifest
+        stored_resources.update(self.scan_manifest_entries(manifest))
+        if self.options.fragment_filenames:
+            self.use_fragments(stored_resources)
+        for prefix, zip_filename in self.options.zip_inputs:
+            self.add_zip_input(stored_resources, prefix, zip_filename)
 
         # Add an __init__.py for each parent package of the support files
         for stored_filename in _runtime_init_files:
@@ -256,15 +769,474 @@ class PythonArchive(object):
             stored_resources[stored_filename] = stored_resource.EmptyFile(
                 stored_filename, self.timestamp_tuple)
 
+        # Copy main entry point to well-known name
+        if '__main__.py' in stored_resources:
+            raise error.Error(
+                ('Configuration error for [%s]: Manifest file included a '
+                 'file named __main__.py, which is not allowed') %
+                self.manifest_filename)
+        stored_resources['__main__.py'] = self.generate_main(
+            self.main_filename,
+            self.generate_boilerplate(
+                import_roots, self.compute_readahead_until(stored_resources)))
+
         return stored_resources
 
+    def compute_readahead_until(self, stored_resources):
+        """Return the stored path ending the readahead region, or None"""
+        # The boilerplate is pure ascii, so the readahead region ends
+        # at the last hot entry with an ascii name.
+        readahead_until = None
+        for path in self.hot_paths:
+            if ((path in stored_resources or path == '__main__.py') and
+                    all(ord(c) < 128 for c in path)):
+                readahead_until = path
+        return readahead_until
+
+    def split_dependencies(self, stored_resources, import_roots):
+        """Move the .par file's dependencies to a separate archive.
+
+        Files from other workspaces than the main one, including zip
+        inputs, are dependencies.  They are removed from
+        stored_resources and written to dependency_filename, and
+        __main__.py is regenerated to point at that archive.
+
+        Args:
+            stored_resources: dict of stored path to StoredResource
+            import_roots: Import roots of the whole .par file
+
+        Raises:
+            Error, IOError
+        """
+        if self.workspace_name is None:
+            raise error.Error(
+                'Configuration error for [%s]: A workspace name is needed '
+                'to tell dependencies apart' % self.manifest_filename)
+        app_tops = set([self.workspace_name, _subpar_package])
+        dependency_resources = {}
+        for stored_path in list(stored_resources):
+            if ('/' in stored_path and
+                    stored_path.split('/', 1)[0] not in app_tops):
+                dependency_resources[stored_path] = (
+                    stored_resources.pop(stored_path))
+        logging.debug('Moving %d of %d files to dependency archive',
+                      len(dependency_resources),
+                      len(dependency_resources) + len(stored_resources))
+
+        # Each archive gets the import roots that have files in it.
+        # Roots with no files at all stay with the .par file.
+        dependency_dirs = _directories(dependency_resources)
+        app_dirs = _directories(stored_resources)
+        app_roots = [root for root in import_roots
+                     if root in app_dirs or root not in dependency_dirs]
+        dependency_roots = [root for root in import_roots
+                            if root in dependency_dirs]
+
+        digest = self.write_dependency_archive(dependency_resources)
+        dependency_archive = (
+            os.path.basename(self.options.dependency_filename), digest,
+            dependency_roots)
+        stored_resources['__main__.py'] = self.generate_main(
+            self.main_filename,
+            self.generate_boilerplate(
+                app_roots, self.compute_readahead_until(stored_resources),
+                dependency_archives=[dependency_archive]))
+
+    def write_dependency_archive(self, stored_resources):
+        """Write a plain zip file holding the given entries.
+
+        The SHA-256 digest of the archive is then appended to it as
+        one more entry.  The runtime checks it, so that a .par file is
+        only combined with the dependency archive it was built with.
+
+        Returns:
+            The digest as a hex string
+        """
+        logging.info('Making dependency archive [%s]...',
+                     self.options.dependency_filename)
+        remove_if_present(self.options.dependency_filename)
+        output_dir = os.path.dirname(self.options.dependency_filename)
+        temp_file = tempfile.NamedTemporaryFile(dir=output_dir, delete=False)
+        try:
+            self.write_zip_data(temp_file, stored_resources)
+            temp_file.close()
+            digest = hashlib.sha256()
+            with open(temp_file.name, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+            with contextlib.closing(zipfile.ZipFile(temp_file.name, 'a')) as z:
+                stored_resource.StoredContent(
+                    _dependency_digest_entry, self.timestamp_tuple,
+                    digest.encode('ascii')).store(z)
+            os.rename(temp_file.name, self.options.dependency_filename)
+        finally:
+            remove_if_present(temp_file.name)
+        return digest
+
+    def should_freeze(self, stored_path, import_roots):
+        """Return True if a Python source should be in the frozen bundle"""
+        runtime_prefix = _runtime_package.replace('.', '/') + '/'
+        if (stored_path == '__main__.py' or
+                stored_path.startswith(runtime_prefix)):
+            return False
+        if not self.options.frozen_modules:
+            return True
+        return _in_packages(stored_path, import_roots,
+                            self.options.frozen_modules)
+
+    def compile_frozen_code(self, stored_resources, import_roots):
+        """Return the bytecode format and code of modules to freeze.
+
+        Code is taken from the .pyc file stored next to each source,
+        if there is one, since it was compiled by the interpreter the
+        .par file runs under.  Otherwise sources are compiled by this
+        interpreter, if it is recent enough for the runtime to use a
+        bundle at all.  Only code in the bytecode format of the .pyc
+        files, if any, or else of this interpreter, is returned.
+
+        Returns:
+            (pyc magic number, dict of stored path to marshalled code)
+        """
+        by_magic = {}
+        stored_magics = set()
+        for stored_path in sorted(stored_resources):
+            if (not stored_path.endswith('.py') or
+                    not self.should_freeze(stored_path, import_roots)):
+                continue
+            pyc_resource = stored_resources.get(stored_path + 'c')
+            if pyc_resource is not None:
+                pyc = pyc_resource.read()
+                stored_magics.add(pyc[:4])
+            elif sys.version_info >= (3, 10):
+                try:
+                    pyc = bytecode.compile_source(
+                        stored_resources[stored_path].read(), stored_path,
+                        -1, 0)
+                except (SyntaxError, ValueError, TypeError) as e:
+                    logging.debug('Not freezing [%s]: %s', stored_path, e)
+                    continue
+            else:
+                continue
+            by_magic.setdefault(pyc[:4], {})[stored_path] = (
+                pyc[_pyc_header_size:])
+        if not by_magic:
+            return None, {}
+        # Stored .pyc files are the best guess of what the .par file
+        # runs under
+        magic = max(by_magic, key=lambda m: (m in stored_magics,
+                                             len(by_magic[m])))
+        return magic, by_magic[magic]
+
+    def write_frozen_bundle(self, stored_resources, import_roots):
+        """Add an entry holding the code objects of pure Python modules.
+
+        At runtime, support.install_frozen_code() reads the bundle
+        with one get_data() call, and modules in it are imported from
+        there instead of from their own .py and .pyc entries.  Those
+        entries stay in the archive, for other interpreters, data
+        access and tracebacks.
+
+        The bundle is a header, a JSON index of stored path to offset
+        and length, and the marshalled code.
+        """
+        magic, codes = self.compile_frozen_code(
+            stored_resources, import_roots)
+        if not codes:
+            logging.info('No modules to freeze')
+            return
+        index = {}
+        data = []
+        offset = 0
+        for stored_path in sorted(codes):
+            index[stored_path] = [offset, len(codes[stored_path])]
+            data.append(codes[stored_path])
+            offset += len(codes[stored_path])
+        index_data = json.dumps(index, sort_keys=True).encode('utf8')
+        content = b''.join([
+            _frozen_bundle_magic,
+            struct.pack('<4sI', magic, len(index_data)),
+            index_data,
+        ] + data)
+        logging.info('Froze %d modules into %d bytes', len(codes),
+                     len(content))
+        stored_resources[_frozen_bundle] = stored_resource.StoredContent(
+            _frozen_bundle, self.timestamp_tuple, content)
+
+    def compute_prefetch_paths(self, stored_resources, import_roots):
+        """Return the stored paths of Python sources to prefetch.
+
+        Modules imported during the layout profile's training run come
+        first, in the order they were imported, then other modules in
+        prefetch_modules.  Modules in the frozen bundle are left out,
+        since they are loaded with it.
+
+        Raises:
+            Error
+        """
+        if (self.options.prefetch_profile and
+                not self.options.layout_profile_filename):
+            raise error.Error(
+                'Configuration error for [%s]: Prefetching modules from '
+                'the profile needs a layout profile' % self.output_filename)
+        candidates = []
+        if self.options.prefetch_profile:
+            candidates.extend(path[:-1] if path.endswith('.pyc') else path
+                              for path in self.hot_paths)
+        if self.options.prefetch_modules:
+            candidates.extend(
+                stored_path for stored_path in sorted(stored_resources)
+                if _in_packages(stored_path, import_roots,
+                                self.options.prefetch_modules))
+        runtime_prefix = _runtime_package.replace('.', '/') + '/'
+        paths = []
+        seen = set()
+        for stored_path in candidates:
+            if (stored_path in seen or not stored_path.endswith('.py') or
+                    stored_path not in stored_resources or
+                    stored_path == '__main__.py' or
+                    stored_path.startswith(runtime_prefix) or
+                    (self.options.freeze_modules and
+                     self.should_freeze(stored_path, import_roots))):
+                continue
+            seen.add(stored_path)
+            paths.append(stored_path)
+        return paths
+
+    def add_prefetch_list(self, stored_resources, import_roots):
+        """Add the list of modules for the runtime to load in the background.
+
+        See support.install_prefetch().
+
+        Raises:
+            Error
+        """
+        paths = self.compute_prefetch_paths(stored_resources, import_roots)
+        logging.info('Listing %d modules to prefetch', len(paths))
+        content = u''.join(u'%s\n' % path for path in paths)
+        stored_resources[_prefetch_list] = stored_resource.StoredContent(
+            _prefetch_list, self.timestamp_tuple, content.encode('utf8'))
+
+    def should_keep_docstrings(self, stored_path):
+        """Return True if stored_path is under a --keep_docstrings prefix"""
+        for prefix in self.options.keep_docstrings:
+            prefix = prefix.rstrip('/')
+            if stored_path == prefix or stored_path.startswith(prefix + '/'):
+                return True
+        return False
+
+    def report_minified(self, stored_resources):
+        """Log, and optionally write, bytes saved by minifying sources.
+
+        Savings are totalled per directory in the archive.
+        """
+        # Directory to [original_size, minified_size]
+        sizes = {}
+        for stored_path, resource in stored_resources.items():
+            if getattr(resource, 'minified_size', None) is None:
+                continue
+            package = sizes.setdefault(posixpath.dirname(stored_path), [0, 0])
+            package[0] += resource.original_size
+            package[1] += resource.minified_size
+        original_total = sum(size[0] for size in sizes.values())
+        minified_total = sum(size[1] for size in sizes.values())
+        logging.info('Minified Python sources from %d to %d bytes',
+                     original_total, minified_total)
+
+        if self.options.minify_report_filename:
+            with io.open(self.options.minify_report_filename, 'wt',
+                         encoding='utf8') as report:
+                report.write(u'# original minified saved package\n')
+                for package, (original, minified) in sorted(
+                        sizes.items(),
+                        key=lambda item: (item[1][1] - item[1][0], item[0])):
+                    report.write(u'%d %d %d %s\n' % (
+                        original, minified, original - minified,
+                        package or '.'))
+                report.write(u'%d %d %d total\n' % (
+                    original_total, minified_total,
+                    original_total - minified_total))
+
+    def prune_unreachable(self, stored_resources, import_roots):
+        """Drop Python modules that can't be reached from __main__.py
+
+        See import_graph.py for the rules used.  Only sources with a
+        module name under some import root can be dropped, other files
+        may be read as data.  Optionally writes a report listing each
+        Python module kept or dropped.
+
+        Returns:
+            A new dict of store_filename to StoredResource
+        """
+        logging.debug('Finding modules reachable from __main__.py...')
+        sources = dict(
+            (stored_path, resource.read)
+            for stored_path, resource in stored_resources.items()
+            if stored_path.endswith('.py'))
+        graph = import_graph.ImportGraph(sources, import_roots)
+        runtime_prefix = _runtime_package.replace('.', '/') + '/'
+        root_paths = ['__main__.py'] + [
+            stored_path for stored_path in sources
+            if stored_path.startswith(runtime_prefix)]
+        reachable = graph.reachable(root_paths, self.options.keep_modules)
+
+        modules = graph.names
+        dropped = set(stored_path for stored_path in modules
+                      if stored_path not in reachable)
+        # Bytecode for dropped sources is unreachable too
+        dropped.update(stored_path + 'c' for stored_path in list(dropped)
+                       if stored_path + 'c' in stored_resources)
+        logging.info('Keeping %d of %d Python modules',
+                     len(modules) - len(dropped & set(modules)),
+                     len(modules))
+
+        if self.options.prune_report_filename:
+            with io.open(self.options.prune_report_filename, 'wt',
+                         encoding='utf8') as report:
+                for stored_path in sorted(stored_resources):
+                    if stored_path in dropped:
+                        report.write(u'drop %s\n' % stored_path)
+                    elif stored_path in modules:
+                        report.write(u'keep %s\n' % stored_path)
+
+        return dict(item for item in stored_resources.items()
+                    if item[0] not in dropped)
+
+    def deduplicate(self, stored_resources, import_roots):
+        """Store each distinct file content once.
+
+        Other paths with the same content are removed from
+        stored_resources, and listed in an alias table instead.  At
+        runtime, support.install_aliases() makes them readable and
+        importable through zipimport, and extraction copies them.
+        Other readers, such as zipfile, pkg_resources and
+        importlib.resources, or Python running the archive without the
+        runtime, don't see aliases, so only Python modules are made
+        aliases.  Entries needed
+        before that runs, and empty files, are never aliased.
+
+        Of each group of copies, the one stored first is kept, so that
+        copies in the layout profile stay in the readahead region.
+
+        Args:
+            stored_resources: dict of stored path to StoredResource
+            import_roots: Import roots of the .par file, which decide
+                what is a module
+
+        Returns:
+            dict of alias stored path to the stored path holding its
+            content
+        """
+        runtime_prefix = _runtime_package.replace('.', '/') + '/'
+        # Only files of the same size can be identical, so hash just
+        # those.
+        by_size = {}
+        for stored_path, resource in stored_resources.items():
+            if (stored_path == '__main__.py' or
+                    stored_path in _runtime_init_files or
+                    stored_path.startswith(runtime_prefix)):
+                continue
+            size = resource.size()
+            if size:
+                by_size.setdefault(size, []).append(stored_path)
+
+        storage_order = dict(
+            (stored_path, i) for i, (stored_path, _) in
+            enumerate(self.order_resources(stored_resources)))
+        aliases = {}
+        for paths in by_size.values():
+            if len(paths) < 2:
+                continue
+            by_digest = {}
+            for stored_path in paths:
+                digest = hashlib.sha256(
+                    stored_resources[stored_path].read()).digest()
+                by_digest.setdefault(digest, []).append(stored_path)
+            for copies in by_digest.values():
+                copies.sort(key=storage_order.get)
+                for alias in copies[1:]:
+                    if _is_module(alias, import_roots):
+                        aliases[alias] = copies[0]
+                        del stored_resources[alias]
+
+        if aliases:
+            logging.info('Storing %d files as aliases of identical files',
+                         len(aliases))
+            table = u''.join(u'%s\t%s\n' % item
+                             for item in sorted(aliases.items()))
+            stored_resources[_alias_table] = stored_resource.StoredContent(
+                _alias_table, self.timestamp_tuple, table.encode('utf8'))
+        return aliases
+
+    def verify(self, parfile_name, stored_resources, aliases):
+        """Check that every path reads back with its intended content.
+
+        The archive is read with the unmodified zipfile and zipimport
+        modules, which must read every stored entry.  Aliases aren't
+        in the zip directory, so instead the alias table must list
+        each of them, pointing at a stored entry.
+
+        Raises:
+            Error
+        """
+        logging.debug('Verifying [%s]...', parfile_name)
+        expected = {}
+        for stored_path, resource in stored_resources.items():
+            expected[stored_path] = hashlib.sha256(resource.read()).digest()
+
+        with contextlib.closing(zipfile.ZipFile(parfile_name)) as z:
+            bad_entry = z.testzip()
+            if bad_entry is not None:
+                raise error.Error('Verification failed: bad CRC for [%s]' %
+                                  bad_entry)
+            names = z.namelist()
+            if sorted(names) != sorted(stored_resources):
+                raise error.Error(
+                    'Verification failed: zipfile lists %d entries, '
+                    'expected %d' % (len(names), len(stored_resources)))
+            for name in names:
+                if hashlib.sha256(z.read(name)).digest() != expected[name]:
+                    raise error.Error(
+                        'Verification failed: zipfile reads wrong content '
+                        'for [%s]' % name)
+            table = {}
+            if _alias_table in expected:
+                for line in z.read(_alias_table).decode(
+                        'utf8').splitlines():
+                    alias, stored_path = line.split('\t')
+                    table[alias] = stored_path
+            if table != aliases or not set(table.values()) <= set(names):
+                raise error.Error(
+                    'Verification failed: alias table doesn\'t match the '
+                    '%d aliases' % len(aliases))
+
+        importer = zipimport.zipimporter(parfile_name)
+        try:
+            for stored_path in sorted(expected):
+                try:
+                    content = importer.get_data(
+                        stored_path.replace('/', os.sep))
+                except (IOError, OSError):
+                    content = None
+                if (content is None or
+                        hashlib.sha256(content).digest() !=
+                        expected[stored_path]):
+                    raise error.Error(
+                        'Verification failed: zipimport reads wrong '
+                        'content for [%s]' % stored_path)
+        finally:
+            zipimport._zip_directory_cache.pop(importer.archive, None)
+        logging.debug('Verified %d entries and %d aliases', len(expected),
+                      len(aliases))
+
     def write_bootstrap(self, temp_parfile):
         """Write the first part of the parfile
 
         This tells the operating system (well, UNIX) how to execute the file.
         """
         logging.debug('Writing boilerplate...')
-        boilerplate = '#!%s\n' % self.interpreter
+        boilerplate = generate_bootstrap(self.interpreter,
+                                         self.options.interpreter_flags)
         temp_parfile.write(boilerplate.encode('ascii'))
 
     def write_zip_data(self, temp_parfile, stored_resources):
@@ -277,11 +1249,33 @@ class PythonArchive(object):
 
         logging.debug('Storing Files...')
         with contextlib.closing(zipfile.ZipFile(temp_parfile, 'w', self.compression)) as z:
-            items = sorted(stored_resources.items())
+            items = self.order_resources(stored_resources)
             for relative_path, resource in items:
                 assert resource.zipinfo.filename == relative_path
                 resource.store(z)
 
+    def order_resources(self, stored_resources):
+        """Return the (relative path, resource) pairs in storage order.
+
+        Entries named in the layout profile come first, in the order
+        they were first accessed, so that the runtime can read them
+        with a single sequential readahead.  Everything else follows
+        in sorted order.
+        """
+        hot_items = []
+        for relative_path in self.hot_paths:
+            resource = stored_resources.get(relative_path)
+            if resource is not None:
+                hot_items.append((relative_path, resource))
+        skipped = len(self.hot_paths) - len(hot_items)
+        if skipped:
+            logging.debug('Skipping %d layout profile entries not in parfile',
+                          skipped)
+        hot_set = set(path for path, _ in hot_items)
+        cold_items = sorted(item for item in stored_resources.items()
+                            if item[0] not in hot_set)
+        return hot_items + cold_items
+
     def create_final_from_temp(self, temp_parfile_name):
         """Move newly created parfile to its final filename."""
         # Python 2 doesn't have os.replace, so use os.rename which is
@@ -290,6 +1284,72 @@ class PythonArchive(object):
         os.rename(temp_parfile_name, self.output_filename)
 
 
+def generate_bootstrap(interpreter, interpreter_flags=()):
+    """Return the text that starts a .par file and runs the interpreter.
+
+    Linux passes everything after the interpreter on a #! line as a
+    single argument.  So a #! line is only used when the interpreter
+    is one word and there's at most one flag.  Otherwise, the file
+    starts as a shell script that runs the interpreter on itself.
+    """
+    if not interpreter_flags:
+        return '#!%s\n' % interpreter
+    if (len(interpreter.split()) == 1 and len(interpreter_flags) == 1 and
+            len(interpreter_flags[0].split()) == 1):
+        return '#!%s %s\n' % (interpreter, interpreter_flags[0])
+    command = shlex.split(interpreter) + list(interpreter_flags)
+    return _shell_bootstrap_template % {
+        'command': ' '.join(shell_quote(arg) for arg in command),
+    }
+
+
+def generate_script_bootstrap(interpreter, interpreter_flags=()):
+    """Return the text that starts a Python script and runs it.
+
+    Like generate_bootstrap(), except that the shell script form is
+    also valid Python.
+    """
+    bootstrap = generate_bootstrap(interpreter, interpreter_flags)
+    if not bootstrap.startswith('#!/bin/sh\n'):
+        return bootstrap
+    command = shlex.split(interpreter) + list(interpreter_flags)
+    return _script_shell_bootstrap_template % {
+        'command': ' '.join(shell_quote(arg) for arg in command),
+    }
+
+
+def _in_packages(stored_path, import_roots, names):
+    """Return True if a Python source is one of the named modules.
+
+    A module is named if its name, under any import root, is one of
+    names or in one of the packages named.
+    """
+    for import_root in [''] + list(import_roots):
+        name_info = import_graph.module_name(stored_path, import_root)
+        if name_info is None:
+            continue
+        for name in names:
+            if name_info[0] == name or name_info[0].startswith(name + '.'):
+                return True
+    return False
+
+
+def _is_module(stored_path, import_roots):
+    """Return whether a stored path can be imported as a Python module"""
+    return any(import_graph.module_name(stored_path, import_root)
+               for import_root in [''] + list(import_roots))
+
+
+def _directories(stored_paths):
+    """Return the set of directories holding the given stored paths"""
+    directories = set()
+    for stored_path in stored_paths:
+        parts = stored_path.split('/')[:-1]
+        for i in range(1, len(parts) + 1):
+            directories.add('/'.join(parts[:i]))
+    return directories
+
+
 def remove_if_present(filename):
     """Delete a file if it exists"""
     try:
@@ -12,13 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fcntl
+import json
+import marshal
 import os
+import shutil
+import socket
 import subprocess
 import sys
 import time
 import unittest
 import zipfile
 
+from subpar.compiler import bytecode
 from subpar.compiler import error
 from subpar.compiler import python_archive
 from subpar.compiler import stored_resource
@@ -52,7 +58,8 @@ class PythonArchiveTest(unittest.TestCase):
         self.timestamp = 315532800
         self.zip_safe = True
 
-    def _construct(self, manifest_filename=None):
+    def _construct(self, manifest_filename=None, workspace_name=None,
+                   **options):
         return python_archive.PythonArchive(
             main_filename=self.main_file.name,
             interpreter=self.interpreter,
@@ -62,6 +69,8 @@ class PythonArchiveTest(unittest.TestCase):
             output_filename=self.output_filename,
             timestamp=self.timestamp,
             zip_safe=self.zip_safe,
+            workspace_name=workspace_name,
+            options=python_archive.Options(**options),
         )
 
     def test_create_manifest_not_found(self):
@@ -82,6 +91,26 @@ class PythonArchiveTest(unittest.TestCase):
             with self.assertRaises(error.Error):
                 par.create()
 
+    def test_create_workspace_name(self):
+        manifest_content = '%s %s\n' % (
+            os.path.basename(self.main_file.name), self.main_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  workspace_name='wwwww')
+            par.create()
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertIn(
+            'wwwww/' + os.path.basename(self.main_file.name), z.namelist())
+        z.close()
+
+    def test_create_workspace_name_main_not_in_manifest(self):
+        with test_utils.temp_file(b'foo.py\n') as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  workspace_name='wwwww')
+            with self.assertRaises(error.Error):
+                par.create()
+
     def test_create_source_file_not_found(self):
         with test_utils.temp_file(b'foo.py doesnotexist.py\n') as manifest_file:
             par = self._construct(manifest_filename=manifest_file.name)
@@ -129,6 +158,853 @@ class PythonArchiveTest(unittest.TestCase):
         content2 = open(par2.output_filename, 'rb').read()
         self.assertEqual(content1, content2)
 
+    def test_create_layout_profile(self):
+        stored_name = os.path.basename(self.main_file.name)
+        profile = '# trace\n__main__.py\n%s\nsubpar/runtime/support.py\n' % (
+            stored_name)
+        with test_utils.temp_file(profile.encode('utf8')) as profile_file:
+            par = self._construct(layout_profile_filename=profile_file.name)
+            par.create()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'Hello World!\n')
+        z = zipfile.ZipFile(self.output_filename)
+        names = [zipinfo.filename for zipinfo in z.infolist()]
+        z.close()
+        self.assertEqual(names[:3], [
+            '__main__.py', stored_name, 'subpar/runtime/support.py'])
+        self.assertEqual(names[3:], sorted(names[3:]))
+
+    def test_create_access_trace(self):
+        par = self._construct()
+        par.create()
+        trace_filename = os.path.join(self.tmpdir, 'trace.txt')
+        env = dict(os.environ)
+        env['SUBPAR_ACCESS_TRACE'] = trace_filename
+        self.assertEqual(
+            subprocess.check_output([self.output_filename], env=env),
+            b'Hello World!\n')
+        with open(trace_filename) as f:
+            trace = f.read()
+        self.assertIn(' import __main__.py\n', trace)
+        self.assertIn('# untouched: ', trace)
+        # The trace can be used as a layout profile
+        self.output_filename = self.output_filename + '2'
+        par = self._construct(layout_profile_filename=trace_filename)
+        par.create()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'Hello World!\n')
+
+    def test_create_prune_imports(self):
+        unused_file = test_utils.temp_file(b'X = 1\n', suffix='.py')
+        manifest_content = '%s %s\nlib/data.txt %s\nlib/unused.py %s\n' % (
+            os.path.basename(self.main_file.name), self.main_file.name,
+            unused_file.name, unused_file.name)
+        profile = '__main__.py\nlib/data.txt\nlib/unused.py\n'
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            with test_utils.temp_file(
+                    profile.encode('utf8')) as profile_file:
+                par = self._construct(
+                    manifest_filename=manifest_file.name,
+                    layout_profile_filename=profile_file.name,
+                    prune_imports=True)
+                par.create()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'Hello World!\n')
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertNotIn('lib/unused.py', z.namelist())
+        # Readahead ends at the last hot entry that was kept
+        self.assertIn(b"readahead_until='lib/data.txt'",
+                      z.read('__main__.py'))
+        z.close()
+
+    def test_create_minify_sources(self):
+        lib_file = test_utils.temp_file(
+            b'"""Doc"""\n# Comment\nassert True\nX = 1\n', suffix='.py')
+        manifest_content = '%s %s\nlib/lib.py %s\n' % (
+            os.path.basename(self.main_file.name), self.main_file.name,
+            lib_file.name)
+        report_filename = os.path.join(self.tmpdir, 'minify_report.txt')
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  minify_sources=True,
+                                  minify_report_filename=report_filename)
+            par.create()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'Hello World!\n')
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertEqual(z.read('lib/lib.py'), b'\n\npass\nX = 1\n')
+        z.close()
+        with open(report_filename) as f:
+            report = f.read()
+        self.assertIn('38 13 25 lib\n', report)
+
+    def test_create_build_report(self):
+        lib_file = test_utils.temp_file(b'X = 1\n' * 100, suffix='.py')
+        manifest_content = '%s %s\nlib/lib.py %s\n' % (
+            os.path.basename(self.main_file.name), self.main_file.name,
+            lib_file.name)
+        report_filename = os.path.join(self.tmpdir, 'build_report.json')
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  build_report_filename=report_filename)
+            par.create()
+        with open(report_filename) as f:
+            report = json.load(f)
+        self.assertEqual([phase['name'] for phase in report['phases']],
+                         ['parse', 'scan', 'write', 'rename'])
+        entries = dict((entry['path'], entry) for entry in report['entries'])
+        self.assertEqual(entries['lib/lib.py']['size'], 600)
+        self.assertIn('__main__.py', entries)
+        self.assertEqual(report['by_directory']['lib']['entries'], 1)
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertEqual(report['total']['entries'], len(z.namelist()))
+        self.assertEqual(entries['lib/lib.py']['compressed_size'],
+                         z.getinfo('lib/lib.py').compress_size)
+        z.close()
+
+    def test_create_dedup_content(self):
+        main_file = test_utils.temp_file(
+            b'import importlib\n'
+            b'getattr(importlib, "invalidate_caches", lambda: None)()\n'
+            b'import lib.a, lib.b\nprint(lib.b.X)', suffix='.py')
+        lib_file = test_utils.temp_file(b'X = "same"\n', suffix='.py')
+        manifest_content = (
+            '%s %s\nlib/__init__.py\nlib/a.py %s\nlib/b.py %s\n' % (
+                os.path.basename(main_file.name), main_file.name,
+                lib_file.name, lib_file.name))
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  dedup_content=True, verify_archive=True)
+            par.main_filename = main_file.name
+            par.create()
+        z = zipfile.ZipFile(self.output_filename)
+        names = z.namelist()
+        self.assertIn('lib/a.py', names)
+        self.assertNotIn('lib/b.py', names)
+        self.assertEqual(z.read('subpar/runtime/aliases.txt'),
+                         b'lib/b.py\tlib/a.py\n')
+        z.close()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'same\n')
+
+    def test_create_dependency_archive(self):
+        main_file = test_utils.temp_file(
+            b'import six\nprint(six.X)', suffix='.py')
+        six_file = test_utils.temp_file(b'X = "from deps"\n', suffix='.py')
+        manifest_content = '%s %s\n../pypi__six/six.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name, six_file.name)
+        dependency_filename = os.path.join(self.output_dir, 'output_deps.par')
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  workspace_name='wwwww',
+                                  dependency_filename=dependency_filename)
+            par.main_filename = main_file.name
+            par.create()
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertNotIn('pypi__six/six.py', z.namelist())
+        self.assertIn('wwwww/' + os.path.basename(main_file.name),
+                      z.namelist())
+        main_content = z.read('__main__.py')
+        z.close()
+        z = zipfile.ZipFile(dependency_filename)
+        self.assertEqual(z.namelist(), [
+            'pypi__six/six.py', 'subpar/runtime/dependency_digest.txt'])
+        digest = z.read('subpar/runtime/dependency_digest.txt')
+        z.close()
+        self.assertIn(b"dependency_archives=[('output_deps.par', ",
+                      main_content)
+        self.assertIn(b"['pypi__six'])]", main_content)
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]),
+            b'from deps\n')
+
+        # The dependency archive can also be found by digest
+        deps_dir = test_utils.mkdtemp()
+        os.rename(dependency_filename,
+                  os.path.join(deps_dir, digest.decode('ascii') + '.par'))
+        env = dict(os.environ)
+        env['SUBPAR_DEPENDENCY_PATH'] = deps_dir
+        self.assertEqual(
+            subprocess.check_output([self.output_filename], env=env),
+            b'from deps\n')
+
+    def test_create_dependency_archive_no_workspace(self):
+        par = self._construct(dependency_filename=os.path.join(
+            self.output_dir, 'output_deps.par'))
+        with self.assertRaises(error.Error):
+            par.create()
+
+    def test_generate_bootstrap(self):
+        self.assertEqual(python_archive.generate_bootstrap('/usr/bin/python'),
+                         '#!/usr/bin/python\n')
+        self.assertEqual(
+            python_archive.generate_bootstrap('/usr/bin/python', ['-SE']),
+            '#!/usr/bin/python -SE\n')
+        self.assertEqual(
+            python_archive.generate_bootstrap('/usr/bin/env python3', ['-S']),
+            '#!/bin/sh\nexec /usr/bin/env python3 -S "$0" "$@"\n')
+        self.assertEqual(
+            python_archive.generate_bootstrap(
+                '/usr/bin/python3', ['-X', 'frozen_modules=on', '-X', 'a b']),
+            '#!/bin/sh\nexec /usr/bin/python3 -X frozen_modules=on -X '
+            '\'a b\' "$0" "$@"\n')
+
+    def test_create_interpreter_flags(self):
+        main_file = test_utils.temp_file(
+            b'import sys\nprint(sys.flags.no_site)', suffix='.py')
+        manifest_content = '%s %s\n' % (
+            os.path.basename(main_file.name), main_file.name)
+        for interpreter_flags in (['-S'], ['-S', '-E', '-s']):
+            with test_utils.temp_file(
+                    manifest_content.encode('utf8')) as manifest_file:
+                par = self._construct(manifest_filename=manifest_file.name,
+                                      interpreter_flags=interpreter_flags)
+                par.main_filename = main_file.name
+                par.create()
+            self.assertEqual(
+                subprocess.check_output([self.output_filename]), b'1\n')
+            z = zipfile.ZipFile(self.output_filename)
+            self.assertIn('__main__.py', z.namelist())
+            z.close()
+
+    def test_generate_script_bootstrap(self):
+        self.assertEqual(
+            python_archive.generate_script_bootstrap('/usr/bin/python',
+                                                     ['-SE']),
+            '#!/usr/bin/python -SE\n')
+        bootstrap = python_archive.generate_script_bootstrap(
+            '/usr/bin/python3', ['-S', '-E'])
+        self.assertEqual(
+            bootstrap,
+            '#!/bin/sh\n' +
+            '\'\'\'\'exec /usr/bin/python3 -S -E "$0" "$@" #\'\'\'\n')
+        # Also a Python script
+        compile(bootstrap, 'bootstrap', 'exec')
+
+    def test_create_dev_launcher(self):
+        main_file = test_utils.temp_file(
+            b'import sys\n' +
+            b'import mod\n' +
+            b'print(sys.flags.no_site)\n' +
+            b'print(mod.__file__)\n' +
+            b'print(sorted(k for k in globals() if not k.startswith("__")))\n',
+            suffix='.py')
+        mod_file = test_utils.temp_file(b'X = 1\n', suffix='.py')
+        manifest_content = 'main.py %s\nlib/mod.py %s\n' % (
+            main_file.name, mod_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  interpreter_flags=['-S', '-E'],
+                                  lazy_import_packages=['big'])
+            par.main_filename = main_file.name
+            par.create_dev_launcher()
+        with open(self.output_filename, 'rb') as f:
+            self.assertIn(b"lazy_imports=['big']", f.read())
+
+        # Bazel builds the runfiles tree
+        runfiles = self.output_filename + '.runfiles'
+        os.makedirs(os.path.join(runfiles, 'lib'))
+        os.symlink(main_file.name, os.path.join(runfiles, 'main.py'))
+        os.symlink(mod_file.name, os.path.join(runfiles, 'lib', 'mod.py'))
+        subpar_dir = os.path.dirname(os.path.dirname(
+            os.path.abspath(python_archive.__file__)))
+        os.symlink(subpar_dir, os.path.join(runfiles, 'subpar'))
+        output = subprocess.check_output([self.output_filename])
+        self.assertEqual(output.decode('utf8').splitlines(), [
+            '1', os.path.join(runfiles, 'lib', 'mod.py'),
+            "['_subpar_launch', 'mod', 'sys']"])
+
+        shutil.rmtree(runfiles)
+        process = subprocess.Popen([self.output_filename],
+                                   stderr=subprocess.PIPE)
+        _, stderr = process.communicate()
+        self.assertEqual(process.returncode, 1)
+        self.assertIn(b'runfiles not found', stderr)
+
+    @unittest.skipIf(sys.version_info[0] < 3, 'zygotes need Python 3')
+    def test_create_zygote(self):
+        main_file = test_utils.temp_file(
+            b'import sys\n' +
+            b'print(\'zygote_lib\' in sys.modules)\n' +
+            b'import zygote_lib\n' +
+            b'sys.stdout.write(sys.stdin.read())\n' +
+            b'sys.exit(int(sys.argv[1]))\n',
+            suffix='.py')
+        lib_file = test_utils.temp_file(b'X = 1\n', suffix='.py')
+        manifest_content = '%s %s\nzygote_lib.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name, lib_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  zygote=True)
+            par.main_filename = main_file.name
+            par.create()
+
+        zygote_dir = test_utils.mkdtemp()
+        env = dict(os.environ)
+        env['SUBPAR_ZYGOTE_DIR'] = zygote_dir
+        env['SUBPAR_ZYGOTE_IDLE_SECONDS'] = '10'
+        self.addCleanup(self._stop_zygotes, zygote_dir)
+
+        def run(argument, stdin):
+            process = subprocess.Popen(
+                [self.output_filename, argument], env=env,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            stdout, _ = process.communicate(stdin)
+            return process.returncode, stdout
+
+        # The first run starts the zygote, and returns once it listens
+        self.assertEqual(run('3', b'first'), (3, b'False\nfirst'))
+        # Later runs are forked from it, with zygote_lib already imported
+        self.assertEqual(run('4', b'second'), (4, b'True\nsecond'))
+        env['SUBPAR_ZYGOTE'] = '0'
+        self.assertEqual(run('0', b'third'), (0, b'False\nthird'))
+
+    def _stop_zygotes(self, zygote_dir):
+        """Make the zygotes in zygote_dir exit, and wait for them"""
+        # Zygotes exit when asked to run a changed .par file
+        os.utime(self.output_filename, (0, 0))
+        for name in os.listdir(zygote_dir):
+            if name.endswith('.sock'):
+                conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                try:
+                    conn.connect(os.path.join(zygote_dir, name))
+                except OSError:
+                    pass
+                conn.close()
+        # Each holds its lock until it exits
+        for name in os.listdir(zygote_dir):
+            if name.endswith('.lock'):
+                with open(os.path.join(zygote_dir, name)) as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+
+    @unittest.skipIf(sys.version_info < (3, 10),
+                     'frozen bundles need Python 3.10')
+    def test_create_freeze_modules(self):
+        main_file = test_utils.temp_file(
+            b'import sys\n' +
+            b'import zipimport\n' +
+            b'import pkg.mod\n' +
+            b'print(pkg.__file__)\n' +
+            b'print(pkg.__path__)\n' +
+            b'print(pkg.__spec__.origin)\n' +
+            b'print(pkg.mod.__file__)\n' +
+            b'print(pkg.mod.__spec__.parent)\n' +
+            b'print(pkg.mod.f.__code__.co_filename)\n' +
+            b'print(isinstance(pkg.mod.__loader__, zipimport.zipimporter))\n' +
+            b'print(type(pkg.mod.__loader__).__name__)\n',
+            suffix='.py')
+        init_file = test_utils.temp_file(b'', suffix='.py')
+        mod_file = test_utils.temp_file(b'def f():\n    pass\n',
+                                        suffix='.py')
+        manifest_content = '%s %s\npkg/__init__.py %s\npkg/mod.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name,
+            init_file.name, mod_file.name)
+        outputs = []
+        for freeze_modules in (False, True):
+            with test_utils.temp_file(
+                    manifest_content.encode('utf8')) as manifest_file:
+                par = self._construct(manifest_filename=manifest_file.name,
+                                      freeze_modules=freeze_modules)
+                par.main_filename = main_file.name
+                par.create()
+            outputs.append(subprocess.check_output(
+                [sys.executable, self.output_filename]).splitlines())
+        plain, frozen = outputs
+        # Module attributes are the same as with zipimport
+        self.assertEqual(frozen[:-1], plain[:-1])
+        self.assertTrue(frozen[3].endswith(b'/pkg/mod.py'), frozen)
+        self.assertEqual(frozen[5], frozen[3])
+        self.assertEqual(plain[-1], b'zipimporter')
+        self.assertEqual(frozen[-1], b'FrozenZipImporter')
+        with zipfile.ZipFile(self.output_filename) as z:
+            bundle = z.read('subpar/runtime/frozen_code.bin')
+        self.assertIn(b'pkg/mod.py', bundle)
+        self.assertNotIn(b'subpar/runtime/support.py', bundle)
+
+    @unittest.skipIf(sys.version_info < (3, 10),
+                     'the bytecode cache needs Python 3.10')
+    def test_create_bytecode_cache(self):
+        main_file = test_utils.temp_file(
+            b'import lib\n' +
+            b'print(lib.__file__)\n' +
+            b'print(lib.f.__code__.co_filename)\n',
+            suffix='.py')
+        lib_file = test_utils.temp_file(b'def f():\n    pass\n', suffix='.py')
+        manifest_content = '%s %s\nlib.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name, lib_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  bytecode_cache=True)
+            par.main_filename = main_file.name
+            par.create()
+        cache_dir = test_utils.mkdtemp()
+        env = dict(os.environ)
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        env['SUBPAR_BYTECODE_CACHE'] = cache_dir
+        first = subprocess.check_output(
+            [sys.executable, self.output_filename], env=env)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        second = subprocess.check_output(
+            [sys.executable, self.output_filename], env=env)
+        self.assertEqual(second, first)
+        lib_path = os.path.join(self.output_filename, 'lib.py').encode()
+        self.assertEqual(first.splitlines(), [lib_path, lib_path])
+
+    def test_should_freeze(self):
+        par = self._construct(frozen_modules=['pkg'])
+        self.assertTrue(par.should_freeze('pkg/__init__.py', []))
+        self.assertTrue(par.should_freeze('root/pkg/mod.py', ['root']))
+        self.assertFalse(par.should_freeze('pkg2/mod.py', []))
+        self.assertFalse(par.should_freeze('__main__.py', []))
+        par = self._construct()
+        self.assertTrue(par.should_freeze('pkg2/mod.py', []))
+        self.assertFalse(par.should_freeze('subpar/runtime/support.py', []))
+
+    @unittest.skipIf(sys.version_info < (3, 10),
+                     'lazy imports from the archive need Python 3.10')
+    def test_create_lazy_imports(self):
+        main_file = test_utils.temp_file(
+            b'import sys\n' +
+            b'import big.used\n' +
+            b'import big.unused\n' +
+            b'print(big.used.X)\n' +
+            b'print(big.used.__file__)\n',
+            suffix='.py')
+        init_file = test_utils.temp_file(b'', suffix='.py')
+        used_file = test_utils.temp_file(b'X = 1\n', suffix='.py')
+        unused_file = test_utils.temp_file(b'raise ImportError()\n',
+                                           suffix='.py')
+        manifest_content = (
+            '%s %s\nbig/__init__.py %s\nbig/used.py %s\n'
+            'big/unused.py %s\n' % (
+                os.path.basename(main_file.name), main_file.name,
+                init_file.name, used_file.name, unused_file.name))
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  lazy_import_packages=['big'])
+            par.main_filename = main_file.name
+            par.create()
+        report_filename = os.path.join(test_utils.mkdtemp(), 'lazy.txt')
+        env = dict(os.environ)
+        env['SUBPAR_LAZY_IMPORT_REPORT'] = report_filename
+        output = subprocess.check_output(
+            [sys.executable, self.output_filename], env=env)
+        used_path = os.path.join(self.output_filename, 'big', 'used.py')
+        self.assertEqual(output.splitlines(), [b'1', used_path.encode()])
+        with open(report_filename) as f:
+            report = [line.split()[:2] for line in f.read().splitlines()]
+        self.assertEqual(report, [
+            ['loaded', 'big'], ['loaded', 'big.used'],
+            ['deferred', 'big.unused']])
+
+    @unittest.skipIf(sys.version_info < (3, 4),
+                     'multiprocessing contexts need Python 3.4')
+    def test_create_child_processes(self):
+        main_file = test_utils.temp_file(
+            b'import multiprocessing\n' +
+            b'import subprocess\n' +
+            b'import sys\n' +
+            b'def where():\n' +
+            b'    return sys.path[0]\n' +
+            b'if __name__ == "__main__":\n' +
+            b'    print(where())\n' +
+            b'    if sys.argv[1:] != ["child"]:\n' +
+            b'        spawn = multiprocessing.get_context("spawn")\n' +
+            b'        with spawn.Pool(1) as p:\n' +
+            b'            print(p.apply(where))\n' +
+            b'        sys.stdout.flush()\n' +
+            b'        subprocess.check_call(\n' +
+            b'            [sys.executable, sys.argv[0], "child"])\n',
+            suffix='.py')
+        manifest_content = '%s %s\n' % (
+            os.path.basename(main_file.name), main_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            self.zip_safe = False
+            par = self._construct(manifest_filename=manifest_file.name)
+            par.main_filename = main_file.name
+            par.create()
+        output = subprocess.check_output(
+            [sys.executable, self.output_filename])
+        # The spawned worker and the re-executed .par file use the
+        # parent's extraction, which is gone once they all exit
+        extract_dirs = output.decode('utf8').splitlines()
+        self.assertEqual(len(extract_dirs), 3)
+        self.assertEqual(len(set(extract_dirs)), 1)
+        self.assertNotEqual(extract_dirs[0], self.output_filename)
+        self.assertFalse(os.path.exists(extract_dirs[0]))
+
+    def test_create_install(self):
+        main_file = test_utils.temp_file(
+            b'import os\n' +
+            b'import sys\n' +
+            b'import mod\n' +
+            b'print(os.path.splitext(mod.__file__)[0])\n' +
+            b'print(sys.path[1])\n',
+            suffix='.py')
+        mod_file = test_utils.temp_file(b'X = 1\n', suffix='.py')
+        manifest_content = '%s %s\nlib/mod.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name, mod_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name)
+            par.main_filename = main_file.name
+            par.create()
+        launcher = os.path.join(test_utils.mkdtemp(), 'app')
+        env = dict(os.environ)
+        env['SUBPAR_INSTALL'] = launcher
+        output = subprocess.check_output(
+            [sys.executable, self.output_filename], env=env)
+        self.assertEqual(output.decode('utf8'), 'Installed %s as %s\n' % (
+            self.output_filename, launcher))
+
+        os.remove(self.output_filename)
+        output = subprocess.check_output([launcher])
+        lib_dir = os.path.join(launcher + '.runfiles', 'lib')
+        self.assertEqual(output.decode('utf8').splitlines(), [
+            os.path.join(lib_dir, 'mod'), lib_dir])
+
+    def test_compute_prefetch_paths(self):
+        resources = dict((path, None) for path in [
+            '__main__.py', 'pkg/__init__.py', 'pkg/a.py', 'pkg/b.py',
+            'pkg/data.txt', 'other.py', 'subpar/runtime/support.py'])
+        par = self._construct(prefetch_modules=['pkg'])
+        self.assertEqual(par.compute_prefetch_paths(resources, []),
+                         ['pkg/__init__.py', 'pkg/a.py', 'pkg/b.py'])
+
+        # Profile order first, then the named modules
+        par = self._construct(prefetch_modules=['pkg'], prefetch_profile=True,
+                              layout_profile_filename='profile.txt')
+        par.hot_paths = ['pkg/b.pyc', 'other.py', 'pkg/data.txt',
+                         '__main__.py', 'subpar/runtime/support.py',
+                         'missing.py']
+        self.assertEqual(par.compute_prefetch_paths(resources, []), [
+            'pkg/b.py', 'other.py', 'pkg/__init__.py', 'pkg/a.py'])
+
+        # Frozen modules are loaded from the bundle instead
+        par.options = par.options._replace(freeze_modules=True,
+                                           frozen_modules=['pkg'])
+        self.assertEqual(par.compute_prefetch_paths(resources, []),
+                         ['other.py'])
+
+        par = self._construct(prefetch_profile=True)
+        with self.assertRaises(error.Error):
+            par.compute_prefetch_paths(resources, [])
+
+    @unittest.skipIf(sys.version_info < (3, 10),
+                     'prefetching needs Python 3.10')
+    def test_create_prefetch(self):
+        main_file = test_utils.temp_file(
+            b'import pkg.mod\n' +
+            b'print(pkg.__file__)\n' +
+            b'print(pkg.mod.__file__)\n' +
+            b'print(pkg.mod.f.__code__.co_filename)\n' +
+            b'print(pkg.mod.X)\n' +
+            b'print(type(pkg.mod.__loader__).__name__)\n',
+            suffix='.py')
+        init_file = test_utils.temp_file(b'', suffix='.py')
+        mod_file = test_utils.temp_file(b'X = 1\ndef f():\n    pass\n',
+                                        suffix='.py')
+        manifest_content = '%s %s\npkg/__init__.py %s\npkg/mod.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name,
+            init_file.name, mod_file.name)
+        outputs = []
+        for prefetch_modules in [(), ['pkg']]:
+            with test_utils.temp_file(
+                    manifest_content.encode('utf8')) as manifest_file:
+                par = self._construct(manifest_filename=manifest_file.name,
+                                      prefetch_modules=prefetch_modules)
+                par.main_filename = main_file.name
+                par.create()
+            outputs.append(subprocess.check_output(
+                [sys.executable, self.output_filename]).splitlines())
+        self.assertEqual(outputs[1][:-1], outputs[0][:-1])
+        self.assertEqual(outputs[0][-1], b'zipimporter')
+        self.assertEqual(outputs[1][-1], b'PrefetchingZipImporter')
+        with zipfile.ZipFile(self.output_filename) as z:
+            self.assertEqual(z.read('subpar/runtime/prefetch.txt'),
+                             b'pkg/__init__.py\npkg/mod.py\n')
+
+    def test_deduplicate(self):
+        par = self._construct()
+        resources = {
+            'a.py': stored_resource.StoredContent(
+                'a.py', self.date_time_tuple, b'same'),
+            'b.py': stored_resource.StoredContent(
+                'b.py', self.date_time_tuple, b'same'),
+            'c.py': stored_resource.StoredContent(
+                'c.py', self.date_time_tuple, b'diff'),
+            'data.txt': stored_resource.StoredContent(
+                'data.txt', self.date_time_tuple, b'same'),
+            'e1.py': stored_resource.EmptyFile('e1.py', self.date_time_tuple),
+            'e2.py': stored_resource.EmptyFile('e2.py', self.date_time_tuple),
+            'pypi__six/six.py': stored_resource.StoredContent(
+                'pypi__six/six.py', self.date_time_tuple, b'same'),
+            'not-a-package/d.py': stored_resource.StoredContent(
+                'not-a-package/d.py', self.date_time_tuple, b'same'),
+            'subpar/runtime/x.py': stored_resource.StoredContent(
+                'subpar/runtime/x.py', self.date_time_tuple, b'same'),
+        }
+        aliases = par.deduplicate(resources, ['pypi__six'])
+        self.assertEqual(aliases, {'b.py': 'a.py', 'pypi__six/six.py': 'a.py'})
+        self.assertEqual(sorted(resources), [
+            'a.py', 'c.py', 'data.txt', 'e1.py', 'e2.py',
+            'not-a-package/d.py', 'subpar/runtime/aliases.txt',
+            'subpar/runtime/x.py'])
+        self.assertEqual(par.deduplicate({}, []), {})
+
+    def test_verify(self):
+        par = self._construct()
+        resources = {
+            'a': stored_resource.StoredContent(
+                'a', self.date_time_tuple, b'same'),
+        }
+        with zipfile.ZipFile(self.output_filename, 'w') as z:
+            z.writestr('a', b'same')
+        par.verify(self.output_filename, resources, {})
+        resources['a'] = stored_resource.StoredContent(
+            'a', self.date_time_tuple, b'different')
+        with self.assertRaises(error.Error):
+            par.verify(self.output_filename, resources, {})
+        # An alias without a table to install it
+        with self.assertRaises(error.Error):
+            par.verify(self.output_filename, {
+                'a': stored_resource.StoredContent(
+                    'a', self.date_time_tuple, b'same'),
+            }, {'b': 'a'})
+        table_name = 'subpar/runtime/aliases.txt'
+        resources = {
+            'a': stored_resource.StoredContent(
+                'a', self.date_time_tuple, b'same'),
+            table_name: stored_resource.StoredContent(
+                table_name, self.date_time_tuple, b'b\ta\n'),
+        }
+        with zipfile.ZipFile(self.output_filename, 'w') as z:
+            z.writestr('a', b'same')
+            z.writestr(table_name, b'b\ta\n')
+        par.verify(self.output_filename, resources, {'b': 'a'})
+        # The table must list exactly the aliases
+        with self.assertRaises(error.Error):
+            par.verify(self.output_filename, resources, {'b': 'a', 'c': 'a'})
+
+    def test_create_fragment(self):
+        lib_file = test_utils.temp_file(b'X = 1\n', suffix='.py')
+        manifest_content = 'lib/__init__.py\nlib/lib.py %s\n' % (
+            lib_file.name)
+        fragment_filename = os.path.join(self.output_dir, 'fragment.zip')
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            fragment = python_archive.PythonArchive(
+                main_filename=None,
+                interpreter=None,
+                import_roots=[],
+                manifest_filename=manifest_file.name,
+                manifest_root=os.getcwd(),
+                output_filename=fragment_filename,
+                timestamp=self.timestamp,
+                zip_safe=self.zip_safe)
+            fragment.create_fragment()
+        z = zipfile.ZipFile(fragment_filename)
+        self.assertEqual(z.namelist(), ['lib/__init__.py', 'lib/lib.py'])
+        z.close()
+
+        # Use the fragment instead of the local files
+        manifest_content = '%s %s\nlib/__init__.py\nlib/lib.py %s\n' % (
+            os.path.basename(self.main_file.name), self.main_file.name,
+            '/nonexistent/lib.py')
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  fragment_filenames=[fragment_filename])
+            par.create()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'Hello World!\n')
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertEqual(z.testzip(), None)
+        self.assertEqual(z.read('lib/lib.py'), b'X = 1\n')
+        z.close()
+
+    def test_create_zip_input(self):
+        wheel_filename = os.path.join(
+            self.input_dir, 'lib-1.0-py3-none-any.whl')
+        with zipfile.ZipFile(wheel_filename, 'w') as z:
+            z.writestr('lib/', b'')
+            z.writestr(zipfile.ZipInfo('lib/__init__.py'),
+                       b'from lib.sub import X\n',
+                       compress_type=zipfile.ZIP_DEFLATED)
+            z.writestr('lib-1.0.data/purelib/lib/sub.py', b'X = "sub"\n')
+            z.writestr('lib-1.0.dist-info/METADATA', b'Name: lib\n')
+        main_file = test_utils.temp_file(
+            b'import lib\nprint(lib.X)\n', suffix='.py')
+        manifest_content = '%s %s\n' % (
+            os.path.basename(main_file.name), main_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(manifest_filename=manifest_file.name,
+                                  zip_inputs=[('pypi__lib', wheel_filename)])
+            par.main_filename = main_file.name
+            par.create()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'sub\n')
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertEqual(z.testzip(), None)
+        self.assertEqual(z.getinfo('pypi__lib/lib/__init__.py').compress_type,
+                         zipfile.ZIP_DEFLATED)
+        self.assertIn('pypi__lib/lib-1.0.dist-info/METADATA', z.namelist())
+        z.close()
+
+    def test_create_zip_input_nested_prefix(self):
+        zip_filename = os.path.join(self.input_dir, 'six.zip')
+        with zipfile.ZipFile(zip_filename, 'w') as z:
+            z.writestr('six.py', b'X = "six"\n')
+        main_file = test_utils.temp_file(
+            b'import six\nprint(six.X)\n', suffix='.py')
+        manifest_content = 'ws/main.py %s\n' % main_file.name
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            par = self._construct(
+                manifest_filename=manifest_file.name,
+                zip_inputs=[('third_party/six', zip_filename)])
+            par.main_filename = main_file.name
+            self.assertEqual(
+                par.compute_import_roots({'ws/main.py': main_file.name}),
+                ['third_party/six', 'ws'])
+            par.create()
+        self.assertEqual(
+            subprocess.check_output([self.output_filename]), b'six\n')
+
+    def test_add_zip_input_collision(self):
+        zip_filename = os.path.join(self.input_dir, 'lib.zip')
+        with zipfile.ZipFile(zip_filename, 'w') as z:
+            z.writestr('lib.py', b'X = 1\n')
+        par = self._construct()
+        resources = {'ws/lib.py': stored_resource.StoredFile(
+            'ws/lib.py', self.date_time_tuple, '/something/lib.py')}
+        # Manifest files take precedence
+        par.add_zip_input(resources, 'ws', zip_filename)
+        self.assertIsInstance(resources['ws/lib.py'],
+                              stored_resource.StoredFile)
+        par.add_zip_input(resources, 'other', zip_filename)
+        with self.assertRaises(error.Error):
+            par.add_zip_input(resources, 'other', zip_filename)
+
+    def test_create_extra_manifest(self):
+        lib_file = test_utils.temp_file(b'X = "source"\n', suffix='.py')
+        pyc_file = test_utils.temp_file(bytecode.compile_source(
+            b'X = "bytecode"\n', 'lib/lib.py', -1, self.timestamp))
+        empty_pyc_file = test_utils.temp_file(b'')
+        main_file = test_utils.temp_file(
+            b'from lib import lib\nprint(lib.X)\n', suffix='.py')
+        manifest_content = '%s %s\nlib/__init__.py\nlib/lib.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name, lib_file.name)
+        extra_manifest_content = 'lib/lib.pyc %s\nlib/__init__.pyc %s\n' % (
+            pyc_file.name, empty_pyc_file.name)
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            with test_utils.temp_file(extra_manifest_content.encode(
+                    'utf8')) as extra_manifest_file:
+                par = self._construct(
+                    manifest_filename=manifest_file.name,
+                    extra_manifest_filenames=[extra_manifest_file.name])
+                par.main_filename = main_file.name
+                par.create()
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertIn('lib/lib.pyc', z.namelist())
+        # Empty bytecode files are left out
+        self.assertNotIn('lib/__init__.pyc', z.namelist())
+        z.close()
+        output = subprocess.check_output([self.output_filename])
+        if sys.version_info >= (3, 7):
+            # Unchecked hash-based .pyc files are always used
+            self.assertEqual(output, b'bytecode\n')
+        else:
+            self.assertIn(output, [b'source\n', b'bytecode\n'])
+
+    def test_create_extra_manifest_minified(self):
+        lib_file = test_utils.temp_file(b'"""Doc"""\nX = "source"\n',
+                                        suffix='.py')
+        pyc_file = test_utils.temp_file(bytecode.compile_source(
+            b'X = "bytecode"\n', 'lib/lib.py', -1, self.timestamp))
+        main_file = test_utils.temp_file(
+            b'from lib import lib\nprint(lib.X)\n', suffix='.py')
+        manifest_content = '%s %s\nlib/__init__.py\nlib/lib.py %s\n' % (
+            os.path.basename(main_file.name), main_file.name, lib_file.name)
+        extra_manifest_content = 'lib/lib.pyc %s\n' % pyc_file.name
+        with test_utils.temp_file(
+                manifest_content.encode('utf8')) as manifest_file:
+            with test_utils.temp_file(extra_manifest_content.encode(
+                    'utf8')) as extra_manifest_file:
+                par = self._construct(
+                    manifest_filename=manifest_file.name,
+                    extra_manifest_filenames=[extra_manifest_file.name],
+                    minify_sources=True,
+                    pyc_interpreter=sys.executable)
+                par.main_filename = main_file.name
+                par.create()
+
+                # Without an interpreter, the .pyc is left out
+                self.output_filename = self.output_filename + '2'
+                par = self._construct(
+                    manifest_filename=manifest_file.name,
+                    extra_manifest_filenames=[extra_manifest_file.name],
+                    minify_sources=True)
+                par.main_filename = main_file.name
+                par.create()
+
+                par.output_filename = self.output_filename + '3'
+                par.options = par.options._replace(
+                    pyc_interpreter=os.path.join(self.tmpdir, 'missing'))
+                with self.assertRaises(error.Error):
+                    par.create()
+
+        z = zipfile.ZipFile(self.output_filename[:-1])
+        pyc = z.read('lib/lib.pyc')
+        z.close()
+        # Compiled from the minified source, under its stored path
+        self.assertEqual(
+            subprocess.check_output([self.output_filename[:-1]]),
+            b'source\n')
+        if sys.version_info >= (3, 7):
+            code = marshal.loads(pyc[16:])
+            self.assertEqual(code.co_filename, 'lib/lib.py')
+            self.assertNotIn('Doc', code.co_consts)
+        z = zipfile.ZipFile(self.output_filename)
+        self.assertNotIn('lib/lib.pyc', z.namelist())
+        z.close()
+        self.assertEqual(subprocess.check_output([self.output_filename]),
+                         b'source\n')
+
+    def test_add_init_files(self):
+        par = self._construct(workspace_name='ws')
+        manifest = {
+            'ws/main.py': 'main.py',
+            'ws/pkg/sub/mod.py': 'mod.py',
+            'ws/pkg/sub/data.txt': 'data.txt',
+            'ws/data/only.txt': 'only.txt',
+            'ext/lib/__init__.py': 'ext_init.py',
+            'ext/lib/native.so': 'native.so',
+        }
+        par.add_init_files(manifest)
+        self.assertEqual(manifest['ws/pkg/__init__.py'], None)
+        self.assertEqual(manifest['ws/pkg/sub/__init__.py'], None)
+        self.assertEqual(manifest['ext/__init__.py'], None)
+        # Existing files are kept
+        self.assertEqual(manifest['ext/lib/__init__.py'], 'ext_init.py')
+        # Nothing at the top of the main workspace or outside packages
+        self.assertNotIn('ws/__init__.py', manifest)
+        self.assertNotIn('__init__.py', manifest)
+        self.assertNotIn('ws/data/__init__.py', manifest)
+        self.assertEqual(len(manifest), 9)
+
     def test_create_temp_parfile(self):
         par = self._construct()
         with par.create_temp_parfile() as t:
@@ -142,6 +1018,20 @@ class PythonArchiveTest(unittest.TestCase):
         self.assertIn('Boilerplate', boilerplate)
         self.assertIn("import_roots=['foo', 'bar']", boilerplate)
 
+    def test_generate_boilerplate_readahead(self):
+        par = self._construct()
+        boilerplate = par.generate_boilerplate(['foo'], 'foo/bar.py')
+        self.assertIn("readahead_until='foo/bar.py'", boilerplate)
+        boilerplate = par.generate_boilerplate(['foo'])
+        self.assertNotIn('readahead_until', boilerplate)
+
+    def test_generate_boilerplate_lazy_imports(self):
+        par = self._construct(lazy_import_packages=[u'pkg', u'other.mod'])
+        boilerplate = par.generate_boilerplate(['foo'])
+        self.assertIn("lazy_imports=['pkg', 'other.mod']", boilerplate)
+        boilerplate = self._construct().generate_boilerplate(['foo'])
+        self.assertNotIn('lazy_imports', boilerplate)
+
     def test_generate_main(self):
         par = self._construct()
         boilerplate = 'BOILERPLATE\n'
@@ -203,6 +1093,33 @@ class PythonArchiveTest(unittest.TestCase):
         # Adds package init files
         self.assertIn('subpar/__init__.py', resources)
 
+    def test_scan_manifest_readahead(self):
+        par = self._construct()
+        par.hot_paths = ['__main__.py', 'foo.py', 'missing.py']
+        resources = par.scan_manifest({'foo.py': None, 'bar.py': None})
+        self.assertIn(b"readahead_until='foo.py'",
+                      resources['__main__.py'].content)
+
+    def test_scan_manifest_strip_elf(self):
+        par = self._construct(strip_elf=True)
+        resources = par.scan_manifest({'libfoo.so': '/something/libfoo.so',
+                                       'bar.py': None})
+        self.assertIsInstance(resources['libfoo.so'],
+                              stored_resource.StrippedFile)
+        self.assertIsInstance(resources['bar.py'], stored_resource.EmptyFile)
+
+    def test_scan_manifest_minify_sources(self):
+        par = self._construct(minify_sources=True, keep_docstrings=['doc/'])
+        resources = par.scan_manifest({'foo.py': '/something/foo.py',
+                                       'doc/bar.py': '/something/bar.py',
+                                       'baz.txt': '/something/baz.txt'})
+        self.assertIsInstance(resources['foo.py'],
+                              stored_resource.MinifiedFile)
+        self.assertFalse(resources['foo.py'].keep_docstrings)
+        self.assertTrue(resources['doc/bar.py'].keep_docstrings)
+        self.assertNotIsInstance(resources['baz.txt'],
+                                 stored_resource.MinifiedFile)
+
     def test_scan_manifest_has_collision(self):
         par = self._construct()
         # Support file already present in manifest, use manifest version
@@ -216,6 +1133,37 @@ class PythonArchiveTest(unittest.TestCase):
                 resources['subpar/runtime/support.py'].local_filename,
                 shadowing_support_file.name)
 
+    def test_prune_unreachable(self):
+        report_filename = os.path.join(self.tmpdir, 'prune_report.txt')
+        par = self._construct(prune_imports=True, keep_modules=['dynamic'],
+                              prune_report_filename=report_filename)
+        resources = par.scan_manifest({
+            'ws/used.py': None,
+            'ws/unused.py': None,
+            'ws/unused.pyc': None,
+            'ws/dynamic.py': None,
+            'ws/data.txt': None,
+            'ws/my-data/template.py': None,
+        })
+        resources['__main__.py'] = stored_resource.StoredContent(
+            '__main__.py', self.date_time_tuple, b'import used\n')
+        pruned = par.prune_unreachable(resources, ['ws'])
+        self.assertIn('ws/used.py', pruned)
+        self.assertIn('ws/dynamic.py', pruned)
+        self.assertIn('ws/data.txt', pruned)
+        # Not importable, so possibly data
+        self.assertIn('ws/my-data/template.py', pruned)
+        self.assertIn('subpar/runtime/support.py', pruned)
+        self.assertNotIn('ws/unused.py', pruned)
+        self.assertNotIn('ws/unused.pyc', pruned)
+        with open(report_filename) as f:
+            report = f.read().splitlines()
+        self.assertIn('drop ws/unused.py', report)
+        self.assertIn('drop ws/unused.pyc', report)
+        self.assertIn('keep ws/used.py', report)
+        self.assertNotIn('keep ws/data.txt', report)
+        self.assertNotIn('keep ws/my-data/template.py', report)
+
     def test_write_bootstrap(self):
         par = self._construct()
         with par.create_temp_parfile() as t:
@@ -243,6 +1191,20 @@ class PythonArchiveTest(unittest.TestCase):
         zipinfo = z.getinfo(stored_name)
         self.assertEqual(zipinfo.date_time, self.date_time_tuple)
 
+    def test_order_resources(self):
+        par = self._construct()
+        resources = {}
+        for name in ['a.py', 'b.py', 'c.py', 'd.py']:
+            resources[name] = stored_resource.EmptyFile(
+                name, self.date_time_tuple)
+        self.assertEqual(
+            [name for name, _ in par.order_resources(resources)],
+            ['a.py', 'b.py', 'c.py', 'd.py'])
+        par.hot_paths = ['c.py', 'missing.py', 'a.py']
+        self.assertEqual(
+            [name for name, _ in par.order_resources(resources)],
+            ['c.py', 'a.py', 'b.py', 'd.py'])
+
     def test_create_final_from_temp(self):
         par = self._construct()
         t = par.create_temp_parfile()
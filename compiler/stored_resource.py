@@ -17,12 +17,45 @@
 See: http://www.pkware.com/documents/casestudies/APPNOTE.TXT
 
 TODO: Python source compilation
-TODO: ELF binary stripping
 """
 
+import atexit
+import contextlib
+import logging
 import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import timeit
 import zipfile
 
+from subpar.compiler import elf
+from subpar.compiler import error
+from subpar.compiler import minify
+
+# Local file header, see APPNOTE.TXT section 4.3.7
+_local_header_format = '<4s5H3L2H'
+_local_header_size = struct.calcsize(_local_header_format)
+_local_header_signature = b'PK\x03\x04'
+
+# General purpose flag bits, see APPNOTE.TXT section 4.4.4
+_flag_encrypted = 0x1
+_flag_data_descriptor = 0x8
+_flag_utf8 = 0x800
+
+# Directory for files needed until the process exits, see _temp_dir()
+_temp_dir_name = None
+
+
+def _temp_dir():
+    """Return a directory that is removed when the process exits"""
+    global _temp_dir_name
+    if _temp_dir_name is None:
+        _temp_dir_name = tempfile.mkdtemp(prefix='subpar-')
+        atexit.register(shutil.rmtree, _temp_dir_name, True)
+    return _temp_dir_name
+
 
 class StoredResource(object):
     """A local resource which can be committed to a par file.
@@ -35,11 +68,27 @@ class StoredResource(object):
     def __init__(self, stored_filename, timestamp_tuple):
         assert not os.path.isabs(stored_filename)
         self.zipinfo = zipfile.ZipInfo(stored_filename, timestamp_tuple)
+        # Time spent by store(), see build_report.py
+        self.read_seconds = 0.0
+        self.write_seconds = 0.0
 
-    def store(self, unused_zip_file):
-        """Write resource to zip file"""
+    def read(self):
+        """Return the content of this resource as bytes"""
         raise NotImplementedError
 
+    def size(self):
+        """Return the length of the content, reading it only if needed"""
+        return len(self.read())
+
+    def store(self, zip_file):
+        """Write resource to zip file"""
+        start = timeit.default_timer()
+        content = self.read()
+        read_done = timeit.default_timer()
+        zip_file.writestr(self.zipinfo, content)
+        self.read_seconds = read_done - start
+        self.write_seconds = timeit.default_timer() - read_done
+
 
 class StoredFile(StoredResource):
     """One file that will be stored in the final archive."""
@@ -48,10 +97,134 @@ class StoredFile(StoredResource):
         StoredResource.__init__(self, stored_filename, timestamp_tuple)
         self.local_filename = local_filename
 
-    def store(self, zip_file):
+    def read(self):
         with open(self.local_filename, 'rb') as f:
-            content = f.read()
-        zip_file.writestr(self.zipinfo, content)
+            return f.read()
+
+    def size(self):
+        return os.path.getsize(self.local_filename)
+
+
+class StrippedFile(StoredFile):
+    """A file that has debugging information removed if it is ELF.
+
+    Args:
+        strip_tool: Path to a `strip` program to use, instead of the
+            built-in pure Python implementation.
+        debug_dir: If set, the debugging information removed is
+            written to a file named <stored_filename>.debug under this
+            directory, like `objcopy --only-keep-debug` does.
+
+    The file is stripped once, on the first read, to a temporary file
+    that later reads use.
+    """
+
+    def __init__(self, stored_filename, timestamp_tuple, local_filename,
+                 strip_tool=None, debug_dir=None):
+        StoredFile.__init__(self, stored_filename, timestamp_tuple,
+                            local_filename)
+        self.strip_tool = strip_tool
+        self.debug_dir = debug_dir
+        # File holding the content to store, once stripped
+        self._stripped_filename = None
+
+    def read(self):
+        with open(self._stripped(), 'rb') as f:
+            return f.read()
+
+    def size(self):
+        return os.path.getsize(self._stripped())
+
+    def _stripped(self):
+        """Return the name of the file with the content to store"""
+        if self._stripped_filename is None:
+            self._stripped_filename = self._strip()
+        return self._stripped_filename
+
+    def _strip(self):
+        """Write the content with debugging information removed.
+
+        Returns:
+            The name of the file written, or local_filename if there
+            is nothing to remove
+        """
+        with open(self.local_filename, 'rb') as f:
+            if not elf.is_elf(f.read(4)):
+                return self.local_filename
+        fd, stripped_filename = tempfile.mkstemp(dir=_temp_dir())
+        os.close(fd)
+        original_size = os.path.getsize(self.local_filename)
+        content = None
+        if self.strip_tool:
+            self._run_strip_tool('--strip-debug', stripped_filename)
+        else:
+            content = StoredFile.read(self)
+            stripped = elf.strip_debug(content)
+            with open(stripped_filename, 'wb') as f:
+                f.write(stripped or b'')
+        stripped_size = os.path.getsize(stripped_filename)
+        if not stripped_size or stripped_size >= original_size:
+            logging.debug('Nothing to strip from [%s]', self.local_filename)
+            os.remove(stripped_filename)
+            return self.local_filename
+        logging.debug('Stripped [%s] from %d to %d bytes',
+                      self.local_filename, original_size, stripped_size)
+        if self.debug_dir:
+            self._write_debug_info(content)
+        return stripped_filename
+
+    def _run_strip_tool(self, flag, output_filename):
+        """Run the strip tool on our file, writing output_filename"""
+        subprocess.check_call([self.strip_tool, flag, '-o',
+                               output_filename, self.local_filename])
+
+    def _write_debug_info(self, content):
+        """Write the debug sidecar file for this resource.
+
+        Args:
+            content: The unstripped content, if already read
+        """
+        debug_filename = os.path.join(
+            self.debug_dir, self.zipinfo.filename + '.debug')
+        debug_parent = os.path.dirname(debug_filename)
+        if not os.path.isdir(debug_parent):
+            os.makedirs(debug_parent)
+        if self.strip_tool:
+            self._run_strip_tool('--only-keep-debug', debug_filename)
+            return
+        if content is None:
+            content = StoredFile.read(self)
+        with open(debug_filename, 'wb') as f:
+            f.write(elf.keep_debug(content))
+
+
+class MinifiedFile(StoredFile):
+    """A Python source file with comments, docstrings and asserts removed
+
+    The sizes before and after are recorded as `original_size` and
+    `minified_size` when the content is read.
+
+    Args:
+        keep_docstrings: If True, only remove comments and asserts
+    """
+
+    def __init__(self, stored_filename, timestamp_tuple, local_filename,
+                 keep_docstrings=False):
+        StoredFile.__init__(self, stored_filename, timestamp_tuple,
+                            local_filename)
+        self.keep_docstrings = keep_docstrings
+        self.original_size = None
+        self.minified_size = None
+
+    def read(self):
+        content = StoredFile.read(self)
+        minified = minify.minify(content, self.keep_docstrings)
+        self.original_size = len(content)
+        self.minified_size = len(minified)
+        return minified
+
+    def size(self):
+        return len(self.read())
 
 
 class StoredContent(StoredResource):
@@ -61,8 +234,8 @@ class StoredContent(StoredResource):
         StoredResource.__init__(self, stored_filename, timestamp_tuple)
         self.content = content
 
-    def store(self, zip_file):
-        zip_file.writestr(self.zipinfo, self.content)
+    def read(self):
+        return self.content
 
 
 class EmptyFile(StoredContent):
@@ -70,3 +243,78 @@ class EmptyFile(StoredContent):
 
     def __init__(self, stored_filename, timestamp_tuple):
         StoredContent.__init__(self, stored_filename, timestamp_tuple, b'')
+
+
+class StoredZipEntry(StoredResource):
+    """One entry copied from another zip file.
+
+    The compressed data is copied as is, without decompressing and
+    recompressing it.  Only the name and timestamp change.
+
+    Args:
+        zip_filename: Path to the zip file to copy from
+        source_zipinfo: ZipInfo of the entry in that zip file
+    """
+
+    def __init__(self, stored_filename, timestamp_tuple, zip_filename,
+                 source_zipinfo):
+        StoredResource.__init__(self, stored_filename, timestamp_tuple)
+        self.zip_filename = zip_filename
+        self.source_zipinfo = source_zipinfo
+
+    def read(self):
+        with contextlib.closing(zipfile.ZipFile(self.zip_filename)) as z:
+            return z.read(self.source_zipinfo)
+
+    def size(self):
+        return self.source_zipinfo.file_size
+
+    def read_raw(self):
+        """Return the compressed data of the entry"""
+        source = self.source_zipinfo
+        with open(self.zip_filename, 'rb') as f:
+            f.seek(source.header_offset)
+            header = f.read(_local_header_size)
+            if (len(header) != _local_header_size or
+                    header[:4] != _local_header_signature):
+                raise error.Error('Bad local header for [%s] in [%s]' % (
+                    source.filename, self.zip_filename))
+            fields = struct.unpack(_local_header_format, header)
+            f.seek(fields[9] + fields[10], os.SEEK_CUR)
+            data = f.read(source.compress_size)
+        if len(data) != source.compress_size:
+            raise error.Error('Truncated data for [%s] in [%s]' % (
+                source.filename, self.zip_filename))
+        return data
+
+    def store(self, zip_file):
+        source = self.source_zipinfo
+        if (source.flag_bits & _flag_encrypted or source.compress_type not in
+                (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)):
+            # zipimport can't read these, so store them uncompressed
+            StoredResource.store(self, zip_file)
+            return
+
+        start = timeit.default_timer()
+        data = self.read_raw()
+        read_done = timeit.default_timer()
+        zinfo = self.zipinfo
+        zinfo.compress_type = source.compress_type
+        zinfo.CRC = source.CRC
+        zinfo.compress_size = source.compress_size
+        zinfo.file_size = source.file_size
+        zinfo.external_attr = source.external_attr
+        # Sizes go in our local header, so there's no data descriptor
+        zinfo.flag_bits = source.flag_bits & ~(
+            _flag_data_descriptor | _flag_utf8)
+        zinfo.header_offset = zip_file.fp.tell()
+        zip_file.fp.write(zinfo.FileHeader())
+        zip_file.fp.write(data)
+        # Like ZipFile.writestr(), for writing the central directory
+        zip_file.filelist.append(zinfo)
+        zip_file.NameToInfo[zinfo.filename] = zinfo
+        zip_file._didModify = True  # pylint: disable=protected-access
+        if hasattr(zip_file, 'start_dir'):
+            zip_file.start_dir = zip_file.fp.tell()
+        self.read_seconds = read_done - start
+        self.write_seconds = timeit.default_timer() - read_done
@@ -16,6 +16,7 @@ import os
 import unittest
 import zipfile
 
+from subpar.compiler import elf
 from subpar.compiler import stored_resource
 from subpar.compiler import test_utils
 
@@ -50,6 +51,7 @@ class StoredResourceTest(unittest.TestCase):
         resource = stored_resource.StoredFile(
             name, self.date_time_tuple, f.name)
         self._write_and_check(resource, name, expected_content)
+        self.assertEqual(resource.size(), len(expected_content))
 
     def test_StoredContent(self):
         expected_content = b'Contents of foo/bar'
@@ -58,10 +60,79 @@ class StoredResourceTest(unittest.TestCase):
             name, self.date_time_tuple, expected_content)
         self._write_and_check(resource, name, expected_content)
 
+    def test_StrippedFile(self):
+        name = 'foo/libbar.so'
+        content = test_utils.make_elf(2, '<')
+        f = test_utils.temp_file(content)
+        debug_dir = test_utils.mkdtemp()
+        resource = stored_resource.StrippedFile(
+            name, self.date_time_tuple, f.name, debug_dir=debug_dir)
+        stripped = resource.read()
+        self.assertLess(len(stripped), len(content))
+        self._write_and_check(resource, name, stripped)
+        debug_filename = os.path.join(debug_dir, name + '.debug')
+        with open(debug_filename, 'rb') as debug:
+            self.assertEqual(debug.read(), elf.keep_debug(content))
+        # Stripped only once
+        os.remove(debug_filename)
+        self.assertEqual(resource.size(), len(stripped))
+        self.assertEqual(resource.read(), stripped)
+        self.assertFalse(os.path.exists(debug_filename))
+
+    def test_StrippedFile_strip_tool(self):
+        name = 'foo/libbar.so'
+        content = test_utils.make_elf(2, '<')
+        f = test_utils.temp_file(content)
+        tmpdir = test_utils.mkdtemp()
+        # Writes the flag it was run with to the output file
+        strip_tool = os.path.join(tmpdir, 'strip')
+        with open(strip_tool, 'w') as script:
+            script.write('#!/bin/sh\nprintf %s "$1" > "$3"\n')
+        os.chmod(strip_tool, 0o755)
+        debug_dir = os.path.join(tmpdir, 'debug')
+        resource = stored_resource.StrippedFile(
+            name, self.date_time_tuple, f.name, strip_tool=strip_tool,
+            debug_dir=debug_dir)
+        self.assertEqual(resource.read(), b'--strip-debug')
+        self.assertEqual(resource.size(), len(b'--strip-debug'))
+        with open(os.path.join(debug_dir, name + '.debug'), 'rb') as debug:
+            self.assertEqual(debug.read(), b'--only-keep-debug')
+
+    def test_StrippedFile_not_elf(self):
+        expected_content = b'Contents of foo/bar'
+        name = 'foo/bar'
+        f = test_utils.temp_file(expected_content)
+        debug_dir = test_utils.mkdtemp()
+        resource = stored_resource.StrippedFile(
+            name, self.date_time_tuple, f.name, debug_dir=debug_dir)
+        self._write_and_check(resource, name, expected_content)
+        self.assertEqual(os.listdir(debug_dir), [])
+
+    def test_StoredZipEntry(self):
+        tmpdir = test_utils.mkdtemp()
+        source_name = os.path.join(tmpdir, 'source.zip')
+        content = b'Contents of foo/bar ' * 100
+        with zipfile.ZipFile(source_name, 'w') as z:
+            z.writestr('stored', content)
+            z.writestr(zipfile.ZipInfo('deflated'), content,
+                       compress_type=zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(source_name, 'r') as z:
+            source_zipinfos = z.infolist()
+        for source_zipinfo in source_zipinfos:
+            name = 'foo/' + source_zipinfo.filename
+            resource = stored_resource.StoredZipEntry(
+                name, self.date_time_tuple, source_name, source_zipinfo)
+            self.assertEqual(resource.read(), content)
+            self._write_and_check(resource, name, content)
+            self.assertEqual(resource.size(), len(content))
+            self.assertEqual(resource.zipinfo.compress_type,
+                             source_zipinfo.compress_type)
+
     def test_EmptyFile(self):
         name = 'foo/bar'
         resource = stored_resource.EmptyFile(name, self.date_time_tuple)
         self._write_and_check(resource, name, b'')
+        self.assertEqual(resource.size(), 0)
 
 
 if __name__ == '__main__':
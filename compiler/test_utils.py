@@ -15,6 +15,7 @@
 """Common test utilities"""
 
 import os
+import struct
 import tempfile
 
 
@@ -36,3 +37,88 @@ def temp_file(contents, suffix=''):
     t.write(contents)
     t.flush()
     return t
+
+
+# Section contents of the file built by make_elf()
+ELF_TEXT = b'\x90' * 16
+ELF_DEBUG_INFO = b'debug info ' * 20
+
+
+def make_elf(elf_class, order):
+    """Build a small ET_DYN file with debug sections.
+
+    Sections are:
+        0 null
+        1 .text, inside the only loadable segment
+        2 .debug_info
+        3 .rela.debug_info, applying to 2
+        4 .symtab, with local symbols in 1 and 2
+        5 .strtab
+        6 .shstrtab
+    """
+    is64 = elf_class == 2
+    ehdr_format = order + ('16sHHIQQQIHHHHHH' if is64 else '16sHHIIIIIHHHHHH')
+    phdr_format = order + ('IIQQQQQQ' if is64 else 'IIIIIIII')
+    shdr_format = order + ('IIQQQQIIQQ' if is64 else 'IIIIIIIIII')
+    ehsize = struct.calcsize(ehdr_format)
+    phentsize = struct.calcsize(phdr_format)
+    shentsize = struct.calcsize(shdr_format)
+
+    def symbol(shndx):
+        if is64:
+            return struct.pack(order + 'IBBHQQ', 0, 0, 0, shndx, 0, 0)
+        return struct.pack(order + 'IIIBBH', 0, 0, 0, 0, 0, shndx)
+
+    names = [b'', b'.text', b'.debug_info', b'.rela.debug_info',
+             b'.symtab', b'.strtab', b'.shstrtab']
+    shstrtab = b''
+    name_offsets = []
+    for name in names:
+        name_offsets.append(len(shstrtab))
+        shstrtab += name + b'\0'
+    symtab = symbol(0) + symbol(1) + symbol(2)
+    sym_entsize = len(symbol(0))
+    rela_entsize = 24 if is64 else 12
+    rela = b'\0' * rela_entsize
+    strtab = b'\0'
+
+    # (type, flags, data, link, info, align, entsize)
+    specs = [
+        (0, 0, b'', 0, 0, 0, 0),
+        (1, 0x6, ELF_TEXT, 0, 0, 16, 0),
+        (1, 0, ELF_DEBUG_INFO, 0, 0, 1, 0),
+        (4, 0x40, rela, 4, 2, 8, rela_entsize),
+        (2, 0, symtab, 5, 3, 8, sym_entsize),
+        (3, 0, strtab, 0, 0, 1, 0),
+        (3, 0, shstrtab, 0, 0, 1, 0),
+    ]
+    content = bytearray(ehsize + phentsize)
+    headers = []
+    for i, (sh_type, flags, data, link, info, align, entsize) in (
+            enumerate(specs)):
+        if i == 0:
+            headers.append((0,) * 10)
+            continue
+        content.extend(b'\0' * (-len(content) % align))
+        headers.append((name_offsets[i], sh_type, flags, 0, len(content),
+                        len(data), link, info, align, entsize))
+        content.extend(data)
+        if i == 1:
+            load_end = len(content)
+    content.extend(b'\0' * (-len(content) % 8))
+    shoff = len(content)
+    for header in headers:
+        content.extend(struct.pack(shdr_format, *header))
+
+    ident = b'\x7fELF' + struct.pack(
+        'BBB', elf_class, 1 if order == '<' else 2, 1)
+    ident += b'\0' * (16 - len(ident))
+    struct.pack_into(
+        ehdr_format, content, 0, ident, 3, 62, 1, 0, ehsize, shoff, 0,
+        ehsize, phentsize, 1, shentsize, len(specs), 6)
+    if is64:
+        phdr = (1, 5, 0, 0, 0, load_end, load_end, 0x1000)
+    else:
+        phdr = (1, 0, 0, 0, load_end, load_end, 5, 0x1000)
+    struct.pack_into(phdr_format, content, ehsize, *phdr)
+    return bytes(content)
@@ -0,0 +1,172 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record which entries of a .par file are actually used at runtime.
+
+Set the environment variable SUBPAR_ACCESS_TRACE to a filename to
+enable the recorder.  Every module import and every data read served
+from the archive is logged with the time since startup.  At exit, the
+trace is written to that file, one access per line:
+
+    <seconds> <kind> <stored_path>
+
+followed by a report, as '#' comment lines, of the entries in the
+archive's central directory that were never touched, and their sizes.
+
+The trace can be passed to the compiler as a --layout_profile.
+
+Only accesses served directly from the archive are recorded, so
+the recorder does nothing useful for .par files built with
+zip_safe=False.
+"""
+
+import atexit
+import os
+import sys
+import time
+
+# Name of environment variable that enables the recorder
+ENV_VAR = 'SUBPAR_ACCESS_TRACE'
+
+# Stored paths imported before the recorder can be installed
+_bootstrap_paths = [
+    '__main__.py',
+    'subpar/__init__.py',
+    'subpar/runtime/__init__.py',
+    'subpar/runtime/support.py',
+    'subpar/runtime/access_trace.py',
+]
+
+
+class AccessTrace(object):
+    """List of accesses to stored paths in one archive.
+
+    Args:
+        archive_path: Path to .par file
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.start_time = time.time()
+        # List of (seconds, kind, stored_path)
+        self.events = []
+
+    def record(self, kind, path):
+        """Record an access to an archive path or stored path"""
+        prefix = self.archive_path + os.sep
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+        stored_path = path.replace(os.sep, '/')
+        self.events.append((time.time() - self.start_time, kind, stored_path))
+
+    def entries(self):
+        """Return ZipInfos for all files in the archive's central directory"""
+        import zipfile
+        zip_file = zipfile.ZipFile(self.archive_path, mode='r')
+        try:
+            return [zipinfo for zipinfo in zip_file.infolist()
+                    if not zipinfo.filename.endswith('/')]
+        finally:
+            zip_file.close()
+
+    def write(self, output_filename):
+        """Write the trace and the untouched entries report"""
+        all_entries = self.entries()
+        touched = set(stored_path for _, _, stored_path in self.events)
+        untouched = [zipinfo for zipinfo in all_entries
+                     if zipinfo.filename not in touched]
+
+        lines = ['# subpar access trace for %s' % self.archive_path]
+        for seconds, kind, stored_path in self.events:
+            lines.append('%.6f %s %s' % (seconds, kind, stored_path))
+        lines.append(
+            '# untouched: %d of %d entries, %d of %d bytes '
+            '(%d of %d compressed)' % (
+                len(untouched), len(all_entries),
+                sum(z.file_size for z in untouched),
+                sum(z.file_size for z in all_entries),
+                sum(z.compress_size for z in untouched),
+                sum(z.compress_size for z in all_entries)))
+        untouched.sort(key=lambda z: (-z.file_size, z.filename))
+        for zipinfo in untouched:
+            lines.append('# untouched %d %d %s' % (
+                zipinfo.file_size, zipinfo.compress_size, zipinfo.filename))
+
+        with open(output_filename, 'w') as f:
+            for line in lines:
+                f.write(line)
+                f.write('\n')
+
+
+def _make_tracing_importer(trace):
+    """Return a zipimporter subclass that records accesses in `trace`"""
+    from subpar.runtime import support
+    base = support._zipimporter_hook()
+
+    class TracingZipImporter(base):
+        """zipimporter that records imports and data reads"""
+
+        def _record_module(self, fullname):
+            # Found the way zipimport does, without loading the code
+            path = self.prefix + fullname.rpartition('.')[2]
+            try:
+                if self.is_package(fullname):
+                    path += os.sep + '__init__'
+            except ImportError:
+                return
+            files = support._zip_files(self)
+            for suffix in ('.pyc', '.pyo', '.py'):
+                if path + suffix in files:
+                    trace.record('import', path + suffix)
+                    return
+
+        def get_code(self, fullname):
+            self._record_module(fullname)
+            return base.get_code(self, fullname)
+
+        def load_module(self, fullname):
+            self._record_module(fullname)
+            return base.load_module(self, fullname)
+
+        def get_data(self, pathname):
+            trace.record('data', pathname)
+            return base.get_data(self, pathname)
+
+    return TracingZipImporter
+
+
+def install(archive_path, output_filename):
+    """Start recording accesses to `archive_path`
+
+    The trace is written to `output_filename` at exit.
+
+    Returns:
+        The AccessTrace
+    """
+    trace = AccessTrace(archive_path)
+    # These were read before we had a chance to install the recorder
+    for stored_path in _bootstrap_paths:
+        trace.record('import', stored_path)
+
+    from subpar.runtime import support
+    support._replace_zipimporter_hook(_make_tracing_importer(trace))
+
+    def _write_trace():
+        try:
+            trace.write(output_filename)
+        except (IOError, OSError) as e:
+            sys.stderr.write('Failed to write %s to %s: %s\n' % (
+                ENV_VAR, output_filename, e))
+    atexit.register(_write_trace)
+    return trace
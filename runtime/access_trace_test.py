@@ -0,0 +1,84 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+import zipfile
+
+from subpar.compiler import test_utils
+from subpar.runtime import access_trace
+
+
+class AccessTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = test_utils.mkdtemp()
+        self.zipfile_name = os.path.join(tmpdir, '_access_trace_test.par')
+        z = zipfile.ZipFile(self.zipfile_name, 'w')
+        z.writestr('pkg/__init__.py', b'')
+        z.writestr('pkg/_access_trace_test_mod.py', b'X = 1\n')
+        z.writestr('pkg/data.txt', b'some data')
+        z.writestr('pkg/unused.txt', b'never read')
+        z.close()
+        self.trace_filename = os.path.join(tmpdir, 'trace.txt')
+
+    def tearDown(self):
+        os.remove(self.zipfile_name)
+
+    def test_record(self):
+        trace = access_trace.AccessTrace(self.zipfile_name)
+        trace.record('data', 'pkg/data.txt')
+        trace.record('data', os.path.join(self.zipfile_name, 'pkg', 'a.txt'))
+        self.assertEqual(
+            [(kind, path) for _, kind, path in trace.events],
+            [('data', 'pkg/data.txt'), ('data', 'pkg/a.txt')])
+
+    def test_tracing_importer(self):
+        trace = access_trace.AccessTrace(self.zipfile_name)
+        importer_class = access_trace._make_tracing_importer(trace)
+        importer = importer_class(os.path.join(self.zipfile_name, 'pkg'))
+        self.assertEqual(importer.get_data('pkg/data.txt'), b'some data')
+        code = importer.get_code('_access_trace_test_mod')
+        self.assertIsNotNone(code)
+        self.assertEqual(
+            [(kind, path) for _, kind, path in trace.events],
+            [('data', 'pkg/data.txt'),
+             ('import', 'pkg/_access_trace_test_mod.py')])
+        # Packages, found without compiling the module again
+        importer = importer_class(self.zipfile_name)
+        importer.get_filename = None
+        self.assertIsNotNone(importer.get_code('pkg'))
+        self.assertEqual(trace.events[-1][1:],
+                         ('import', 'pkg/__init__.py'))
+
+    def test_write(self):
+        trace = access_trace.AccessTrace(self.zipfile_name)
+        trace.record('import', 'pkg/__init__.py')
+        trace.record('data', 'pkg/data.txt')
+        trace.write(self.trace_filename)
+        with open(self.trace_filename) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines[0].startswith('# subpar access trace'))
+        self.assertTrue(lines[1].endswith(' import pkg/__init__.py'))
+        self.assertTrue(lines[2].endswith(' data pkg/data.txt'))
+        self.assertTrue(
+            lines[3].startswith('# untouched: 2 of 4 entries, 16 of 25 bytes'),
+            lines[3])
+        self.assertTrue(lines[4].startswith('# untouched 10 '), lines[4])
+        self.assertTrue(lines[4].endswith(' pkg/unused.txt'), lines[4])
+        self.assertTrue(lines[5].endswith(' pkg/_access_trace_test_mod.py'))
+
+
+if __name__ == '__main__':
+    unittest.main()
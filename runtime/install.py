@@ -0,0 +1,255 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Install a .par file as a directory tree that runs without unpacking.
+
+Running any .par file with $SUBPAR_INSTALL set installs it instead of
+running it:
+
+    SUBPAR_INSTALL=/srv/foo/foo ./foo.par
+
+This extracts foo.par and its dependency archives to
+/srv/foo/foo.runfiles, compiles every Python source there for the
+interpreter doing the install, using all CPUs, and writes a launcher
+script to /srv/foo/foo.  The launcher runs __main__.py with the same
+sys.path as the .par file gets from setup(), without zipimport,
+extraction, or any of the other startup work of setup().
+
+The directory is filled under a temporary name and renamed when
+complete, then the launcher is written the same way, so a launcher
+never runs a partial tree.  Neither may exist beforehand.  Since the
+bytecode is only used by the interpreter that wrote it, the launcher
+runs that interpreter, with its -E, -s, -S and -O flags.
+"""
+
+import errno
+import os
+import shutil
+import sys
+import tempfile
+
+from subpar.runtime import support
+
+# Runs __main__.py of an installed .par file.  Everything but one
+# function is kept out of the globals __main__.py runs with.
+_launcher_template = """\
+#!%(interpreter)s
+# Launcher for %(archive_name)s, written by subpar/runtime/install.py
+
+
+def _subpar_launch():
+    import os
+    import sys
+    root = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        %(runfiles_name)r)
+    # Processes started by multiprocessing already have the sys.path
+    # of their parent
+    if sys.path[0] != root:
+        sys.path[0:1] = [root] + [os.path.join(root, import_root)
+                                  for import_root in %(import_roots)r]
+    from subpar.runtime import support
+    support._installed = True
+    filename = os.path.join(root, '__main__.py')
+    with open(filename, 'rb') as f:
+        return compile(f.read(), filename, 'exec')
+
+
+exec(_subpar_launch())
+"""
+
+
+def runfiles_dir(launcher_path):
+    """Return the directory holding the files of an installed .par file"""
+    return launcher_path + '.runfiles'
+
+
+def interpreter_flags():
+    """Return the letters of the running interpreter's flags to keep.
+
+    Bytecode file names depend on the -O level, and the .par file may
+    have been built to run with the others.
+    """
+    letters = ''
+    if sys.flags.ignore_environment:
+        letters += 'E'
+    if sys.flags.no_user_site:
+        letters += 's'
+    if sys.flags.no_site:
+        letters += 'S'
+    letters += 'O' * sys.flags.optimize
+    return letters
+
+
+def generate_launcher(interpreter, flags, archive_name, runfiles_name,
+                      import_roots):
+    """Return the text of the launcher script.
+
+    Linux passes everything after the interpreter on a #! line as a
+    single argument, so flags are combined into one.
+
+    Args:
+        interpreter: Absolute path of the Python interpreter
+        flags: Letters of interpreter flags, see interpreter_flags()
+        archive_name: Name of the installed .par file
+        runfiles_name: Name of the directory holding its files,
+            relative to the launcher's directory
+        import_roots: Directories of that tree to add to sys.path,
+            in order
+    """
+    if flags:
+        interpreter = '%s -%s' % (interpreter, flags)
+    return _launcher_template % {
+        'interpreter': interpreter,
+        'archive_name': archive_name,
+        'runfiles_name': runfiles_name,
+        'import_roots': [str(import_root) for import_root in import_roots],
+    }
+
+
+def _compile_file(source):
+    """Compile one of the sources listed by compile_tree()"""
+    import compileall
+    filename, ddir = source
+    return bool(compileall.compile_file(filename, ddir=ddir, quiet=1))
+
+
+def compile_tree(directory, final_directory, workers=None):
+    """Write bytecode for every Python source under a directory.
+
+    Bytecode is written for the running interpreter and its -O level.
+    Errors are printed, and the files left for Python to compile, and
+    fail to, when imported.
+
+    Args:
+        directory: Directory to compile
+        final_directory: Where directory will be moved to, for the
+            file names recorded in the bytecode
+        workers: Number of processes to compile in, the number of
+            CPUs if None.  Only forked processes are used, so that
+            they don't run __main__.py again.
+
+    Returns:
+        True if every source compiled
+    """
+    import multiprocessing
+    sources = []
+    for dirpath, _, filenames in os.walk(directory):
+        relative_dir = os.path.relpath(dirpath, directory)
+        ddir = final_directory
+        if relative_dir != os.curdir:
+            ddir = os.path.join(final_directory, relative_dir)
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                sources.append((os.path.join(dirpath, filename), ddir))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if (workers > 1 and len(sources) > 1 and hasattr(os, 'fork') and
+            sys.version_info >= (3, 4)):
+        pool = multiprocessing.get_context('fork').Pool(workers)
+        try:
+            results = pool.map(_compile_file, sources)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_compile_file(source) for source in sources]
+    return all(results)
+
+
+def _default_mode(mode):
+    umask = os.umask(0)
+    os.umask(umask)
+    return mode & ~umask
+
+
+def install(archive_path, launcher_path, aliases=(), dependency_paths=(),
+            import_roots=(), workers=None):
+    """Install a .par file as a directory tree and a launcher script.
+
+    Args:
+        archive_path: Path of the .par file
+        launcher_path: Path of the launcher script to write.  Files go
+            in a directory next to it, see runfiles_dir().
+        aliases: List of (alias, stored path) pairs, see
+            support.install_aliases()
+        dependency_paths: Dependency archives to install with it
+        import_roots: Directories of the tree to add to sys.path, in
+            order
+        workers: Number of processes compiling bytecode, see
+            compile_tree()
+
+    Returns:
+        True if every Python source compiled
+
+    Raises:
+        IOError, OSError, zipfile.BadZipfile
+    """
+    launcher_path = os.path.abspath(launcher_path)
+    runfiles = runfiles_dir(launcher_path)
+    for path in (launcher_path, runfiles):
+        if os.path.lexists(path):
+            raise OSError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+    parent_dir, launcher_name = os.path.split(launcher_path)
+    if not os.path.isdir(parent_dir):
+        os.makedirs(parent_dir)
+
+    temp_prefix = '.%s.' % launcher_name
+    temp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=temp_prefix)
+    fd, temp_launcher = tempfile.mkstemp(dir=parent_dir, prefix=temp_prefix)
+    try:
+        os.chmod(temp_dir, _default_mode(0o777))
+        support._extract_archives(temp_dir, archive_path, aliases,
+                                  dependency_paths)
+        compiled = compile_tree(temp_dir, runfiles, workers)
+        launcher = generate_launcher(
+            os.path.abspath(sys.executable), interpreter_flags(),
+            os.path.basename(archive_path), os.path.basename(runfiles),
+            import_roots)
+        with os.fdopen(fd, 'w') as f:
+            fd = None
+            f.write(launcher)
+        os.chmod(temp_launcher, _default_mode(0o777))
+        os.rename(temp_dir, runfiles)
+        os.rename(temp_launcher, launcher_path)
+    except BaseException:
+        if fd is not None:
+            os.close(fd)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if os.path.exists(temp_launcher):
+            os.remove(temp_launcher)
+        raise
+    return compiled
+
+
+def main(archive_path, launcher_path, aliases, dependency_paths,
+         import_roots):
+    """Install a .par file for setup(), then exit.
+
+    Exits with status 1, and a message on stderr, if it fails.
+    """
+    import zipfile
+    # Processes we start, and .par files they run, must not install
+    # again
+    del os.environ[support._install_variable]
+    try:
+        compiled = install(archive_path, launcher_path, aliases,
+                           dependency_paths, import_roots)
+    except (IOError, OSError, zipfile.BadZipfile) as e:
+        sys.exit('Failed to install %s: %s' % (archive_path, e))
+    if not compiled:
+        sys.stderr.write('Some files in %s could not be compiled\n' %
+                         runfiles_dir(os.path.abspath(launcher_path)))
+    sys.stdout.write('Installed %s as %s\n' % (archive_path, launcher_path))
+    sys.exit(0)
@@ -0,0 +1,120 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import io
+import os
+import sys
+import unittest
+import zipfile
+
+from subpar.compiler import test_utils
+from subpar.runtime import install
+
+
+def _bytecode_path(filename):
+    if sys.version_info >= (3, 2):
+        import importlib.util
+        return importlib.util.cache_from_source(filename)
+    return filename + 'c'
+
+
+class _Output(io.BytesIO if sys.version_info[0] < 3 else io.StringIO):
+    # compileall encodes error messages with it
+    encoding = 'utf-8'
+
+
+class InstallTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = test_utils.mkdtemp()
+        self.zipfile_name = os.path.join(self.tmpdir, '_install_test.par')
+        z = zipfile.ZipFile(self.zipfile_name, 'w')
+        z.writestr('__main__.py', b'print("Hello World!")\n')
+        z.writestr('lib/mod.py', b'X = 1\n')
+        z.writestr('lib/data.txt', b'some data')
+        z.close()
+        self.launcher_path = os.path.join(self.tmpdir, 'bin', 'app')
+
+    def test_generate_launcher(self):
+        launcher = install.generate_launcher(
+            '/usr/bin/python', 'sO', 'app.par', 'app.runfiles',
+            ['lib', 'other'])
+        lines = launcher.splitlines()
+        self.assertEqual(lines[0], '#!/usr/bin/python -sO')
+        self.assertIn("                        'app.runfiles')", lines)
+        self.assertIn("['lib', 'other']", launcher)
+        compile(launcher, 'app', 'exec')
+        launcher = install.generate_launcher(
+            '/usr/bin/python', '', 'app.par', 'app.runfiles', [])
+        self.assertEqual(launcher.splitlines()[0], '#!/usr/bin/python')
+
+    def test_compile_tree(self):
+        directory = test_utils.mkdtemp()
+        os.makedirs(os.path.join(directory, 'pkg'))
+        sources = [os.path.join(directory, 'a.py'),
+                   os.path.join(directory, 'pkg', 'b.py')]
+        for source in sources:
+            with open(source, 'w') as f:
+                f.write('X = 1\n')
+        self.assertTrue(install.compile_tree(directory, '/final', workers=2))
+        for source in sources:
+            self.assertTrue(os.path.exists(_bytecode_path(source)))
+
+        with open(os.path.join(directory, 'bad.py'), 'w') as f:
+            f.write('X = \n')
+        old_stdout = sys.stdout
+        try:
+            sys.stdout = _Output()
+            compiled = install.compile_tree(directory, '/final', workers=1)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = old_stdout
+        self.assertFalse(compiled)
+        self.assertIn('bad.py', output)
+
+    def test_install(self):
+        self.assertTrue(install.install(
+            self.zipfile_name, self.launcher_path,
+            aliases=[('lib/alias.py', 'lib/mod.py')], import_roots=['lib']))
+        runfiles = self.launcher_path + '.runfiles'
+        self.assertTrue(os.access(self.launcher_path, os.X_OK))
+        with open(self.launcher_path) as f:
+            launcher = f.read()
+        self.assertTrue(launcher.startswith('#!'))
+        self.assertIn("'app.runfiles'", launcher)
+        for stored_path in ('__main__.py', 'lib/mod.py', 'lib/alias.py',
+                            'lib/data.txt'):
+            self.assertTrue(os.path.isfile(os.path.join(runfiles,
+                                                        stored_path)))
+        self.assertTrue(os.path.exists(
+            _bytecode_path(os.path.join(runfiles, 'lib', 'mod.py'))))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(runfiles))),
+                         ['app', 'app.runfiles'])
+
+        # Never over an existing install
+        with self.assertRaises(OSError) as context:
+            install.install(self.zipfile_name, self.launcher_path)
+        self.assertEqual(context.exception.errno, errno.EEXIST)
+
+    def test_install_failure(self):
+        with self.assertRaises(IOError):
+            install.install(os.path.join(self.tmpdir, 'missing.par'),
+                            self.launcher_path)
+        self.assertEqual(os.listdir(os.path.dirname(self.launcher_path)),
+                         [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -52,16 +52,65 @@ so use something else.  For example:
 
 """
 
-import atexit
+# Every .par file imports this module at startup, so anything more
+# than the modules Python has already loaded to run a zip file is
+# imported where it is used.  See support_test.test_startup.
 import os
-import pkgutil
-import shutil
 import sys
-import tempfile
-import warnings
-import zipfile
 import zipimport
 
+# Stored path of the table of paths whose content is stored under
+# another path, see PythonArchive.deduplicate()
+_alias_table = 'subpar/runtime/aliases.txt'
+
+# Entry of a dependency archive holding its digest, see
+# PythonArchive.write_dependency_archive()
+_dependency_digest_entry = 'subpar/runtime/dependency_digest.txt'
+
+# Directories to search for dependency archives, before the directory
+# holding the .par file
+_dependency_path_variable = 'SUBPAR_DEPENDENCY_PATH'
+
+# Stored path of the code objects of bundled modules, see
+# PythonArchive.freeze_modules()
+_frozen_bundle = 'subpar/runtime/frozen_code.bin'
+_frozen_bundle_magic = b'SUBPAR-FROZEN-1\n'
+
+# Where install_bytecode_cache() keeps compiled modules, and the size
+# in bytes it trims the cache to
+_bytecode_cache_variable = 'SUBPAR_BYTECODE_CACHE'
+_bytecode_cache_size_variable = 'SUBPAR_BYTECODE_CACHE_SIZE'
+_bytecode_cache_default_size = 256 << 20
+
+# Stored paths of modules to load in the background, see
+# PythonArchive.add_prefetch_list()
+_prefetch_list = 'subpar/runtime/prefetch.txt'
+_prefetch_threads_variable = 'SUBPAR_PREFETCH_THREADS'
+_prefetch_default_threads = 2
+
+# File to report lazily imported modules to, see install_lazy_imports()
+_lazy_import_report_variable = 'SUBPAR_LAZY_IMPORT_REPORT'
+
+# Environment variable passing what setup() found to child processes
+# running the same .par file, see _export_state()
+_state_variable = 'SUBPAR_RUNTIME_STATE'
+
+# File in an extraction directory that processes using it lock, see
+# _ExtractionLock
+_extraction_lock = 'subpar/runtime/extraction.lock'
+
+# _ExtractionLock held by this process, if any
+_extraction = None
+
+# True in processes forked from a zygote, see zygote.py
+_zygote_worker = False
+
+# Where to install this .par file instead of running it, and whether
+# we were started by a launcher that has set sys.path already, see
+# install.py and PythonArchive.create_dev_launcher()
+_install_variable = 'SUBPAR_INSTALL'
+_installed = False
+
 
 def _log(msg):
     """Print a debugging message in the same format as python -vv output"""
@@ -75,50 +124,914 @@ def _find_archive():
 
     We don't handle the case where prefix is non-empty.
     """
-    main = sys.modules.get('__main__')
+    # Children started by multiprocessing run the .par file as
+    # __mp_main__, see _setup_multiprocessing_spawn()
+    main = sys.modules.get('__mp_main__') or sys.modules.get('__main__')
     if not main:
         _log('# __main__ module not found')
         return None
-    main_loader = getattr(main, '__loader__')
+    main_loader = getattr(main, '__loader__', None)
     if not main_loader:
         _log('# __main__.__loader__ not set')
         return None
-    prefix = getattr(main_loader, 'prefix')
+    prefix = getattr(main_loader, 'prefix', None)
     if prefix != '':
-        _log('# unexpected prefix for __main__.__loader__ is %s' %
-             main_loader.prefix)
+        _log('# unexpected prefix for __main__.__loader__ is %s' % prefix)
         return None
-    archive_path = getattr(main_loader, 'archive')
+    archive_path = getattr(main_loader, 'archive', None)
     if not archive_path:
         _log('# missing archive for __main__.__loader__')
         return None
     return archive_path
 
 
-def _extract_files(archive_path):
+class _AliasingDirectoryCache(dict):
+    """zipimport's directory cache, adding aliases to what it caches.
+
+    Since Python 3.10, importlib.invalidate_caches() makes zipimport
+    read the directory of each archive again, which would drop the
+    aliases added by install_aliases().  zipimport stores what it read
+    in its cache, so we add them back there.
+    """
+
+    def __setitem__(self, archive_path, directory):
+        _add_aliases(directory, _archive_aliases.get(archive_path, ()))
+        dict.__setitem__(self, archive_path, directory)
+
+
+# Keys of (alias, stored path) in zipimport's directory cache, by
+# archive, see install_aliases()
+_archive_aliases = {}
+
+
+def _add_aliases(directory, alias_keys):
+    """Point aliases at the directory entries of their stored paths"""
+    for alias_key, stored_key in alias_keys:
+        toc_entry = directory.get(stored_key)
+        if toc_entry is not None:
+            directory[alias_key] = toc_entry
+
+
+def install_aliases(archive_path):
+    """Make paths with duplicate content importable from a .par file.
+
+    The compiler stores identical Python modules once, and lists the
+    other paths in an alias table.  We add those paths to zipimport's
+    directory cache, pointing at the stored copy, so that imports and
+    get_data() find them like any other entry.  They are added again
+    whenever zipimport reads the directory again.
+
+    This is also used by the compiler to verify new .par files.
+
+    Returns:
+        List of (alias, stored path) pairs that were installed
+    """
+    directory = zipimport._zip_directory_cache.get(archive_path)
+    if not directory:
+        return []
+    table_key = _alias_table.replace('/', os.sep)
+    if table_key not in directory:
+        return []
+    table = zipimport.zipimporter(archive_path).get_data(table_key)
+    aliases = []
+    alias_keys = []
+    for line in table.decode('utf-8').splitlines():
+        alias, stored_path = line.split('\t')
+        stored_key = stored_path.replace('/', os.sep)
+        if stored_key not in directory:
+            _log('# alias target %s not found' % stored_path)
+            continue
+        alias_keys.append((alias.replace('/', os.sep), stored_key))
+        aliases.append((alias, stored_path))
+    _add_aliases(directory, alias_keys)
+    # Only the pure Python zipimport of 3.10 and later reads a
+    # directory again, and its cache can be replaced
+    if hasattr(zipimport.zipimporter, 'invalidate_caches'):
+        _archive_aliases[archive_path] = alias_keys
+        if not isinstance(zipimport._zip_directory_cache,
+                          _AliasingDirectoryCache):
+            zipimport._zip_directory_cache = _AliasingDirectoryCache(
+                zipimport._zip_directory_cache)
+    _log('# installed %d aliases' % len(aliases))
+    return aliases
+
+
+def _read_frozen_bundle(archive_path):
+    """Return (index, data) of a .par file's frozen bundle, or None.
+
+    The bundle is a header, a JSON index mapping stored paths of .py
+    files to (offset, length), and the marshalled code objects.  It is
+    only used if written for this interpreter's bytecode format.
+    """
+    directory = zipimport._zip_directory_cache.get(archive_path)
+    bundle_key = _frozen_bundle.replace('/', os.sep)
+    if not directory or bundle_key not in directory:
+        return None
+    import importlib.util
+    import json
+    import struct
+    bundle = zipimport.zipimporter(archive_path).get_data(bundle_key)
+    header_size = len(_frozen_bundle_magic) + 8
+    if (bundle[:len(_frozen_bundle_magic)] != _frozen_bundle_magic or
+            len(bundle) < header_size):
+        _log('# frozen bundle %s is corrupt' % _frozen_bundle)
+        return None
+    pyc_magic, index_size = struct.unpack_from(
+        '<4sI', bundle, len(_frozen_bundle_magic))
+    if pyc_magic != importlib.util.MAGIC_NUMBER:
+        _log('# frozen bundle was built for another Python version')
+        return None
+    index = json.loads(
+        bundle[header_size:header_size + index_size].decode('utf-8'))
+    return index, memoryview(bundle)[header_size + index_size:]
+
+
+def install_frozen_code(archive_path):
+    """Import modules from a .par file's frozen bundle, if it has one.
+
+    The bundle holds the code objects of a .par file's pure Python
+    modules, read with a single get_data() call.  zipimport instead
+    opens the archive and reads each module's entry, twice, since
+    get_filename() reads the code too.  We replace zipimport's path
+    hook with a subclass that takes code from the bundle, so modules
+    get the same __file__, __path__ and __spec__ as with plain
+    zipimport, and a __loader__ that is a zipimporter.
+
+    Returns:
+        True if the bundle was installed
+    """
+    # zipimporter has exec_module() calling get_code() only in 3.10+
+    if sys.version_info < (3, 10):
+        return False
+    bundle = _read_frozen_bundle(archive_path)
+    if bundle is None:
+        return False
+    index, data = bundle
+    import _imp
+    import marshal
+    base = _zipimporter_hook()
+
+    class FrozenZipImporter(base):
+        """zipimporter that takes code objects from a frozen bundle"""
+
+        def _find_frozen(self, fullname):
+            """Return (path of the module's .py, index entry) or None"""
+            if self.archive != archive_path:
+                return None
+            path = self.prefix + fullname.rpartition('.')[2]
+            try:
+                if self.is_package(fullname):
+                    path += os.sep + '__init__'
+            except ImportError:
+                return None
+            path += '.py'
+            entry = index.get(path.replace(os.sep, '/'))
+            if entry is None:
+                return None
+            return path, entry
+
+        def get_code(self, fullname):
+            found = self._find_frozen(fullname)
+            if found is None:
+                return base.get_code(self, fullname)
+            path, (offset, length) = found
+            code = marshal.loads(data[offset:offset + length])
+            if path + 'c' not in _zip_files(self):
+                # zipimport would compile the source, with a filename
+                # that depends on where the .par file is
+                _imp._fix_co_filename(  # pylint: disable=protected-access
+                    code, self.archive + os.sep + path)
+            return code
+
+        def get_filename(self, fullname):
+            # zipimport reads the code just to find this
+            found = self._find_frozen(fullname)
+            if found is None:
+                return base.get_filename(self, fullname)
+            path = found[0]
+            if path + 'c' in _zip_files(self):
+                path += 'c'
+            return self.archive + os.sep + path
+
+    _replace_zipimporter_hook(FrozenZipImporter)
+    _log('# installed frozen bundle of %d modules' % len(index))
+    return True
+
+
+def _zip_files(importer):
+    """Return the directory of a zipimporter's archive"""
+    # 3.13 rereads the directory if the archive changed
+    get_files = getattr(importer, '_get_files', None)
+    if get_files is not None:
+        return get_files()
+    return importer._files  # pylint: disable=protected-access
+
+
+def _zipimporter_hook():
+    """Return the zipimporter class that sys.path_hooks creates"""
+    for hook in sys.path_hooks:
+        if isinstance(hook, type) and issubclass(hook, zipimport.zipimporter):
+            return hook
+    return zipimport.zipimporter
+
+
+def _replace_zipimporter_hook(importer):
+    """Make importer the class of zipimporters created from now on.
+
+    Cached importers are dropped, so they are recreated by the new
+    hook.
+    """
+    base = _zipimporter_hook()
+    sys.path_hooks[:] = [importer if hook is base else hook
+                         for hook in sys.path_hooks]
+    for entry, cached in list(sys.path_importer_cache.items()):
+        if (isinstance(cached, zipimport.zipimporter) and
+                not isinstance(cached, importer)):
+            del sys.path_importer_cache[entry]
+
+
+def _bytecode_cache_dir():
+    """Return the directory to cache compiled modules in"""
+    directory = os.environ.get(_bytecode_cache_variable)
+    if directory:
+        return directory
+    cache_home = (os.environ.get('XDG_CACHE_HOME') or
+                  os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'subpar', 'bytecode')
+
+
+def _trim_bytecode_cache(directory, max_size):
+    """Delete the least recently used files until under max_size bytes"""
+    files = []
+    total = 0
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        files.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+        total += st.st_size
+    if total <= max_size:
+        return
+    # Trim further than needed, so this isn't done on every write
+    target = max_size * 3 // 4
+    files.sort()
+    for _, size, path in files:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+    _log('# trimmed bytecode cache %s to %d bytes' % (directory, total))
+
+
+def install_bytecode_cache(directory=None, max_size=None):
+    """Cache modules compiled from source in a .par file, across runs.
+
+    zipimport can't write .pyc files into an archive, so modules
+    without one are compiled on every run.  We replace zipimport's
+    path hook with a subclass that saves the code it compiles under
+    directory, and loads it from there on later runs, with one open()
+    per module.
+
+    Files are named after a digest of the interpreter's bytecode magic
+    number, the module's stored path, the CRC-32 and size of its
+    source from the zip directory, and the optimization level.
+    Unchanged modules are found again in rebuilt .par files, and
+    nothing needs to be read or hashed to compute the name.  Files are
+    written atomically, and the least recently used ones are deleted
+    at exit once the directory grows past max_size bytes.  Like
+    __pycache__, nothing is written if sys.dont_write_bytecode is set.
+
+    Returns:
+        True if the cache was installed
+    """
+    # zipimporter has exec_module() calling get_code() only in 3.10+
+    if sys.version_info < (3, 10):
+        return False
+    import _imp
+    import atexit
+    import hashlib
+    import importlib.util
+    import marshal
+    import tempfile
+    if directory is None:
+        directory = _bytecode_cache_dir()
+    if max_size is None:
+        max_size = int(os.environ.get(_bytecode_cache_size_variable) or
+                       _bytecode_cache_default_size)
+    magic = importlib.util.MAGIC_NUMBER
+    written = []
+    base = _zipimporter_hook()
+
+    def _write_cache_file(cache_file, data):
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_name, cache_file)
+            except BaseException:
+                os.remove(temp_name)
+                raise
+        except (IOError, OSError) as e:
+            _log('# failed to write %s: %s' % (cache_file, e))
+
+    class CachingZipImporter(base):
+        """zipimporter that caches code compiled from source"""
+
+        def _cache_path(self, fullname):
+            """Return (path of the module's source, cache file) or None"""
+            path = self.prefix + fullname.rpartition('.')[2]
+            try:
+                if self.is_package(fullname):
+                    path += os.sep + '__init__'
+            except ImportError:
+                return None
+            files = _zip_files(self)
+            toc_entry = files.get(path + '.py')
+            # zipimport uses a .pyc if there is one
+            if toc_entry is None or path + '.pyc' in files:
+                return None
+            key = '\0'.join([path.replace(os.sep, '/'), str(toc_entry[3]),
+                             str(toc_entry[7]), str(sys.flags.optimize)])
+            digest = hashlib.sha256(magic + key.encode('utf-8', 'replace'))
+            return path + '.py', os.path.join(directory,
+                                              digest.hexdigest()[:40])
+
+        def get_code(self, fullname):
+            found = self._cache_path(fullname)
+            if found is None:
+                return base.get_code(self, fullname)
+            path, cache_file = found
+            filename = self.archive + os.sep + path
+            try:
+                with open(cache_file, 'rb') as f:
+                    code = marshal.loads(f.read())
+                # Compiled for wherever the .par file was then
+                _imp._fix_co_filename(  # pylint: disable=protected-access
+                    code, filename)
+                return code
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass
+            code = base.get_code(self, fullname)
+            if not sys.dont_write_bytecode:
+                _write_cache_file(cache_file, marshal.dumps(code))
+                written.append(cache_file)
+            return code
+
+        def get_filename(self, fullname):
+            # zipimport compiles the source just to find this
+            found = self._cache_path(fullname)
+            if found is None:
+                return base.get_filename(self, fullname)
+            return self.archive + os.sep + found[0]
+
+    def _trim_at_exit():
+        if written:
+            try:
+                _trim_bytecode_cache(directory, max_size)
+            except (IOError, OSError) as e:
+                _log('# failed to trim bytecode cache %s: %s' % (
+                    directory, e))
+
+    _replace_zipimporter_hook(CachingZipImporter)
+    atexit.register(_trim_at_exit)
+    _log('# using bytecode cache %s' % directory)
+    return True
+
+
+class _Prefetcher(object):
+    """Load module code in background threads for later imports.
+
+    Modules are loaded in list order, each by whichever thread gets
+    to it first.  An import that finds its module still queued takes
+    it off the queue and loads it itself, and one that finds it being
+    loaded waits for it.  Results are kept until get() removes them.
+    """
+
+    def __init__(self, load, keys):
+        import collections
+        import threading
+        self._threading = threading
+        self._load = load
+        self._queue = collections.deque(keys)
+        self._queued = set(keys)
+        self._in_flight = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def start(self, thread_count):
+        for _ in range(thread_count):
+            thread = self._threading.Thread(target=self._run,
+                                            name='subpar-prefetch')
+            thread.daemon = True
+            thread.start()
+
+    def reset(self):
+        """Stop handing out work, after a fork left the threads behind"""
+        self._lock = self._threading.Lock()
+        self._queue.clear()
+        self._queued.clear()
+        self._in_flight.clear()
+
+    def _take(self, key):
+        """Mark a queued key as being loaded.  Call with the lock held."""
+        self._queued.discard(key)
+        done = self._in_flight[key] = self._threading.Event()
+        return done
+
+    def _finish(self, key, done):
+        try:
+            result = self._load(key)
+        except Exception:  # pylint: disable=broad-except
+            # Let the import load it again and report the error
+            result = None
+        with self._lock:
+            if result is not None:
+                self._results[key] = result
+            self._in_flight.pop(key, None)
+        done.set()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while self._queue and self._queue[0] not in self._queued:
+                    self._queue.popleft()
+                if not self._queue:
+                    return
+                key = self._queue.popleft()
+                done = self._take(key)
+            self._finish(key, done)
+
+    def get(self, key, remove):
+        """Return the loaded result for key, or None to load it directly"""
+        with self._lock:
+            if key in self._results:
+                if remove:
+                    return self._results.pop(key)
+                return self._results[key]
+            done = self._in_flight.get(key)
+            if done is None:
+                if key not in self._queued:
+                    return None
+                done = self._take(key)
+                load_here = True
+            else:
+                load_here = False
+        if load_here:
+            self._finish(key, done)
+        else:
+            done.wait()
+        with self._lock:
+            if remove:
+                return self._results.pop(key, None)
+            return self._results.get(key)
+
+
+def install_prefetch(archive_path, thread_count=None):
+    """Start loading the modules in a .par file's prefetch list.
+
+    Threads read, decompress, and compile or unmarshal each listed
+    module through zipimport, while the main thread goes on with
+    __main__.py.  We replace zipimport's path hook with a subclass
+    that takes the code and filename of listed modules from the
+    threads.  Reading and decompressing release the GIL, so they
+    overlap with the main thread's own work.
+
+    Returns:
+        True if prefetching was started
+    """
+    # zipimporter has exec_module() calling get_code() only in 3.10+
+    if sys.version_info < (3, 10):
+        return False
+    if thread_count is None:
+        thread_count = int(os.environ.get(_prefetch_threads_variable) or
+                           _prefetch_default_threads)
+    directory = zipimport._zip_directory_cache.get(archive_path)
+    list_key = _prefetch_list.replace('/', os.sep)
+    if thread_count <= 0 or not directory or list_key not in directory:
+        return False
+    prefetch_list = zipimport.zipimporter(archive_path).get_data(list_key)
+    # Module paths inside the archive, without .py
+    keys = [line[:-len('.py')].replace('/', os.sep)
+            for line in prefetch_list.decode('utf-8').splitlines()
+            if line.endswith('.py')]
+    base = _zipimporter_hook()
+
+    def _load(key):
+        """Return (code, filename) of a module, as zipimport finds them"""
+        package, _, name = key.rpartition(os.sep)
+        if name == '__init__':
+            package, _, name = package.rpartition(os.sep)
+        importer = base(os.path.join(archive_path, package) if package
+                        else archive_path)
+        code = base.get_code(importer, name)
+        # zipimport prefers a .pyc if it's valid.  Code it compiles
+        # from source has the path of the source as its filename, while
+        # a .pyc records the path given when it was built.
+        source_path = archive_path + os.sep + key + '.py'
+        filename = source_path
+        if (key + '.pyc' in directory and
+                (key + '.py' not in directory or
+                 code.co_filename != source_path)):
+            filename = source_path + 'c'
+        return code, filename
+
+    prefetcher = _Prefetcher(_load, keys)
+
+    class PrefetchingZipImporter(base):
+        """zipimporter that takes modules loaded by _Prefetcher"""
+
+        def _prefetched(self, fullname, remove):
+            if self.archive != archive_path:
+                return None
+            key = self.prefix + fullname.rpartition('.')[2]
+            try:
+                if self.is_package(fullname):
+                    key += os.sep + '__init__'
+            except ImportError:
+                return None
+            return prefetcher.get(key, remove)
+
+        def get_code(self, fullname):
+            result = self._prefetched(fullname, True)
+            if result is None:
+                return base.get_code(self, fullname)
+            return result[0]
+
+        def get_filename(self, fullname):
+            # zipimport loads the code to find this, so use the
+            # prefetched code too
+            result = self._prefetched(fullname, False)
+            if result is None:
+                return base.get_filename(self, fullname)
+            return result[1]
+
+    _replace_zipimporter_hook(PrefetchingZipImporter)
+    # Threads don't survive fork(), see zygote.py
+    os.register_at_fork(after_in_child=prefetcher.reset)
+    prefetcher.start(thread_count)
+    _log('# prefetching %d modules in %d threads' % (len(keys),
+                                                     thread_count))
+    return True
+
+
+def _dependency_digest(filename):
+    """Return the digest recorded in a dependency archive, or None.
+
+    zipimport caches the archive's directory, so this costs nothing
+    extra when the archive is then imported from.
+    """
+    try:
+        importer = zipimport.zipimporter(filename)
+        digest = importer.get_data(
+            _dependency_digest_entry.replace('/', os.sep))
+    except (zipimport.ZipImportError, IOError, OSError):
+        return None
+    return digest.decode('ascii').strip()
+
+
+def find_dependency_archive(archive_path, filename, digest):
+    """Find a dependency archive of a .par file.
+
+    We look in the directories listed in $SUBPAR_DEPENDENCY_PATH, then
+    next to the .par file, for a file with the given name, or named
+    after the digest.  The digest recorded in the file must match.
+    The content itself isn't hashed, since that would take too long at
+    every startup.
+
+    Returns:
+        Path of the archive, or None if not found
+    """
+    directories = [
+        directory for directory in
+        os.environ.get(_dependency_path_variable, '').split(os.pathsep)
+        if directory]
+    directories.append(os.path.dirname(archive_path))
+    for directory in directories:
+        for name in (filename, digest + '.par'):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and _dependency_digest(path) == digest:
+                return path
+            _log('# dependency archive not at %s' % path)
+    return None
+
+
+class _ExtractionLock(object):
+    """Keep an extraction directory until no process uses it.
+
+    Each process using the directory, including children that attach
+    to it, holds a shared flock() on a file in it.  At exit, each
+    tries to turn its lock into an exclusive one, which only the last
+    one can, and that one deletes the directory.  A child forked
+    while a lock is held takes a lock of its own.
+
+    Processes that leave with os._exit(), other than those started by
+    multiprocessing, don't delete it, so it stays behind if one of
+    them is the last.
+    """
+
+    def __init__(self, extract_dir, fd):
+        self.extract_dir = extract_dir
+        self.fd = fd
+
+    @classmethod
+    def acquire(cls, extract_dir, create):
+        """Return a lock held on an extraction directory, or None.
+
+        Args:
+            extract_dir: Directory the .par file was extracted to
+            create: Whether to create the lock file, rather than
+                attach to a directory another process created
+        """
+        try:
+            import fcntl
+        except ImportError:
+            return None
+        lock_path = os.path.join(extract_dir, _extraction_lock)
+        try:
+            if create:
+                lock_dir = os.path.dirname(lock_path)
+                if not os.path.isdir(lock_dir):
+                    os.makedirs(lock_dir)
+                fd = os.open(lock_path, os.O_RDONLY | os.O_CREAT, 0o600)
+            else:
+                fd = os.open(lock_path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            # The last process deletes the directory while holding an
+            # exclusive lock, so it may be gone by now
+            if os.path.exists(lock_path):
+                return cls(extract_dir, fd)
+        except (IOError, OSError):
+            pass
+        os.close(fd)
+        return None
+
+    def register(self):
+        """Release the lock at exit, and take a new one after fork()"""
+        import atexit
+        atexit.register(self.release)
+        # Children started by multiprocessing leave with os._exit()
+        # after running its finalizers
+        util = sys.modules.get('multiprocessing.util')
+        if util is not None:
+            util.Finalize(None, self.release, exitpriority=0)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.reopen)
+
+    def reopen(self):
+        """Take a lock of our own, in a process forked with this one"""
+        if self.fd is None:
+            return
+        import fcntl
+        inherited_fd, self.fd = self.fd, None
+        try:
+            fd = os.open(os.path.join(self.extract_dir, _extraction_lock),
+                         os.O_RDONLY)
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            self.fd = fd
+        except (IOError, OSError) as e:
+            _log('# failed to lock %s: %s' % (self.extract_dir, e))
+        # Closing our copy leaves the parent's lock in place
+        os.close(inherited_fd)
+        util = sys.modules.get('multiprocessing.util')
+        if util is not None:
+            util.Finalize(None, self.release, exitpriority=0)
+
+    def release(self):
+        """Delete the directory if no other process uses it"""
+        if self.fd is None:
+            return
+        import fcntl
+        import shutil
+        fd, self.fd = self.fd, None
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                _log('# leaving %s to other processes' % self.extract_dir)
+                return
+            shutil.rmtree(self.extract_dir, ignore_errors=True)
+        finally:
+            os.close(fd)
+
+
+def _extract_archives(extract_dir, archive_path, aliases=(),
+                      dependency_paths=()):
+    """Write the contents of a .par file and its dependencies to disk.
+
+    Args:
+        extract_dir: Existing directory to write to
+        archive_path: Path of the .par file
+        aliases: List of (alias, stored path) pairs to copy as well
+        dependency_paths: Dependency archives to extract to the same
+            directory
+    """
+    import shutil
+    import zipfile
+    for path in [archive_path] + list(dependency_paths):
+        zip_file = zipfile.ZipFile(path, mode='r')
+        zip_file.extractall(extract_dir)
+        zip_file.close()
+    for alias, stored_path in aliases:
+        alias_filename = os.path.join(extract_dir, alias)
+        alias_dir = os.path.dirname(alias_filename)
+        if not os.path.isdir(alias_dir):
+            os.makedirs(alias_dir)
+        shutil.copyfile(os.path.join(extract_dir, stored_path),
+                        alias_filename)
+
+
+def _extract_files(archive_path, aliases=(), dependency_paths=()):
     """Extract the contents of this .par file to disk.
 
-    This creates a temporary directory, and registers an atexit
-    handler to clean that directory on program exit.  Extraction and
+    This creates a temporary directory, to be deleted when the last
+    process using it exits, see _ExtractionLock.  Extraction and
     cleanup will potentially use significant time and disk space.
 
+    Args:
+        archive_path: Path of the .par file
+        aliases: List of (alias, stored path) pairs to copy as well
+        dependency_paths: Dependency archives to extract to the same
+            directory
+
     Returns:
         Directory where contents were extracted to.
     """
+    global _extraction
+    import atexit
+    import shutil
+    import tempfile
     extract_dir = tempfile.mkdtemp()
+    _log('# extracting %s to %s' % (archive_path, extract_dir))
 
-    def _extract_files_cleanup():
+    try:
+        _extract_archives(extract_dir, archive_path, aliases,
+                          dependency_paths)
+        lock = _ExtractionLock.acquire(extract_dir, create=True)
+    except BaseException:
         shutil.rmtree(extract_dir, ignore_errors=True)
-    atexit.register(_extract_files_cleanup)
-    _log('# extracting %s to %s' % (archive_path, extract_dir))
+        raise
+
+    if lock is None:
+        # No flock() here, so no sharing with other processes
+        def _extract_files_cleanup():
+            shutil.rmtree(extract_dir, ignore_errors=True)
+        atexit.register(_extract_files_cleanup)
+    else:
+        lock.register()
+        _extraction = lock
+    return extract_dir
 
-    zip_file = zipfile.ZipFile(archive_path, mode='r')
-    zip_file.extractall(extract_dir)
-    zip_file.close()
 
+def _attach_extraction(extract_dir):
+    """Use a directory a parent process extracted this .par file to.
+
+    Returns:
+        extract_dir, or None if it can't be used
+    """
+    global _extraction
+    lock = _ExtractionLock.acquire(extract_dir, create=False)
+    if lock is None:
+        _log('# %s is gone, extracting again' % extract_dir)
+        return None
+    lock.register()
+    _extraction = lock
+    _log('# using %s from the parent process' % extract_dir)
     return extract_dir
 
 
+def _archive_stamp(archive_path):
+    """Return a string identifying one version of a file, or None"""
+    try:
+        st = os.stat(archive_path)
+    except OSError:
+        return None
+    return '%d %d %d %r' % (st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+
+
+def _export_state(archive_path, extract_dir, dependencies):
+    """Pass what setup() found to child processes.
+
+    Children that run the same .par file, whether they re-exec
+    sys.argv[0] or are started by multiprocessing, inherit the
+    environment, and skip finding dependency archives and extracting
+    files again.  See _inherited_state().
+
+    Args:
+        archive_path: Path of the .par file
+        extract_dir: Directory shared with children, or None
+        dependencies: List of (digest, path) of dependency archives
+    """
+    stamp = _archive_stamp(archive_path)
+    fields = [stamp, extract_dir or '']
+    for digest, path in dependencies:
+        fields.extend([digest, path])
+    if stamp is None or any('\n' in field for field in fields):
+        return
+    os.environ[_state_variable] = '\n'.join(fields)
+
+
+def _inherited_state(archive_path):
+    """Return what a parent process's setup() found, or None.
+
+    Returns:
+        (extract dir or '', dict of digest to dependency archive path),
+        if the parent ran the same .par file
+    """
+    state = os.environ.get(_state_variable)
+    if not state:
+        return None
+    fields = state.split('\n')
+    if (len(fields) < 2 or len(fields) % 2 or
+            fields[0] != _archive_stamp(archive_path)):
+        return None
+    return fields[1], dict(zip(fields[2::2], fields[3::2]))
+
+
+def _setup_multiprocessing_spawn(spawn_name, archive_path):
+    """Make multiprocessing run this .par file in children it spawns.
+
+    A spawned child runs the parent's main module again, under the
+    name it was imported with, but not if that is __main__, as it is
+    for a zip file.  The child then can't unpickle anything defined in
+    __main__.py.  We make it run the .par file by path instead.
+    """
+    try:
+        __import__(spawn_name)
+    except ImportError:
+        return
+    spawn = sys.modules.get(spawn_name)
+    get_preparation_data = getattr(spawn, 'get_preparation_data', None)
+    if get_preparation_data is None:
+        return
+
+    def get_par_preparation_data(name):
+        data = get_preparation_data(name)
+        main_loader = getattr(sys.modules.get('__main__'), '__loader__',
+                              None)
+        if (data.get('init_main_from_name') == '__main__' and
+                getattr(main_loader, 'archive', None) and
+                os.path.abspath(main_loader.archive) == archive_path):
+            del data['init_main_from_name']
+            data['init_main_from_path'] = archive_path
+        return data
+
+    spawn.get_preparation_data = get_par_preparation_data
+
+
+def _readahead(archive_path, readahead_until):
+    """Ask the OS to read the start of this .par file into memory.
+
+    The compiler places the entries that are accessed at startup
+    contiguously at the start of the archive, ending with the entry
+    stored at `readahead_until`.  Reading that region in one
+    sequential pass avoids scattered reads on a cold cache.
+    """
+    directory = zipimport._zip_directory_cache.get(archive_path)
+    if not directory:
+        _log('# no zip directory for %s, skipping readahead' % archive_path)
+        return
+    toc_entry = directory.get(readahead_until.replace('/', os.sep))
+    if toc_entry is None:
+        _log('# readahead entry %s not found' % readahead_until)
+        return
+    # (path, compress, data_size, file_size, file_offset, ...).  The
+    # local file header before the data is at least 30 bytes plus the
+    # filename, so this covers the entry even without extra fields.
+    data_size = toc_entry[2]
+    file_offset = toc_entry[4]
+    length = file_offset + 30 + len(readahead_until) + data_size
+    _log('# reading ahead %d bytes of %s' % (length, archive_path))
+    try:
+        fd = os.open(archive_path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+        else:
+            remaining = length
+            while remaining > 0:
+                chunk = os.read(fd, min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
 def _version_check_pkg_resources(pkg_resources):
     """Check that pkg_resources supports the APIs we need."""
     # Check that pkg_resources is new enough.
@@ -263,6 +1176,7 @@ def _setup_pkg_resources(pkg_resources_name):
     # there is no public interface to easily refresh/reload it that
     # doesn't also have a "Don't use this" warning.  So we manually
     # add just the entries we know about to the existing WorkingSet.
+    import pkgutil
     for entry in sys.path:
         importer = pkgutil.get_importer(entry)
         if isinstance(importer, zipimport.zipimporter):
@@ -272,17 +1186,277 @@ def _setup_pkg_resources(pkg_resources_name):
                                                   replace=True)
 
 
-def _initialize_import_path(import_roots, import_prefix):
-    """Add extra entries to PYTHONPATH so that modules can be imported."""
+def _find_spec_after(skipped_finder, fullname, path, target):
+    """Find a module spec with the meta path finders but one"""
+    for finder in sys.meta_path:
+        find_spec = getattr(finder, 'find_spec', None)
+        if finder is skipped_finder or find_spec is None:
+            continue
+        spec = find_spec(fullname, path, target)
+        if spec is not None:
+            return spec
+    return None
+
+
+class _AfterImportLoader(object):
+    """Loader that calls a hook once the module it runs is imported"""
+
+    def __init__(self, loader, hook):
+        self.loader = loader
+        self.hook = hook
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The module should only ever see its real loader
+        module.__loader__ = module.__spec__.loader = self.loader
+        self.loader.exec_module(module)
+        self.hook(module.__name__)
+
+
+class _AfterLoadModuleLoader(object):
+    """_AfterImportLoader for loaders without exec_module().
+
+    zipimporter only has load_module() before Python 3.10.
+    """
+
+    def __init__(self, spec, hook):
+        self.spec = spec
+        self.loader = spec.loader
+        self.hook = hook
+
+    def load_module(self, fullname):
+        # The module should only ever see its real loader
+        self.spec.loader = self.loader
+        module = self.loader.load_module(fullname)
+        self.hook(fullname)
+        return module
+
+
+class _AfterImportFinder(object):
+    """Meta path finder that waits for some modules to be imported.
+
+    Importing pkg_resources takes longer than everything else at
+    startup, and most programs never use it, so we set up its hooks
+    when the program first imports it instead.  The same goes for
+    multiprocessing.
+
+    Args:
+        hooks: dict of module name to function called with the name
+            once the module is imported
+    """
+
+    def __init__(self, hooks):
+        self.hooks = dict(hooks)
+
+    def find_spec(self, fullname, path, target=None):
+        hook = self.hooks.get(fullname)
+        if hook is None:
+            return None
+        spec = _find_spec_after(self, fullname, path, target)
+        if spec is None:
+            return None
+        if hasattr(spec.loader, 'exec_module'):
+            spec.loader = _AfterImportLoader(spec.loader, hook)
+        elif hasattr(spec.loader, 'load_module'):
+            spec.loader = _AfterLoadModuleLoader(spec, hook)
+        else:
+            return spec
+        # Only the first import runs the module
+        del self.hooks[fullname]
+        return spec
+
+
+def _call_after_import(hooks):
+    """Call each hook with its module's name once it is imported.
+
+    Hooks of modules already imported are called now.
+
+    Args:
+        hooks: List of (module name, function)
+    """
+    # Python 2 has no find_spec(), so hooks import their module now
+    if sys.version_info < (3, 4):
+        for name, hook in hooks:
+            hook(name)
+        return
+    waiting = {}
+    for name, hook in hooks:
+        if name in sys.modules:
+            hook(name)
+        elif not any(isinstance(finder, _AfterImportFinder) and
+                     name in finder.hooks for finder in sys.meta_path):
+            waiting[name] = hook
+    if waiting:
+        sys.meta_path.insert(0, _AfterImportFinder(waiting))
+
+
+class _LazyImportFinder(object):
+    """Meta path finder that makes some modules load on first use.
+
+    Modules found in the named packages get an importlib LazyLoader,
+    which runs the module only when one of its attributes is first
+    accessed.  Importing a submodule accesses its package, so that
+    loads the package.
+
+    Args:
+        names: Modules and packages to import lazily
+        loaded: If not None, dict to record, for each lazy module that
+            was loaded, where it was first used
+    """
+
+    def __init__(self, names, loaded=None):
+        import importlib.machinery
+        import importlib.util
+        self.names = list(names)
+        self.modules = []
+        self.loaded = loaded
+        # Only modules run from Python code can be loaded lazily
+        self.lazy_loaders = (importlib.machinery.SourceFileLoader,
+                             importlib.machinery.SourcelessFileLoader,
+                             zipimport.zipimporter)
+        self.lazy_loader = importlib.util.LazyLoader
+
+    def find_spec(self, fullname, path, target=None):
+        for name in self.names:
+            if fullname == name or fullname.startswith(name + '.'):
+                break
+        else:
+            return None
+        spec = _find_spec_after(self, fullname, path, target)
+        # zipimporter has exec_module(), which LazyLoader needs, only
+        # in 3.10+
+        if (spec is None or
+                not isinstance(spec.loader, self.lazy_loaders) or
+                not hasattr(spec.loader, 'exec_module')):
+            return spec
+        loader = spec.loader
+        if self.loaded is not None:
+            loader = _ReportingLoader(loader, self.loaded)
+        spec.loader = self.lazy_loader(loader)
+        self.modules.append(fullname)
+        return spec
+
+
+class _ReportingLoader(object):
+    """Loader that records where a lazily imported module was loaded.
+
+    LazyLoader runs the module with this loader when one of its
+    attributes is first accessed.
+    """
+
+    def __init__(self, loader, loaded):
+        import importlib.util
+        self.loader = loader
+        self.loaded = loaded
+        # LazyLoader's own frames are between us and the first use
+        self.skipped_filenames = (importlib.util.__file__,)
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The module should only ever see its real loader
+        module.__loader__ = module.__spec__.loader = self.loader
+        frame = sys._getframe(1)
+        while frame.f_back and (
+                frame.f_code.co_filename.startswith('<frozen ') or
+                frame.f_code.co_filename in self.skipped_filenames):
+            frame = frame.f_back
+        self.loaded[module.__spec__.name] = '%s:%d' % (
+            frame.f_code.co_filename, frame.f_lineno)
+        self.loader.exec_module(module)
+
+
+def _write_lazy_import_report(output_filename, finder):
+    """Write which lazily imported modules were loaded, and where"""
+    with open(output_filename, 'w') as f:
+        for name in finder.modules:
+            if name in finder.loaded:
+                f.write('loaded %s %s\n' % (name, finder.loaded[name]))
+        for name in finder.modules:
+            if name not in finder.loaded:
+                f.write('deferred %s\n' % name)
+
+
+def install_lazy_imports(names):
+    """Import modules in the named packages lazily.
+
+    Needs Python 3.5, and 3.10 for modules imported from the archive
+    itself rather than extracted.
+
+    If $SUBPAR_LAZY_IMPORT_REPORT names a file, a report is written to
+    it at exit, one module per line:
+
+        loaded <module> <filename>:<line where first used>
+        deferred <module>
+
+    Returns:
+        True if lazy imports were installed
+    """
+    # LazyLoader is new in 3.5
+    if sys.version_info < (3, 5) or not names:
+        return False
+    report_filename = os.environ.get(_lazy_import_report_variable)
+    finder = _LazyImportFinder(
+        names, loaded={} if report_filename else None)
+    sys.meta_path.insert(0, finder)
+    if report_filename:
+        import atexit
+
+        def _write_report():
+            try:
+                _write_lazy_import_report(report_filename, finder)
+            except (IOError, OSError) as e:
+                sys.stderr.write('Failed to write %s to %s: %s\n' % (
+                    _lazy_import_report_variable, report_filename, e))
+        atexit.register(_write_report)
+    _log('# importing %s lazily' % ', '.join(names))
+    return True
+
+
+def _initialize_import_path(import_roots, import_prefix,
+                            dependency_roots=()):
+    """Add extra entries to PYTHONPATH so that modules can be imported.
+
+    Roots in dependency archives, given as (import prefix, import
+    roots) pairs, follow those of the .par file itself.
+    """
     # We try to match to order of Bazel's stub
     full_roots = [
         os.path.join(import_prefix, import_root)
         for import_root in import_roots]
+    for dependency_prefix, dependency_import_roots in dependency_roots:
+        full_roots.extend(
+            os.path.join(dependency_prefix, import_root)
+            for import_root in dependency_import_roots)
     sys.path[1:1] = full_roots
     _log('# adding %s to sys.path' % full_roots)
 
 
-def setup(import_roots, zip_safe):
+def _zygote_socket(archive_path, zip_safe):
+    """Return the zygote socket path for this run, or None"""
+    if not zip_safe or os.environ.get('SUBPAR_ACCESS_TRACE'):
+        return None
+    from subpar.runtime import zygote
+    if not zygote.is_supported():
+        return None
+    try:
+        return zygote.socket_path(archive_path)
+    except OSError as e:
+        _log('# not using a zygote: %s' % e)
+        return None
+
+
+def _warn(message):
+    import warnings
+    warnings.warn(message, UserWarning, stacklevel=2)
+
+
+def setup(import_roots, zip_safe, readahead_until=None,
+          dependency_archives=(), zygote=False, bytecode_cache=False,
+          lazy_imports=()):
     """Initialize subpar run-time support
 
     Args:
@@ -291,39 +1465,154 @@ def setup(import_roots, zip_safe):
       zip_safe (bool): If False, extract the .par file contents to a
                        temporary directory, and import everything from
                        that directory.
+      readahead_until (str): If set, stored path of the last entry in
+                             the region at the start of the .par file
+                             to read ahead sequentially.
+      dependency_archives (list): (filename, digest, import roots) of
+                                  each archive holding dependencies
+                                  that were left out of this .par file.
+                                  See find_dependency_archive().
+      zygote (bool): If True, run in a resident process that already
+                     has this .par file loaded, starting one if there
+                     isn't one.  See zygote.py.
+      bytecode_cache (bool): If True, keep modules compiled from
+                             source in a per-user cache directory.
+                             See install_bytecode_cache().
+      lazy_imports (list): Modules and packages to load only when
+                           first used.  See install_lazy_imports().
 
     Returns:
       True if setup was successful, else False
     """
+    if _zygote_worker:
+        # Already set up in the zygote
+        return True
+    if _installed:
+        # The launcher has set sys.path, and there is no archive to
+        # import from
+        if lazy_imports:
+            install_lazy_imports(lazy_imports)
+        return True
+
     archive_path = _find_archive()
     if not archive_path:
-        warnings.warn('Failed to initialize .par file runtime support',
-                      UserWarning)
+        _warn('Failed to initialize .par file runtime support')
         return False
     if os.path.abspath(sys.path[0]) != os.path.abspath(archive_path):
-        warnings.warn('Failed to initialize .par file runtime support. ' +
-                      'archive_path was %r, sys.path was %r' % (
-                          archive_path, sys.path),
-                      UserWarning)
+        _warn('Failed to initialize .par file runtime support. ' +
+              'archive_path was %r, sys.path was %r' % (
+                  archive_path, sys.path))
         return False
 
+    install_target = os.environ.get(_install_variable)
+    zygote_socket = None
+    if zygote and not install_target:
+        zygote_socket = _zygote_socket(archive_path, zip_safe)
+        if zygote_socket:
+            from subpar.runtime import zygote as zygote_module
+            # Doesn't return if there is a zygote to run in
+            zygote_module.forward(zygote_socket)
+
+    # A parent process running this .par file may have done some of
+    # the work already
+    inherited = _inherited_state(archive_path)
+    dependency_paths = []
+    for filename, digest, _ in dependency_archives:
+        path = inherited[1].get(digest) if inherited else None
+        if path is None or not os.path.isfile(path):
+            path = find_dependency_archive(archive_path, filename, digest)
+        if path is None:
+            _warn('Failed to initialize .par file runtime support. ' +
+                  'Dependency archive %s with digest %s not found' % (
+                      filename, digest))
+            return False
+        dependency_paths.append(path)
+
+    # Paths stored only once must be known before anything else is
+    # imported from the archive
+    aliases = install_aliases(archive_path)
+
+    if install_target:
+        from subpar.runtime import install
+        # Doesn't return
+        install.main(archive_path, install_target, aliases,
+                     dependency_paths,
+                     list(import_roots) + [
+                         import_root for archive in dependency_archives
+                         for import_root in archive[2]])
+
+    if readahead_until:
+        _readahead(archive_path, readahead_until)
+
+    # The access trace must see every module read from the archive
+    trace_filename = os.environ.get('SUBPAR_ACCESS_TRACE')
+    if zip_safe and not trace_filename:
+        if bytecode_cache:
+            install_bytecode_cache()
+        install_prefetch(archive_path)
+        install_frozen_code(archive_path)
+
     # Extract files to disk if necessary
     if not zip_safe:
-        extract_dir = _extract_files(archive_path)
+        extract_dir = None
+        if inherited is not None and inherited[0]:
+            extract_dir = _attach_extraction(inherited[0])
+        if extract_dir is None:
+            extract_dir = _extract_files(archive_path, aliases,
+                                         dependency_paths)
         # sys.path[0] is the name of the executing .par file.  Point
         # it to the extract directory instead, so that Python searches
         # there for imports.
         sys.path[0] = extract_dir
         import_prefix = extract_dir
+        dependency_prefixes = [extract_dir] * len(dependency_paths)
     else:  # Import directly from .par file
         extract_dir = None
         import_prefix = archive_path
+        dependency_prefixes = dependency_paths
 
     # Initialize import path
-    _initialize_import_path(import_roots, import_prefix)
+    _initialize_import_path(
+        import_roots, import_prefix,
+        [(prefix, archive[2]) for prefix, archive in
+         zip(dependency_prefixes, dependency_archives)])
+
+    # Let child processes running this .par file reuse all that
+    shared_dir = None
+    if (extract_dir is not None and _extraction is not None and
+            _extraction.extract_dir == extract_dir):
+        shared_dir = extract_dir
+    _export_state(archive_path, shared_dir, [
+        (archive[1], path)
+        for archive, path in zip(dependency_archives, dependency_paths)])
+
+    # Record accesses to the archive if requested
+    if trace_filename:
+        if zip_safe:
+            from subpar.runtime import access_trace
+            access_trace.install(archive_path, trace_filename)
+        else:
+            _warn('SUBPAR_ACCESS_TRACE is ignored for .par files ' +
+                  'built with zip_safe=False')
+
+    if lazy_imports:
+        install_lazy_imports(lazy_imports)
 
     # Add hook for package metadata
-    _setup_pkg_resources('pkg_resources')
-    _setup_pkg_resources('pip._vendor.pkg_resources')
+    _call_after_import([
+        ('pkg_resources', _setup_pkg_resources),
+        ('pip._vendor.pkg_resources', _setup_pkg_resources),
+    ])
+    if sys.version_info >= (3, 4):
+        absolute_archive_path = os.path.abspath(archive_path)
+        _call_after_import([
+            ('multiprocessing.spawn',
+             lambda name: _setup_multiprocessing_spawn(
+                 name, absolute_archive_path)),
+        ])
+
+    if zygote_socket:
+        from subpar.runtime import zygote as zygote_module
+        zygote_module.spawn(zygote_socket, archive_path)
 
     return True
@@ -13,10 +13,14 @@
 # limitations under the License.
 
 import io
+import marshal
 import os
+import subprocess
 import sys
 import unittest
+import warnings
 import zipfile
+import zipimport
 
 from subpar.compiler import test_utils
 from subpar.runtime import support
@@ -36,6 +40,22 @@ finally:
     sys.path = old_sys_path
 
 
+# Seconds a zip-safe .par file may spend importing the runtime and in
+# setup(), see test_startup
+# __main__.py for test_startup
+_startup_main = b"""\
+import sys
+from subpar.runtime import support
+support.setup(import_roots=[], zip_safe=True)
+print(' '.join(sorted(sys.modules)))
+"""
+
+_startup_baseline_main = b"""\
+import sys
+print(' '.join(sorted(sys.modules)))
+"""
+
+
 # We assume this test isn't run as a par file.
 class SupportTest(unittest.TestCase):
     @classmethod
@@ -77,6 +97,14 @@ class SupportTest(unittest.TestCase):
         main = sys.modules.get('__main__')
         main.__loader__ = cls.old_loader
 
+    def setUp(self):
+        # setup() passes its state to child processes in os.environ
+        self.old_environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.old_environ)
+
     def test__log(self):
         old_stderr = sys.stderr
         try:
@@ -111,6 +139,394 @@ class SupportTest(unittest.TestCase):
             actual_data = f.read()
             self.assertEqual(actual_data, self.entry_data)
 
+    def _make_aliased_zip(self):
+        tmpdir = test_utils.mkdtemp()
+        zipfile_name = os.path.join(tmpdir, '_support_test_aliases.par')
+        z = zipfile.ZipFile(zipfile_name, 'w')
+        z.writestr('a/mod.py', b'X = 42\n')
+        z.writestr('subpar/runtime/aliases.txt',
+                   b'b/mod.py\ta/mod.py\nc/missing.py\ta/missing.py\n')
+        z.close()
+        return zipfile_name
+
+    def test_install_aliases(self):
+        zipfile_name = self._make_aliased_zip()
+        # Nothing to do before zipimport has read the archive
+        self.assertEqual(support.install_aliases(zipfile_name), [])
+        importer = zipimport.zipimporter(zipfile_name)
+        try:
+            aliases = support.install_aliases(zipfile_name)
+            self.assertEqual(aliases, [('b/mod.py', 'a/mod.py')])
+            self.assertEqual(importer.get_data(os.path.join('b', 'mod.py')),
+                             b'X = 42\n')
+            b_importer = zipimport.zipimporter(os.path.join(zipfile_name, 'b'))
+            namespace = {}
+            exec(b_importer.get_code('mod'), namespace)
+            self.assertEqual(namespace['X'], 42)
+        finally:
+            zipimport._zip_directory_cache.pop(zipfile_name, None)
+            support._archive_aliases.pop(zipfile_name, None)
+        # No alias table
+        zipimport.zipimporter(self.zipfile_name)
+        self.assertEqual(support.install_aliases(self.zipfile_name), [])
+
+    @unittest.skipIf(sys.version_info < (3, 10),
+                     'zipimport reads directories again since 3.10')
+    def test_install_aliases_invalidate_caches(self):
+        zipfile_name = self._make_aliased_zip()
+        importer = zipimport.zipimporter(zipfile_name)
+        try:
+            support.install_aliases(zipfile_name)
+            importer.invalidate_caches()
+            b_importer = zipimport.zipimporter(os.path.join(zipfile_name, 'b'))
+            self.assertEqual(b_importer.get_source('mod'), 'X = 42\n')
+            self.assertEqual(importer.get_data(os.path.join('b', 'mod.py')),
+                             b'X = 42\n')
+        finally:
+            zipimport._zip_directory_cache.pop(zipfile_name, None)
+            support._archive_aliases.pop(zipfile_name, None)
+
+    def test__extract_files_with_aliases(self):
+        zipfile_name = self._make_aliased_zip()
+        extract_path = support._extract_files(
+            zipfile_name, [('b/mod.py', 'a/mod.py')])
+        with open(os.path.join(extract_path, 'b', 'mod.py'), 'rb') as f:
+            self.assertEqual(f.read(), b'X = 42\n')
+
+    def test__trim_bytecode_cache(self):
+        directory = test_utils.mkdtemp()
+        for i in range(4):
+            path = os.path.join(directory, str(i))
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            os.utime(path, (1000 + i, 1000 + i))
+        support._trim_bytecode_cache(directory, 400)
+        self.assertEqual(len(os.listdir(directory)), 4)
+        # The least recently used files go first
+        support._trim_bytecode_cache(directory, 300)
+        self.assertEqual(sorted(os.listdir(directory)), ['2', '3'])
+
+    @unittest.skipIf(sys.version_info < (3, 10),
+                     'the bytecode cache needs Python 3.10')
+    def test_install_bytecode_cache(self):
+        tmpdir = test_utils.mkdtemp()
+        zipfile_name = os.path.join(tmpdir, 'cached.par')
+        with zipfile.ZipFile(zipfile_name, 'w') as z:
+            z.writestr('pkg/__init__.py', b'')
+            z.writestr('pkg/mod.py', b'X = 1\n')
+            z.writestr('pkg/compiled.py', b'X = 2\n')
+            z.writestr('pkg/compiled.pyc', b'')
+        cache_dir = os.path.join(tmpdir, 'cache')
+        old_path_hooks = list(sys.path_hooks)
+        old_path_importer_cache = dict(sys.path_importer_cache)
+        old_dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        try:
+            self.assertTrue(support.install_bytecode_cache(cache_dir))
+            hook = support._zipimporter_hook()
+            self.assertTrue(issubclass(hook, zipimport.zipimporter))
+            importer = hook(os.path.join(zipfile_name, 'pkg'))
+            self.assertEqual(importer.get_filename('mod'),
+                             os.path.join(zipfile_name, 'pkg', 'mod.py'))
+            code = importer.get_code('mod')
+            self.assertEqual(code.co_filename,
+                             os.path.join(zipfile_name, 'pkg', 'mod.py'))
+            # Only modules compiled from source are cached
+            cache_files = os.listdir(cache_dir)
+            self.assertEqual(len(cache_files), 1)
+
+            # Later runs load the code from the cache
+            cache_file = os.path.join(cache_dir, cache_files[0])
+            with open(cache_file, 'wb') as f:
+                f.write(marshal.dumps(compile('X = 3\n', 'old', 'exec')))
+            namespace = {}
+            code = importer.get_code('mod')
+            exec(code, namespace)
+            self.assertEqual(namespace['X'], 3)
+            self.assertEqual(code.co_filename,
+                             os.path.join(zipfile_name, 'pkg', 'mod.py'))
+
+            # A corrupt cache file is replaced
+            with open(cache_file, 'wb') as f:
+                f.write(b'corrupt')
+            namespace = {}
+            exec(importer.get_code('mod'), namespace)
+            self.assertEqual(namespace['X'], 1)
+        finally:
+            sys.dont_write_bytecode = old_dont_write_bytecode
+            sys.path_hooks[:] = old_path_hooks
+            sys.path_importer_cache.clear()
+            sys.path_importer_cache.update(old_path_importer_cache)
+            zipimport._zip_directory_cache.pop(zipfile_name, None)
+
+    def test__Prefetcher(self):
+        loaded = []
+
+        def load(key):
+            loaded.append(key)
+            if key == 'bad':
+                raise ImportError(key)
+            return key.upper()
+
+        prefetcher = support._Prefetcher(load, ['a', 'b', 'bad'])
+        # Before the threads start, imports load queued modules themselves
+        self.assertEqual(prefetcher.get('b', False), 'B')
+        self.assertEqual(prefetcher.get('b', True), 'B')
+        self.assertEqual(prefetcher.get('b', True), None)
+        self.assertEqual(prefetcher.get('unlisted', True), None)
+        prefetcher.start(2)
+        self.assertEqual(prefetcher.get('a', True), 'A')
+        self.assertEqual(prefetcher.get('bad', True), None)
+        self.assertEqual(sorted(loaded), ['a', 'b', 'bad'])
+
+    def test_install_prefetch(self):
+        tmpdir = test_utils.mkdtemp()
+        zipfile_name = os.path.join(tmpdir, 'prefetch.par')
+        with zipfile.ZipFile(zipfile_name, 'w') as z:
+            z.writestr('pkg/__init__.py', b'')
+            z.writestr('pkg/mod.py', b'X = 1\n')
+            z.writestr('subpar/runtime/prefetch.txt',
+                       b'pkg/__init__.py\npkg/mod.py\n')
+        old_path_hooks = list(sys.path_hooks)
+        old_path_importer_cache = dict(sys.path_importer_cache)
+        try:
+            zipimport.zipimporter(zipfile_name)
+            if sys.version_info < (3, 10):
+                self.assertFalse(support.install_prefetch(zipfile_name))
+                return
+            self.assertFalse(support.install_prefetch(zipfile_name, 0))
+            self.assertTrue(support.install_prefetch(zipfile_name, 1))
+            hook = support._zipimporter_hook()
+            self.assertTrue(issubclass(hook, zipimport.zipimporter))
+            mod_path = os.path.join(zipfile_name, 'pkg', 'mod.py')
+            importer = hook(os.path.join(zipfile_name, 'pkg'))
+            self.assertEqual(importer.get_filename('mod'), mod_path)
+            code = importer.get_code('mod')
+            self.assertEqual(code.co_filename, mod_path)
+            namespace = {}
+            exec(code, namespace)
+            self.assertEqual(namespace['X'], 1)
+            # Taken once, then loaded as usual
+            self.assertEqual(importer.get_code('mod').co_filename, mod_path)
+            importer = hook(zipfile_name)
+            self.assertEqual(importer.get_filename('pkg'), os.path.join(
+                zipfile_name, 'pkg', '__init__.py'))
+        finally:
+            sys.path_hooks[:] = old_path_hooks
+            sys.path_importer_cache.clear()
+            sys.path_importer_cache.update(old_path_importer_cache)
+            zipimport._zip_directory_cache.pop(zipfile_name, None)
+
+    def _run_startup(self, main_content):
+        tmpdir = test_utils.mkdtemp()
+        zipfile_name = os.path.join(tmpdir, 'startup.par')
+        source_filename = os.path.splitext(support.__file__)[0] + '.py'
+        with zipfile.ZipFile(zipfile_name, 'w') as z:
+            z.writestr('__main__.py', main_content)
+            z.writestr('subpar/__init__.py', b'')
+            z.writestr('subpar/runtime/__init__.py', b'')
+            z.write(source_filename, 'subpar/runtime/support.py')
+        output = subprocess.check_output([sys.executable, zipfile_name])
+        return set(output.decode('ascii').split())
+
+    @unittest.skipIf(sys.version_info < (3, 4),
+                     'pkg_resources is set up at once without find_spec')
+    def test_startup(self):
+        # A zip-safe .par file imports only the runtime itself
+        baseline_modules = self._run_startup(_startup_baseline_main)
+        modules = self._run_startup(_startup_main)
+        self.assertEqual(
+            sorted(modules - baseline_modules),
+            ['subpar', 'subpar.runtime', 'subpar.runtime.support'])
+        # Set up when the program imports them
+        for name in ('pkg_resources', 'multiprocessing'):
+            self.assertNotIn(name, modules)
+
+    @unittest.skipIf(sys.version_info < (3, 4),
+                     'hooks are called at once without find_spec')
+    def test__call_after_import(self):
+        tmpdir = test_utils.mkdtemp()
+        with open(os.path.join(tmpdir, 'fake_pkg_resources.py'), 'w') as f:
+            f.write('X = 1\n')
+        called = []
+        hooks = [('fake_pkg_resources', called.append)]
+        old_meta_path = list(sys.meta_path)
+        old_sys_path = list(sys.path)
+        try:
+            sys.path.insert(0, tmpdir)
+            support._call_after_import(hooks)
+            # Only once per name
+            support._call_after_import(hooks)
+            self.assertEqual(len(sys.meta_path), len(old_meta_path) + 1)
+            self.assertEqual(called, [])
+            import fake_pkg_resources
+            self.assertEqual(called, ['fake_pkg_resources'])
+            self.assertEqual(fake_pkg_resources.X, 1)
+            self.assertNotIsInstance(fake_pkg_resources.__loader__,
+                                     support._AfterImportLoader)
+            self.assertIs(fake_pkg_resources.__spec__.loader,
+                          fake_pkg_resources.__loader__)
+            # Already imported
+            support._call_after_import(hooks)
+            self.assertEqual(called, ['fake_pkg_resources'] * 2)
+        finally:
+            sys.meta_path[:] = old_meta_path
+            sys.path[:] = old_sys_path
+            sys.modules.pop('fake_pkg_resources', None)
+
+    @unittest.skipIf(sys.version_info < (3, 4),
+                     'hooks are called at once without find_spec')
+    def test__call_after_import_zip(self):
+        tmpdir = test_utils.mkdtemp()
+        zipfile_name = os.path.join(tmpdir, 'hooked.zip')
+        with zipfile.ZipFile(zipfile_name, 'w') as z:
+            z.writestr('zip_pkg_resources.py', b'X = 1\n')
+        called = []
+        old_meta_path = list(sys.meta_path)
+        old_sys_path = list(sys.path)
+        try:
+            sys.path.insert(0, zipfile_name)
+            support._call_after_import(
+                [('zip_pkg_resources', called.append)])
+            import zip_pkg_resources
+            self.assertEqual(called, ['zip_pkg_resources'])
+            self.assertEqual(zip_pkg_resources.X, 1)
+            self.assertIsInstance(zip_pkg_resources.__loader__,
+                                  zipimport.zipimporter)
+            self.assertIs(zip_pkg_resources.__spec__.loader,
+                          zip_pkg_resources.__loader__)
+        finally:
+            sys.meta_path[:] = old_meta_path
+            sys.path[:] = old_sys_path
+            sys.modules.pop('zip_pkg_resources', None)
+            sys.path_importer_cache.pop(zipfile_name, None)
+            zipimport._zip_directory_cache.pop(zipfile_name, None)
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'LazyLoader is new in 3.5')
+    def test__LazyImportFinder(self):
+        tmpdir = test_utils.mkdtemp()
+        os.mkdir(os.path.join(tmpdir, 'lazy_pkg'))
+        for name, content in [('__init__.py', ''),
+                              ('used.py', 'X = 1\n'),
+                              ('unused.py', 'raise ImportError("ran")\n')]:
+            with open(os.path.join(tmpdir, 'lazy_pkg', name), 'w') as f:
+                f.write(content)
+        old_meta_path = list(sys.meta_path)
+        old_sys_path = list(sys.path)
+        try:
+            sys.path.insert(0, tmpdir)
+            finder = support._LazyImportFinder(['lazy_pkg'], loaded={})
+            sys.meta_path.insert(0, finder)
+            import lazy_pkg.used
+            import lazy_pkg.unused  # noqa
+            self.assertEqual(lazy_pkg.used.X, 1)
+            self.assertEqual(finder.modules, [
+                'lazy_pkg', 'lazy_pkg.used', 'lazy_pkg.unused'])
+            # The package was loaded to import its submodules
+            self.assertEqual(sorted(finder.loaded),
+                             ['lazy_pkg', 'lazy_pkg.used'])
+            self.assertTrue(finder.loaded['lazy_pkg.used'].startswith(
+                os.path.splitext(__file__)[0]))
+            self.assertNotIsInstance(lazy_pkg.used.__loader__,
+                                     support._ReportingLoader)
+
+            report_filename = os.path.join(tmpdir, 'report.txt')
+            support._write_lazy_import_report(report_filename, finder)
+            with open(report_filename) as f:
+                report = f.read().splitlines()
+            self.assertEqual([line.split()[:2] for line in report], [
+                ['loaded', 'lazy_pkg'], ['loaded', 'lazy_pkg.used'],
+                ['deferred', 'lazy_pkg.unused']])
+        finally:
+            sys.meta_path[:] = old_meta_path
+            sys.path[:] = old_sys_path
+            for name in ['lazy_pkg', 'lazy_pkg.used', 'lazy_pkg.unused']:
+                sys.modules.pop(name, None)
+
+    @unittest.skipIf(sys.platform == 'win32', 'needs flock()')
+    def test__ExtractionLock(self):
+        extract_dir = test_utils.mkdtemp()
+        first = support._ExtractionLock.acquire(extract_dir, create=True)
+        second = support._ExtractionLock.acquire(extract_dir, create=False)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        # Kept while another process uses it
+        first.release()
+        self.assertTrue(os.path.isdir(extract_dir))
+        first.release()
+        second.release()
+        self.assertFalse(os.path.exists(extract_dir))
+        self.assertIsNone(
+            support._ExtractionLock.acquire(extract_dir, create=False))
+
+    def test__inherited_state(self):
+        self.assertIsNone(support._inherited_state(self.zipfile_name))
+        support._export_state(self.zipfile_name, '/tmp/extracted',
+                              [('abc123', '/deps/app_deps.par')])
+        self.assertEqual(support._inherited_state(self.zipfile_name), (
+            '/tmp/extracted', {'abc123': '/deps/app_deps.par'}))
+        # Only for the same .par file
+        other = os.path.join(test_utils.mkdtemp(), 'other.par')
+        with open(other, 'wb') as f:
+            f.write(b'other')
+        self.assertIsNone(support._inherited_state(other))
+        support._export_state(self.zipfile_name, None, [])
+        self.assertEqual(support._inherited_state(self.zipfile_name),
+                         ('', {}))
+
+    def test__readahead(self):
+        # Populate the zipimport directory cache for the archive
+        zipimport.zipimporter(self.zipfile_name)
+        with zipfile.ZipFile(self.zipfile_name) as z:
+            zipinfo = z.getinfo(self.entry_name)
+        # Up to the end of the entry, with the shortest local header
+        expected_length = (zipinfo.header_offset + 30 +
+                           len(self.entry_name) + zipinfo.compress_size)
+        archive_inode = os.stat(self.zipfile_name).st_ino
+        calls = []
+
+        def fake_posix_fadvise(fd, offset, length, advice):
+            calls.append((os.fstat(fd).st_ino, offset, length, advice))
+
+        old_posix_fadvise = getattr(os, 'posix_fadvise', None)
+        old_read = os.read
+        os.posix_fadvise = fake_posix_fadvise
+        had_willneed = hasattr(os, 'POSIX_FADV_WILLNEED')
+        if not had_willneed:
+            os.POSIX_FADV_WILLNEED = 3
+        try:
+            support._readahead(self.zipfile_name, self.entry_name)
+            self.assertEqual(calls, [(archive_inode, 0, expected_length,
+                                      os.POSIX_FADV_WILLNEED)])
+            # Unknown entry, and unknown archive
+            support._readahead(self.zipfile_name, 'doesnotexist.py')
+            support._readahead(self.zipfile_name + '.missing',
+                               self.entry_name)
+            self.assertEqual(len(calls), 1)
+
+            # Without posix_fadvise(), the region is read instead
+            del os.posix_fadvise
+            reads = []
+
+            def fake_read(fd, size):
+                data = old_read(fd, size)
+                reads.append(len(data))
+                return data
+
+            os.read = fake_read
+            support._readahead(self.zipfile_name, self.entry_name)
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(sum(reads), expected_length)
+        finally:
+            os.read = old_read
+            if old_posix_fadvise is None:
+                if hasattr(os, 'posix_fadvise'):
+                    del os.posix_fadvise
+            else:
+                os.posix_fadvise = old_posix_fadvise
+            if not had_willneed:
+                del os.POSIX_FADV_WILLNEED
+
     def test__version_check(self):
         class MockModule(object):
             pass
@@ -158,6 +574,79 @@ class SupportTest(unittest.TestCase):
         if module and support._version_check_pkg_resources(module):
             self.assertEqual(mock_sys_path[3:], sys.path[1:])
 
+    def _make_dependency_archive(self, name):
+        tmpdir = test_utils.mkdtemp()
+        filename = os.path.join(tmpdir, name)
+        z = zipfile.ZipFile(filename, 'w')
+        z.writestr('pypi__dep/dep.py', b'X = 1\n')
+        z.writestr('subpar/runtime/dependency_digest.txt', b'abc123')
+        z.close()
+        return filename
+
+    def test_find_dependency_archive(self):
+        filename = self._make_dependency_archive('app_deps.par')
+        tmpdir = os.path.dirname(filename)
+        archive_path = os.path.join(tmpdir, 'app.par')
+        self.assertEqual(support.find_dependency_archive(
+            archive_path, 'app_deps.par', 'abc123'), filename)
+        # Wrong digest
+        self.assertIsNone(support.find_dependency_archive(
+            archive_path, 'app_deps.par', 'abc124'))
+        self.assertIsNone(support.find_dependency_archive(
+            archive_path, 'missing.par', 'abc123'))
+        # Found by digest, on the search path
+        other_dir = test_utils.mkdtemp()
+        os.rename(filename, os.path.join(other_dir, 'abc123.par'))
+        old_environ = dict(os.environ)
+        try:
+            os.environ['SUBPAR_DEPENDENCY_PATH'] = other_dir
+            self.assertEqual(
+                support.find_dependency_archive(
+                    archive_path, 'app_deps.par', 'abc123'),
+                os.path.join(other_dir, 'abc123.par'))
+        finally:
+            os.environ.clear()
+            os.environ.update(old_environ)
+
+    def test_setup_dependency_archives(self):
+        filename = self._make_dependency_archive(
+            os.path.basename(self.zipfile_name).replace('.par', '_deps.par'))
+        os.rename(filename, os.path.join(
+            os.path.dirname(self.zipfile_name), os.path.basename(filename)))
+        dependency_archives = [
+            (os.path.basename(filename), 'abc123', ['pypi__dep'])]
+        old_sys_path = sys.path
+        try:
+            mock_sys_path = list(sys.path)
+            mock_sys_path[0] = self.zipfile_name
+            sys.path = mock_sys_path
+            success = support.setup(import_roots=['some_root'],
+                                    zip_safe=True,
+                                    dependency_archives=dependency_archives)
+            self.assertTrue(success)
+        finally:
+            sys.path = old_sys_path
+        self.assertTrue(mock_sys_path[1].endswith('some_root'))
+        self.assertEqual(mock_sys_path[2], os.path.join(
+            os.path.dirname(self.zipfile_name), os.path.basename(filename),
+            'pypi__dep'))
+
+        # Missing dependency archive, in a process not started by one
+        # that found it
+        os.environ.pop('SUBPAR_RUNTIME_STATE')
+        try:
+            mock_sys_path = list(sys.path)
+            mock_sys_path[0] = self.zipfile_name
+            sys.path = mock_sys_path
+            with warnings.catch_warnings(record=True):
+                warnings.simplefilter('always')
+                success = support.setup(
+                    import_roots=['some_root'], zip_safe=True,
+                    dependency_archives=[('missing.par', 'abc123', [])])
+            self.assertFalse(success)
+        finally:
+            sys.path = old_sys_path
+
     def test_setup__extract(self):
         # Run setup() with file extraction
         old_sys_path = sys.path
@@ -0,0 +1,427 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run a .par file by forking a resident process that has it loaded.
+
+For .par files built with zygote=True, the first run starts a
+background process, the zygote, after setup() is done.  The zygote
+listens on a Unix socket, then imports the modules that __main__.py
+imports at its top level.  Later runs send their argv, environment,
+working directory and stdin/stdout/stderr to the zygote, which forks a
+worker to run __main__.py with them.  The run then waits for the
+worker and exits with its status.  Signals it receives are passed on
+to the worker.
+
+The socket is named after the .par file's path, inode, size and
+modification time, and the interpreter, so a rebuilt or redeployed
+.par file never uses a zygote of an older version.  Sockets live in a
+directory only the user can access, $SUBPAR_ZYGOTE_DIR if set.  If
+there is no zygote, or it doesn't answer, the run goes on as usual.
+A zygote exits after $SUBPAR_ZYGOTE_IDLE_SECONDS (default 600)
+without work.  Set SUBPAR_ZYGOTE=0 to not use zygotes at all.
+
+Caveats: modules imported by the zygote see its environment and
+working directory, not those of each run, and threads they start at
+import time don't exist in workers.
+
+This needs Python 3, since file descriptors are passed with
+socket.sendmsg().
+"""
+
+import array
+import errno
+import fcntl
+import hashlib
+import io
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+
+# Environment variables
+ENABLE_VAR = 'SUBPAR_ZYGOTE'
+DIR_VAR = 'SUBPAR_ZYGOTE_DIR'
+IDLE_VAR = 'SUBPAR_ZYGOTE_IDLE_SECONDS'
+
+_default_idle_seconds = 600
+
+# Request is a 4 byte length, then that much JSON.  Replies are the
+# worker's pid, then its exit status, or minus the signal that killed
+# it.
+_length = struct.Struct('<I')
+_reply = struct.Struct('<i')
+
+_stdio_fds = (0, 1, 2)
+
+# Signals passed on to the worker
+_forwarded_signals = ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT', 'SIGUSR1',
+                      'SIGUSR2')
+
+
+def _log(msg):
+    """Print a debugging message in the same format as python -vv output"""
+    if sys.flags.verbose:
+        sys.stderr.write(msg)
+        sys.stderr.write('\n')
+
+
+def is_supported():
+    """Return True if zygotes can be used in this process"""
+    return (hasattr(socket, 'AF_UNIX') and
+            hasattr(socket.socket, 'sendmsg') and
+            os.environ.get(ENABLE_VAR, '1') != '0')
+
+
+def _socket_dir():
+    """Return the directory holding zygote sockets, or None if unsafe"""
+    directory = os.environ.get(DIR_VAR) or os.path.join(
+        tempfile.gettempdir(), 'subpar-zygote-%d' % os.getuid())
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return None
+    st = os.lstat(directory)
+    if st.st_uid != os.getuid() or st.st_mode & 0o077:
+        _log('# not using zygote directory %s with unsafe owner or mode' %
+             directory)
+        return None
+    return directory
+
+
+def socket_path(archive_path):
+    """Return the zygote socket path for a .par file, or None"""
+    directory = _socket_dir()
+    if directory is None:
+        return None
+    st = os.stat(archive_path)
+    key = '\0'.join(str(part) for part in (
+        os.path.realpath(archive_path), st.st_dev, st.st_ino, st.st_size,
+        st.st_mtime, sys.executable, sys.version, sys.flags))
+    digest = hashlib.sha256(key.encode('utf-8', 'surrogateescape'))
+    return os.path.join(directory, digest.hexdigest()[:32] + '.sock')
+
+
+def _recv_exactly(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def forward(path):
+    """Run this program in the zygote listening on path, if any.
+
+    Returns:
+        None if there is no working zygote.  Otherwise, doesn't return,
+        but exits with the worker's status.
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+        request = json.dumps({
+            'argv': sys.argv,
+            'env': dict(os.environ),
+            'cwd': os.getcwd(),
+        }).encode('utf-8', 'surrogateescape')
+        fds = array.array('i', _stdio_fds)
+        conn.sendmsg([_length.pack(len(request)) + request],
+                     [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())])
+        pid = _reply.unpack(_recv_exactly(conn, _reply.size))[0]
+    except (OSError, EOFError) as e:
+        _log('# no zygote at %s: %s' % (path, e))
+        conn.close()
+        return None
+    _log('# running in zygote worker %d' % pid)
+
+    def _pass_on(signum, _):
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+    for name in _forwarded_signals:
+        signal.signal(getattr(signal, name), _pass_on)
+
+    while True:
+        try:
+            status = _reply.unpack(_recv_exactly(conn, _reply.size))[0]
+            break
+        except EOFError:
+            # Lost the zygote, so we can't know how the worker did
+            status = 1
+            break
+        except InterruptedError:
+            continue
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(_resend_signal(status))
+
+
+def spawn(path, archive_path):
+    """Start a zygote in the background, from the current state.
+
+    Returns once the zygote listens on path, or has given up.  In the
+    zygote, this doesn't return.
+    """
+    # The zygote closes its end when it is ready
+    ready_read, ready_write = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(ready_write)
+        os.waitpid(pid, 0)
+        os.read(ready_read, 1)
+        os.close(ready_read)
+        return
+    # Detach from the terminal and from the caller's process
+    try:
+        os.close(ready_read)
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in _stdio_fds:
+            os.dup2(devnull, fd)
+        os.close(devnull)
+        _serve(path, archive_path, ready_write)
+    finally:
+        os._exit(0)
+
+
+def _preload(main_code):
+    """Import the modules __main__.py imports at its top level"""
+    import ast
+    try:
+        tree = ast.parse(main_code)
+    except (SyntaxError, ValueError):
+        return
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and not node.level:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            try:
+                __import__(name)
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+
+def _serve(path, archive_path, ready_fd):
+    """Answer requests on path until idle, closing ready_fd once listening"""
+    # Only one zygote per socket
+    lock = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return
+    if os.path.exists(path):
+        os.remove(path)
+
+    main = sys.modules['__main__']
+    main_globals = dict(main.__dict__)
+    main_filename = getattr(main, '__file__', None) or os.path.join(
+        archive_path, '__main__.py')
+    import zipimport
+    source = zipimport.zipimporter(archive_path).get_data('__main__.py')
+    main_code = compile(source, main_filename, 'exec', dont_inherit=True)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(64)
+    os.close(ready_fd)
+    # Requests wait in the backlog meanwhile
+    _preload(source)
+    listener.settimeout(float(os.environ.get(IDLE_VAR, '') or
+                              _default_idle_seconds))
+    # Workers are reaped by their waiter, and waiters by the system
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    for name in _forwarded_signals:
+        signal.signal(getattr(signal, name), signal.SIG_IGN)
+    st = os.stat(archive_path)
+    try:
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                return
+            conn.settimeout(None)
+            if _is_stale(archive_path, st):
+                # Let the caller start normally
+                return
+            fds = []
+            try:
+                request, fds = _receive(conn)
+                if os.fork() == 0:
+                    listener.close()
+                    _wait_for_worker(conn, request, fds, main_code,
+                                     main_globals)
+            except (OSError, EOFError, ValueError):
+                pass
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                conn.close()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _is_stale(archive_path, st):
+    """Return whether the .par file changed since it was stat()ed as st"""
+    try:
+        current = os.stat(archive_path)
+    except OSError:
+        return True
+    return (current.st_ino, current.st_mtime) != (st.st_ino, st.st_mtime)
+
+
+def _receive(conn):
+    """Return the request and stdio file descriptors sent by forward()"""
+    fd_size = array.array('i').itemsize
+    data, ancdata, _, _ = conn.recvmsg(
+        _length.size, socket.CMSG_LEN(len(_stdio_fds) * fd_size))
+    fds = array.array('i')
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) -
+                                    len(cmsg_data) % fd_size])
+    fds = list(fds)
+    if len(data) < _length.size:
+        data += _recv_exactly(conn, _length.size - len(data))
+    size = _length.unpack(data)[0]
+    request = json.loads(_recv_exactly(conn, size).decode(
+        'utf-8', 'surrogateescape'))
+    if len(fds) != len(_stdio_fds):
+        raise ValueError('Expected %d file descriptors, got %d' % (
+            len(_stdio_fds), len(fds)))
+    return request, fds
+
+
+def _wait_for_worker(conn, request, fds, main_code, main_globals):
+    """Fork a worker for a request, and report its status"""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        os._exit(_run_worker(request, fds, main_code, main_globals))
+    try:
+        for fd in fds:
+            os.close(fd)
+        conn.sendall(_reply.pack(pid))
+        _, wait_status = os.waitpid(pid, 0)
+        conn.sendall(_reply.pack(_status(wait_status)))
+    finally:
+        os._exit(0)
+
+
+def _status(wait_status):
+    """Return the exit status, or minus the signal, from os.waitpid()"""
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def _resend_signal(status):
+    """Kill this process with the signal a status from _status() names.
+
+    Returns:
+        The exit status to use, if the signal doesn't end the process
+    """
+    if status < 0:
+        signal.signal(-status, signal.SIG_DFL)
+        os.kill(os.getpid(), -status)
+        status = 128 - status
+    return status
+
+
+def _run_worker(request, fds, main_code, main_globals):
+    """Run __main__.py as the program that sent the request.
+
+    Returns:
+        The exit status, after doing what the interpreter does when a
+        program ends
+    """
+    try:
+        for fd, target in zip(fds, _stdio_fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        for name in _forwarded_signals + ('SIGCHLD',):
+            signal.signal(getattr(signal, name), signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv[:] = request['argv']
+        _reopen_stdio()
+    except BaseException:  # pylint: disable=broad-except
+        return 1
+
+    from subpar.runtime import support
+    support._zygote_worker = True
+    main = sys.modules['__main__']
+    main.__dict__.clear()
+    main.__dict__.update(main_globals)
+    status = 0
+    try:
+        exec(main_code, main.__dict__)
+    except SystemExit as e:
+        status = _exit_status(e)
+    except BaseException as e:  # pylint: disable=broad-except
+        status = 1
+        # Leave this frame out of the traceback
+        exc_type, _, tb = sys.exc_info()
+        sys.excepthook(exc_type, e, tb.tb_next)
+        if isinstance(e, KeyboardInterrupt):
+            status = -signal.SIGINT
+
+    # Same as interpreter shutdown, except for the module teardown
+    import threading
+    import atexit
+    threading._shutdown()  # pylint: disable=protected-access
+    atexit._run_exitfuncs()  # pylint: disable=protected-access
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except (IOError, OSError, ValueError):
+            pass
+    return _resend_signal(status)
+
+
+def _exit_status(e):
+    """Return the exit status for a SystemExit, like the interpreter"""
+    if e.code is None:
+        return 0
+    if isinstance(e.code, int):
+        return e.code & 0xFF
+    sys.stderr.write('%s\n' % (e.code,))
+    return 1
+
+
+def _reopen_stdio():
+    """Replace sys.stdin, stdout and stderr with ones for the new fds"""
+    def reopen(fd, mode, old, line_buffering):
+        return io.open(fd, mode, buffering=1 if line_buffering else -1,
+                       encoding=getattr(old, 'encoding', None),
+                       errors=getattr(old, 'errors', None), closefd=False)
+    sys.stdin = sys.__stdin__ = reopen(0, 'r', sys.stdin, False)
+    sys.stdout = sys.__stdout__ = reopen(1, 'w', sys.stdout, os.isatty(1))
+    sys.stderr = sys.__stderr__ = reopen(2, 'w', sys.stderr, True)
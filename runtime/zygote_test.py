@@ -0,0 +1,127 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import unittest
+
+from subpar.compiler import test_utils
+from subpar.runtime import zygote
+
+
+@unittest.skipIf(sys.version_info[0] < 3, 'zygotes need Python 3')
+class ZygoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.conn, self.peer = socket.socketpair(socket.AF_UNIX,
+                                                 socket.SOCK_STREAM)
+        self.addCleanup(self.conn.close)
+        self.addCleanup(self.peer.close)
+
+    def _send(self, request, fds):
+        """Send a request the way forward() does, in two parts"""
+        data = json.dumps(request).encode('utf-8')
+        self.peer.sendmsg([zygote._length.pack(len(data))],
+                          [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                            array.array('i', fds).tobytes())])
+        self.peer.sendall(data)
+
+    def _pipe_fds(self, count):
+        fds = []
+        for _ in range(count):
+            read_fd, write_fd = os.pipe()
+            os.close(write_fd)
+            fds.append(read_fd)
+            self.addCleanup(os.close, read_fd)
+        return fds
+
+    def test__receive(self):
+        request = {'argv': ['a.par', 'x'], 'env': {'A': 'b'}, 'cwd': '/'}
+        self._send(request, self._pipe_fds(3))
+        received, fds = zygote._receive(self.conn)
+        self.assertEqual(received, request)
+        self.assertEqual(len(fds), 3)
+        for fd in fds:
+            # New descriptors, for the same files
+            self.assertEqual(os.read(fd, 1), b'')
+            os.close(fd)
+
+    def test__receive_wrong_fd_count(self):
+        self._send({}, self._pipe_fds(1))
+        with self.assertRaises(ValueError):
+            zygote._receive(self.conn)
+
+    def test__receive_truncated(self):
+        self.peer.sendall(zygote._length.pack(10) + b'{}')
+        self.peer.close()
+        with self.assertRaises(EOFError):
+            zygote._receive(self.conn)
+
+    def test__is_stale(self):
+        archive = test_utils.temp_file(b'archive')
+        st = os.stat(archive.name)
+        self.assertFalse(zygote._is_stale(archive.name, st))
+        os.utime(archive.name, (st.st_atime, st.st_mtime + 10))
+        self.assertTrue(zygote._is_stale(archive.name, st))
+        archive.close()
+        self.assertTrue(zygote._is_stale(archive.name, st))
+
+    def _wait_status(self, child):
+        """Run child() in a forked process, and return its wait status"""
+        pid = os.fork()
+        if pid == 0:
+            try:
+                child()
+            finally:
+                os._exit(99)
+        return os.waitpid(pid, 0)[1]
+
+    def test__status(self):
+        self.assertEqual(
+            zygote._status(self._wait_status(lambda: os._exit(3))), 3)
+        self.assertEqual(
+            zygote._status(self._wait_status(
+                lambda: os.kill(os.getpid(), signal.SIGTERM))),
+            -signal.SIGTERM)
+
+    def test__resend_signal(self):
+        self.assertEqual(zygote._resend_signal(0), 0)
+        self.assertEqual(zygote._resend_signal(4), 4)
+        # The handler the zygote installs isn't kept
+        wait_status = self._wait_status(lambda: (
+            signal.signal(signal.SIGUSR1, signal.SIG_IGN),
+            zygote._resend_signal(-signal.SIGUSR1)))
+        self.assertTrue(os.WIFSIGNALED(wait_status))
+        self.assertEqual(os.WTERMSIG(wait_status), signal.SIGUSR1)
+
+    def test__exit_status(self):
+        self.assertEqual(zygote._exit_status(SystemExit()), 0)
+        self.assertEqual(zygote._exit_status(SystemExit(3)), 3)
+        self.assertEqual(zygote._exit_status(SystemExit(258)), 2)
+        stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            self.assertEqual(zygote._exit_status(SystemExit('failed')), 1)
+            self.assertEqual(sys.stderr.getvalue(), 'failed\n')
+        finally:
+            sys.stderr = stderr
+
+
+if __name__ == '__main__':
+    unittest.main()
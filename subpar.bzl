@@ -18,119 +18,541 @@ load("@rules_python//python:defs.bzl", "py_binary", "py_test")
 
 DEFAULT_COMPILER = "//compiler:compiler.par"
 
-def _parfile_impl(ctx):
-    """Implementation of parfile() rule"""
+# Used to build fragments.  Not the .par, to avoid a dependency cycle
+# when building the compiler .par itself.
+_FRAGMENT_COMPILER = "//compiler:compiler"
+
+ParFragmentInfo = provider(
+    doc = "Zip files holding the files of Python libraries, for use by parfile()",
+    fields = {
+        "fragments": "depset of zip files, one per library with files of its own",
+    },
+)
+
+def _par_fragment_aspect_impl(target, ctx):
+    """Build a zip file of one library's own srcs and data"""
+    transitive = [
+        dep[ParFragmentInfo].fragments
+        for dep in getattr(ctx.rule.attr, "deps", [])
+        if ParFragmentInfo in dep
+    ]
+    own_files = getattr(ctx.rule.files, "srcs", []) + getattr(ctx.rule.files, "data", [])
+    if PyInfo not in target or not own_files:
+        return [ParFragmentInfo(fragments = depset(transitive = transitive))]
+
+    manifest = ctx.actions.args()
+    manifest.set_param_file_format("multiline")
+    manifest.add_all(own_files, map_each = _manifest_line)
+    sources_file = ctx.actions.declare_file(ctx.label.name + "_par_fragment_SOURCES")
+    ctx.actions.write(
+        output = sources_file,
+        content = manifest,
+        is_executable = False,
+    )
+
+    fragment = ctx.actions.declare_file(ctx.label.name + "_par_fragment.zip")
+    args = ctx.actions.args()
+    args.add("--fragment_only", "True")
+    args.add("--manifest_file", sources_file)
+    args.add("--workspace_name", ctx.workspace_name)
+    args.add("--output_par", fragment)
+    args.add("--zip_safe", "True")
+    ctx.actions.run(
+        inputs = own_files + [sources_file],
+        outputs = [fragment],
+        progress_message = "Building par fragment %s" % ctx.label,
+        executable = ctx.executable._fragment_compiler,
+        arguments = [args],
+        mnemonic = "PythonCompileFragment",
+        use_default_shell_env = True,
+    )
+    return [ParFragmentInfo(fragments = depset([fragment], transitive = transitive))]
+
+_par_fragment_aspect = aspect(
+    implementation = _par_fragment_aspect_impl,
+    attr_aspects = ["deps"],
+    attrs = {
+        "_fragment_compiler": attr.label(
+            default = Label(_FRAGMENT_COMPILER),
+            executable = True,
+            cfg = "exec",
+        ),
+    },
+)
+
+SubparSettingInfo = provider(
+    doc = "Value of a subpar build setting",
+    fields = {"value": "The value"},
+)
+
+def _setting_impl(ctx):
+    return [SubparSettingInfo(value = ctx.build_setting_value)]
 
-    # Find the main entry point
+string_setting = rule(
+    implementation = _setting_impl,
+    build_setting = config.string(flag = True),
+)
+
+int_setting = rule(
+    implementation = _setting_impl,
+    build_setting = config.int(flag = True),
+)
+
+bool_setting = rule(
+    implementation = _setting_impl,
+    build_setting = config.bool(flag = True),
+)
+
+ParPycInfo = provider(
+    doc = "Compiled .pyc files of Python libraries, for use by parfile()",
+    fields = {
+        "manifests": "depset of files listing stored paths of .pyc files",
+        "pycs": "depset of .pyc files",
+    },
+)
+
+def _par_pyc_aspect_impl(target, ctx):
+    """Compile one library's own srcs to .pyc files"""
+    deps = [
+        dep[ParPycInfo]
+        for dep in getattr(ctx.rule.attr, "deps", [])
+        if ParPycInfo in dep
+    ]
+    manifests = [info.manifests for info in deps]
+    pycs = [info.pycs for info in deps]
+    interpreter = ctx.attr._pyc_interpreter[SubparSettingInfo].value
+    srcs = [
+        src
+        for src in getattr(ctx.rule.files, "srcs", [])
+        if src.extension == "py"
+    ]
+    if not interpreter or PyInfo not in target or not srcs:
+        return [ParPycInfo(
+            manifests = depset(transitive = manifests),
+            pycs = depset(transitive = pycs),
+        )]
+
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = True)
+    args.set_param_file_format("multiline")
+    manifest = ctx.actions.args()
+    manifest.set_param_file_format("multiline")
+    own_pycs = []
+    for i, src in enumerate(srcs):
+        # Indexed, since two sources may have the same basename
+        pyc = ctx.actions.declare_file("%s_pyc/%d/%sc" % (ctx.label.name, i, src.basename))
+        own_pycs.append(pyc)
+        args.add(src)
+
+        # The path zipimport would compile the stored source under,
+        # less the location of the par file
+        args.add(_runfiles_path(ctx, src))
+        args.add(pyc)
+        manifest.add("%sc %s" % (src.short_path, pyc.path))
+
+    manifest_file = ctx.actions.declare_file("%s_pyc/SOURCES" % ctx.label.name)
+    ctx.actions.write(
+        output = manifest_file,
+        content = manifest,
+        is_executable = False,
+    )
+    optimize = ctx.attr._pyc_optimize[SubparSettingInfo].value
+    ctx.actions.run(
+        inputs = srcs + [ctx.file._bytecode],
+        outputs = own_pycs,
+        progress_message = "Compiling bytecode for %s" % ctx.label,
+        executable = interpreter,
+        arguments = [
+            ctx.file._bytecode.path,
+            "--optimize=%d" % optimize,
+            args,
+        ],
+        mnemonic = "PythonBytecode",
+        use_default_shell_env = True,
+    )
+    return [ParPycInfo(
+        manifests = depset([manifest_file], transitive = manifests),
+        pycs = depset(own_pycs, transitive = pycs),
+    )]
+
+_par_pyc_aspect = aspect(
+    implementation = _par_pyc_aspect_impl,
+    attr_aspects = ["deps"],
+    attrs = {
+        "_bytecode": attr.label(
+            default = Label("//compiler:bytecode.py"),
+            allow_single_file = True,
+        ),
+        "_pyc_interpreter": attr.label(default = Label("//:pyc_interpreter")),
+        "_pyc_optimize": attr.label(default = Label("//:pyc_optimize")),
+    },
+)
+
+def _main_py_file(ctx):
+    """Return the main entry point of a parfile() or similar rule"""
     py_files = ctx.files.main
     if len(py_files) == 0:
         fail("Expected exactly one .py file, found none", "main")
     elif len(py_files) > 1:
         fail("Expected exactly one .py file, found these: [%s]" % py_files, "main")
-    main_py_file = py_files[0]
-    if main_py_file not in ctx.attr.src.data_runfiles.files.to_list():
-        fail("Main entry point [%s] not listed in srcs" % main_py_file, "main")
+    return py_files[0]
+
+def _parfile_impl(ctx):
+    """Implementation of parfile() rule"""
 
-    # Find the list of things that must be built before this thing is built
+    # Everything below avoids flattening the runfiles depsets during
+    # analysis.  The compiler checks that the main entry point is in
+    # the manifest, and maps short paths to stored paths.
     # TODO: also handle ctx.attr.src.data_runfiles.symlinks
-    inputs = ctx.attr.src.default_runfiles.files.to_list()
+    runfiles = ctx.attr.src.default_runfiles
+    return _compile_par(
+        ctx,
+        main_py_file = _main_py_file(ctx),
+        files = runfiles.files,
+        empty_filenames = runfiles.empty_filenames,
+        import_roots = ctx.attr.src[PyInfo].imports,
+        libraries = [ctx.attr.src],
+        stub_file = ctx.attr.src.files_to_run.executable,
+        extra_inputs = [ctx.attr.src.files_to_run.runfiles_manifest],
+        runfiles = runfiles,
+    )
+
+def _parfile_from_deps_impl(ctx):
+    """Implementation of parfile_from_deps() rule"""
+    main_py_file = _main_py_file(ctx)
+    files = depset(
+        [main_py_file] + ctx.files.srcs + ctx.files.data,
+        transitive = [
+            dep[PyInfo].transitive_sources
+            for dep in ctx.attr.deps
+        ] + [
+            target[DefaultInfo].default_runfiles.files
+            for target in ctx.attr.deps + ctx.attr.data
+        ],
+    )
+    own_import_roots = [
+        "/".join([ctx.workspace_name] + [
+            part
+            for part in [ctx.label.package, imp]
+            if part and part != "."
+        ])
+        for imp in ctx.attr.imports
+    ]
+    import_roots = depset(
+        own_import_roots,
+        transitive = [dep[PyInfo].imports for dep in ctx.attr.deps],
+    )
+    return _compile_par(
+        ctx,
+        main_py_file = main_py_file,
+        files = files,
+        import_roots = import_roots,
+        libraries = ctx.attr.deps,
+        interpreter = ctx.attr.interpreter,
+        create_init = ctx.attr.legacy_create_init,
+    )
+
+def _compile_par(
+        ctx,
+        main_py_file,
+        files,
+        import_roots,
+        libraries,
+        empty_filenames = None,
+        stub_file = None,
+        interpreter = None,
+        create_init = False,
+        extra_inputs = [],
+        runfiles = None):
+    """Run the .par compiler on a set of files.
+
+    Args:
+      ctx: Context of a parfile() or similar rule
+      main_py_file: File of the main entry point
+      files: depset of files to store, by short path
+      import_roots: depset of directories to add to sys.path
+      libraries: Targets whose ParPycInfo and ParFragmentInfo to use
+      empty_filenames: Optional depset of zero-length files to store
+      stub_file: py_binary() stub to read the interpreter from
+      interpreter: Interpreter path, if there is no stub_file
+      create_init: Whether the compiler should add missing __init__.py
+        files, if there are no empty_filenames
+      extra_inputs: Other files the compiler reads
+      runfiles: Optional runfiles holding files, for a development
+        launcher
+    """
+    if ctx.attr._dev_mode[SubparSettingInfo].value:
+        return _compile_dev_launcher(
+            ctx,
+            main_py_file = main_py_file,
+            files = files,
+            import_roots = import_roots,
+            empty_filenames = empty_filenames,
+            stub_file = stub_file,
+            interpreter = interpreter,
+            create_init = create_init,
+            runfiles = runfiles,
+        )
 
     # Make a manifest of files to store in the .par file.  The
-    # runfiles manifest is not quite right, so we make our own.
-    sources_map = {}
-
-    # First, add the zero-length __init__.py files
-    for empty in ctx.attr.src.default_runfiles.empty_filenames.to_list():
-        stored_path = _prepend_workspace(empty, ctx)
-        local_path = ""
-        sources_map[stored_path] = local_path
-
-    # Now add the regular (source and generated) files
-    for input_file in inputs:
-        stored_path = _prepend_workspace(input_file.short_path, ctx)
-        local_path = input_file.path
-        sources_map[stored_path] = local_path
-
-    # Now make a nice sorted list
-    sources_lines = []
-    for k, v in sorted(sources_map.items()):
-        sources_lines.append("%s %s" % (k, v))
-    sources_content = "\n".join(sources_lines) + "\n"
+    # runfiles manifest is not quite right, so we make our own.  The
+    # zero-length __init__.py files come first, so that regular
+    # (source and generated) files with the same name override them.
+    # One line per file, unquoted, as manifest_parser expects.
+    manifest = ctx.actions.args()
+    manifest.set_param_file_format("multiline")
+    if empty_filenames != None:
+        manifest.add_all(empty_filenames)
+    manifest.add_all(files, map_each = _manifest_line)
 
     # Write the list to the manifest file
     sources_file = ctx.actions.declare_file(ctx.label.name + "_SOURCES")
     ctx.actions.write(
         output = sources_file,
-        content = sources_content,
+        content = manifest,
         is_executable = False,
     )
 
-    # Find the list of directories to add to sys.path
-    import_roots = ctx.attr.src[PyInfo].imports.to_list()
-
     # Inputs to the action, but don't actually get stored in the .par file
-    extra_inputs = [
-        sources_file,
-        ctx.attr.src.files_to_run.runfiles_manifest,
-    ]
+    extra_inputs = [sources_file] + extra_inputs
 
     zip_safe = ctx.attr.zip_safe
 
     # Assemble command line for .par compiler
-    args = ctx.attr.compiler_args + [
-        "--manifest_file",
-        sources_file.path,
-        "--output_par",
-        ctx.outputs.executable.path,
-        "--stub_file",
-        ctx.attr.src.files_to_run.executable.path,
-        "--zip_safe",
-        str(zip_safe),
-    ]
-    for import_root in import_roots:
-        args.extend(['--import_root', import_root])
-    args.append(main_py_file.path)
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = False)
+    args.set_param_file_format("multiline")
+    args.add_all(ctx.attr.compiler_args)
+    args.add("--manifest_file", sources_file)
+    args.add("--workspace_name", ctx.workspace_name)
+    args.add("--output_par", ctx.outputs.executable)
+    if stub_file:
+        args.add("--stub_file", stub_file)
+    else:
+        args.add("--interpreter", interpreter)
+    args.add_all(ctx.attr.interpreter_flags, format_each = "--interpreter_flag=%s")
+    if create_init:
+        args.add("--create_init", "True")
+    args.add("--zip_safe", str(zip_safe))
+
+    # Directories to add to sys.path
+    args.add_all(import_roots, before_each = "--import_root")
+
+    if ctx.file.layout_profile:
+        args.add("--layout_profile", ctx.file.layout_profile)
+        extra_inputs.append(ctx.file.layout_profile)
+    outputs = [ctx.outputs.executable]
+    output_groups = {}
+    if ctx.attr.prune_imports:
+        prune_report = ctx.actions.declare_file(ctx.label.name + "_prune_report.txt")
+        args.add("--prune_imports", "True")
+        args.add("--prune_report", prune_report)
+        args.add_all(ctx.attr.keep_modules, before_each = "--keep_module")
+        outputs.append(prune_report)
+        output_groups["prune_report"] = depset([prune_report])
+    tools = [stub_file] if stub_file else []
+    if ctx.attr.strip_elf:
+        args.add("--strip_elf", "True")
+        if ctx.executable.strip_tool:
+            args.add("--strip_tool", ctx.executable.strip_tool)
+            tools.append(ctx.executable.strip_tool)
+        if ctx.attr.elf_debug_info:
+            elf_debug = ctx.actions.declare_directory(ctx.label.name + "_elf_debug")
+            args.add("--elf_debug_dir", elf_debug.path)
+            outputs.append(elf_debug)
+            output_groups["elf_debug"] = depset([elf_debug])
+    if ctx.attr.minify_sources:
+        minify_report = ctx.actions.declare_file(ctx.label.name + "_minify_report.txt")
+        args.add("--minify_sources", "True")
+        args.add("--minify_report", minify_report)
+        args.add_all(ctx.attr.keep_docstrings, before_each = "--keep_docstrings")
+        outputs.append(minify_report)
+        output_groups["minify_report"] = depset([minify_report])
+
+        # .pyc files from _par_pyc_aspect are compiled again from the
+        # minified sources
+        pyc_interpreter = ctx.attr._pyc_interpreter[SubparSettingInfo].value
+        if pyc_interpreter:
+            args.add("--pyc_interpreter", pyc_interpreter)
+            args.add("--pyc_optimize", str(ctx.attr._pyc_optimize[SubparSettingInfo].value))
+    if ctx.attr.build_report:
+        build_report = ctx.actions.declare_file(ctx.label.name + "_build_report.json")
+        args.add("--build_report", build_report)
+        outputs.append(build_report)
+        output_groups["build_report"] = depset([build_report])
+    if ctx.attr.dedup_content:
+        args.add("--dedup_content", "True")
+    if ctx.attr.verify_archive:
+        args.add("--verify_archive", "True")
+    if ctx.attr.zygote:
+        args.add("--zygote", "True")
+    if ctx.attr.bytecode_cache:
+        args.add("--bytecode_cache", "True")
+    if ctx.attr.freeze_modules:
+        args.add("--freeze_modules", "True")
+        args.add_all(ctx.attr.frozen_modules, before_each = "--frozen_module")
+    args.add_all(ctx.attr.prefetch_modules, before_each = "--prefetch_module")
+    if ctx.attr.prefetch_profile:
+        args.add("--prefetch_profile", "True")
+    args.add_all(ctx.attr.lazy_import_packages, before_each = "--lazy_import_package")
+    default_files = [ctx.outputs.executable]
+    if ctx.attr.dependency_archive:
+        name = ctx.label.name
+        if name.endswith(".par"):
+            name = name[:-len(".par")]
+        dependency_archive = ctx.actions.declare_file(name + "_deps.par")
+        args.add("--dependency_archive", dependency_archive)
+        outputs.append(dependency_archive)
+        default_files.append(dependency_archive)
+        output_groups["dependency_archive"] = depset([dependency_archive])
+    args.add(main_py_file)
+
+    transitive_inputs = [files]
+
+    # Wheels and zip files, copied into the .par without unpacking
+    for target, prefix in ctx.attr.zip_inputs.items():
+        args.add_all(
+            target.files,
+            before_each = "--zip_input",
+            format_each = prefix.replace("%", "%%") + "=%s",
+        )
+        transitive_inputs.append(target.files)
+
+    # Bytecode compiled per library, see _par_pyc_aspect
+    pyc_infos = [library[ParPycInfo] for library in libraries]
+    pyc_manifests = depset(transitive = [info.manifests for info in pyc_infos])
+    args.add_all(pyc_manifests, before_each = "--extra_manifest_file")
+    transitive_inputs.append(pyc_manifests)
+    transitive_inputs.extend([info.pycs for info in pyc_infos])
+
+    # Library files are copied from prebuilt fragments where possible
+    if ctx.attr.fragments:
+        fragments = depset(transitive = [
+            library[ParFragmentInfo].fragments
+            for library in libraries
+        ])
+        args.add_all(fragments, before_each = "--fragment")
+        transitive_inputs.append(fragments)
 
     # Run compiler
     ctx.actions.run(
-        inputs = inputs + extra_inputs,
-        tools = [ctx.attr.src.files_to_run.executable],
-        outputs = [ctx.outputs.executable],
+        inputs = depset(extra_inputs, transitive = transitive_inputs),
+        tools = tools,
+        outputs = outputs,
         progress_message = "Building par file %s" % ctx.label,
         executable = ctx.executable.compiler,
-        arguments = args,
+        arguments = [args],
         mnemonic = "PythonCompile",
         use_default_shell_env = True,
     )
 
-    # .par file itself has no runfiles and no providers
-    return []
-
-def _prepend_workspace(path, ctx):
-    """Given a path, prepend the workspace name as the parent directory"""
-
-    # It feels like there should be an easier, less fragile way.
-    if path.startswith("../"):
-        # External workspace, for example
-        # '../protobuf/python/google/protobuf/any_pb2.py'
-        stored_path = path[len("../"):]
-    elif path.startswith("external/"):
-        # External workspace, for example
-        # 'external/protobuf/python/__init__.py'
-        stored_path = path[len("external/"):]
+    # .par file itself has no runfiles, only optional reports, and the
+    # dependency archive that must be next to it
+    return [
+        DefaultInfo(
+            files = depset(default_files),
+            runfiles = ctx.runfiles(files = default_files[1:]),
+        ),
+        OutputGroupInfo(**output_groups),
+    ]
+
+def _compile_dev_launcher(
+        ctx,
+        main_py_file,
+        files,
+        import_roots,
+        empty_filenames,
+        stub_file,
+        interpreter,
+        create_init,
+        runfiles):
+    """Write a launcher that runs the program from its runfiles tree.
+
+    Used instead of _compile_par() when the @subpar//:dev_mode build
+    setting is on.  The compile action reads only the list of files,
+    so it doesn't run again when their content changes.  Options that
+    only affect the archive are ignored.
+    """
+    manifest = ctx.actions.args()
+    manifest.set_param_file_format("multiline")
+    if empty_filenames != None:
+        manifest.add_all(empty_filenames)
+    manifest.add_all(files, map_each = _manifest_line)
+    sources_file = ctx.actions.declare_file(ctx.label.name + "_SOURCES")
+    ctx.actions.write(
+        output = sources_file,
+        content = manifest,
+        is_executable = False,
+    )
+
+    args = ctx.actions.args()
+    args.use_param_file("@%s", use_always = False)
+    args.set_param_file_format("multiline")
+    args.add_all(ctx.attr.compiler_args)
+    args.add("--dev_launcher", "True")
+    args.add("--manifest_file", sources_file)
+    args.add("--workspace_name", ctx.workspace_name)
+    args.add("--output_par", ctx.outputs.executable)
+    if stub_file:
+        args.add("--stub_file", stub_file)
     else:
-        # Main workspace, for example 'mypackage/main.py'
-        stored_path = ctx.workspace_name + "/" + path
-    return stored_path
+        args.add("--interpreter", interpreter)
+    args.add_all(ctx.attr.interpreter_flags, format_each = "--interpreter_flag=%s")
+    if create_init:
+        args.add("--create_init", "True")
+    args.add("--zip_safe", str(ctx.attr.zip_safe))
+    args.add_all(import_roots, before_each = "--import_root")
+
+    # Wheels and zip files are imported from as they are
+    zip_files = depset(transitive = [
+        target.files
+        for target in ctx.attr.zip_inputs
+    ])
+    args.add_all([
+        _runfiles_path(ctx, zip_file)
+        for zip_file in zip_files.to_list()
+    ], before_each = "--import_root")
+    args.add_all(ctx.attr.lazy_import_packages, before_each = "--lazy_import_package")
+    args.add(main_py_file)
 
-parfile_attrs = {
-    "src": attr.label(mandatory = True),
+    ctx.actions.run(
+        inputs = [sources_file] + ([stub_file] if stub_file else []),
+        outputs = [ctx.outputs.executable],
+        progress_message = "Building development launcher %s" % ctx.label,
+        executable = ctx.executable.compiler,
+        arguments = [args],
+        mnemonic = "PythonCompile",
+        use_default_shell_env = True,
+    )
+
+    if runfiles == None:
+        runfiles = ctx.runfiles(transitive_files = files)
+    runfiles = runfiles.merge(ctx.runfiles(transitive_files = zip_files))
+    runfiles = runfiles.merge(ctx.attr._dev_runtime[DefaultInfo].default_runfiles)
+    return [DefaultInfo(
+        files = depset([ctx.outputs.executable]),
+        runfiles = runfiles,
+    )]
+
+def _manifest_line(input_file):
+    """Return the manifest line for a runfile, see _compile_par()"""
+    return "%s %s" % (input_file.short_path, input_file.path)
+
+def _runfiles_path(ctx, input_file):
+    """Return the path of a file under a runfiles tree.
+
+    It is also the file's stored path in a par file.
+    """
+    if input_file.short_path.startswith("../"):
+        return input_file.short_path[len("../"):]
+    return ctx.workspace_name + "/" + input_file.short_path
+
+_common_attrs = {
     "main": attr.label(
         mandatory = True,
         allow_single_file = True,
     ),
     "imports": attr.string_list(default = []),
-    "default_python_version": attr.string(mandatory = True),
     "compiler": attr.label(
         default = Label(DEFAULT_COMPILER),
         executable = True,
@@ -138,55 +560,357 @@ parfile_attrs = {
     ),
     "compiler_args": attr.string_list(default = []),
     "zip_safe": attr.bool(default = True),
+    "layout_profile": attr.label(allow_single_file = True),
+    "prune_imports": attr.bool(default = False),
+    "keep_modules": attr.string_list(default = []),
+    "strip_elf": attr.bool(default = False),
+    "strip_tool": attr.label(
+        allow_single_file = True,
+        executable = True,
+        cfg = "exec",
+    ),
+    "elf_debug_info": attr.bool(default = False),
+    "minify_sources": attr.bool(default = False),
+    "keep_docstrings": attr.string_list(default = []),
+    "fragments": attr.bool(default = False),
+    "zip_inputs": attr.label_keyed_string_dict(allow_files = [".whl", ".zip"]),
+    "build_report": attr.bool(default = False),
+    "dedup_content": attr.bool(default = False),
+    "verify_archive": attr.bool(default = False),
+    "dependency_archive": attr.bool(default = False),
+    "interpreter_flags": attr.string_list(default = []),
+    "zygote": attr.bool(default = False),
+    "bytecode_cache": attr.bool(default = False),
+    "freeze_modules": attr.bool(default = False),
+    "frozen_modules": attr.string_list(default = []),
+    "prefetch_modules": attr.string_list(default = []),
+    "prefetch_profile": attr.bool(default = False),
+    "lazy_import_packages": attr.string_list(default = []),
+    "_pyc_interpreter": attr.label(default = Label("//:pyc_interpreter")),
+    "_pyc_optimize": attr.label(default = Label("//:pyc_optimize")),
+    "_dev_mode": attr.label(default = Label("//:dev_mode")),
+    "_dev_runtime": attr.label(default = Label("//runtime:support")),
 }
 
-# Rule to create a parfile given a py_binary() as input
-parfile = rule(
+def _library_aspects(fragments):
+    """Return the aspects to apply to the libraries of a par file.
+
+    The fragment aspect is only applied when fragments are used, so
+    that other par files don't pay for visiting every library.
+    """
+    if fragments:
+        return [_par_fragment_aspect, _par_pyc_aspect]
+    return [_par_pyc_aspect]
+
+def _parfile_attrs(fragments):
+    """Return the attributes of a parfile() or parfile_test() rule"""
+    return dict(
+        _common_attrs,
+        src = attr.label(
+            mandatory = True,
+            aspects = _library_aspects(fragments),
+        ),
+        default_python_version = attr.string(mandatory = True),
+    )
+
+parfile_attrs = _parfile_attrs(fragments = False)
+
+# Rules to create a parfile given a py_binary() as input, see parfile()
+_parfile = rule(
     attrs = parfile_attrs,
     executable = True,
     implementation = _parfile_impl,
     test = False,
 )
-"""A self-contained, single-file Python program, with a .par file extension.
 
-You probably want to use par_binary() instead of this.
+_parfile_with_fragments = rule(
+    attrs = _parfile_attrs(fragments = True),
+    executable = True,
+    implementation = _parfile_impl,
+    test = False,
+)
+
+def parfile(name, fragments = False, **kwargs):
+    """A self-contained, single-file Python program, with a .par file extension.
+
+    You probably want to use par_binary() instead of this.
+
+    Args:
+      src: A py_binary() target
+      main: The name of the source file that is the main entry point of
+        the application.
+
+        See [py_binary.main](http://www.bazel.io/docs/be/python.html#py_binary.main)
+
+      imports: List of import directories to be added to the PYTHONPATH.
+
+        See [py_binary.imports](http://www.bazel.io/docs/be/python.html#py_binary.imports)
+
+      default_python_version: A string specifying the default Python major version to use when building this par file.
+
+        See [py_binary.default_python_version](http://www.bazel.io/docs/be/python.html#py_binary.default_python_version)
+
+      compiler: Internal use only.
+
+      zip_safe: Whether to import Python code and read datafiles directly
+                from the zip archive.  Otherwise, if False, all files are
+                extracted to a temporary directory on disk each time the
+                par file executes.
+
+      layout_profile: Optional file listing stored paths in the order they
+                      were first accessed during a training run, one per
+                      line.  Those entries are placed contiguously at the
+                      start of the archive and read ahead at startup.
+
+      prune_imports: Whether to leave out Python modules that can't be
+                     imported, starting from the main entry point.  A
+                     list of kept and dropped modules is available in the
+                     `prune_report` output group.
+
+      keep_modules: Modules that are imported dynamically, which are kept
+                    along with everything they import when pruning.  A
+                    name ending in `.*` means every module in that package.
 
-Args:
-  src: A py_binary() target
-  main: The name of the source file that is the main entry point of
-    the application.
+      strip_elf: Whether to remove debugging information from ELF shared
+                 libraries and executables stored in the par file.
 
-    See [py_binary.main](http://www.bazel.io/docs/be/python.html#py_binary.main)
+      strip_tool: Optional `strip` program to use for `strip_elf`.  By
+                  default, a built-in implementation is used.
 
-  imports: List of import directories to be added to the PYTHONPATH.
+      elf_debug_info: Whether to keep the debugging information removed by
+                      `strip_elf`, as `<stored path>.debug` files in the
+                      `elf_debug` output group.  Like the output of
+                      `objcopy --only-keep-debug`, each holds the debug
+                      sections, symbols and notes, but no code or data.
 
-    See [py_binary.imports](http://www.bazel.io/docs/be/python.html#py_binary.imports)
+      minify_sources: Whether to remove comments, docstrings and assert
+                      statements from Python sources, like `python -OO`.
+                      Bytes saved per package are listed in the
+                      `minify_report` output group.
 
-  default_python_version: A string specifying the default Python major version to use when building this par file.
+      keep_docstrings: Stored paths, or directory prefixes, of Python
+                       sources whose docstrings are read at runtime, and
+                       must be kept by `minify_sources`.  Sources that
+                       mention `__doc__` always keep their docstrings.
 
-    See [py_binary.default_python_version](http://www.bazel.io/docs/be/python.html#py_binary.default_python_version)
+      fragments: Whether to copy library files from a zip file built once
+                 per `py_library`, instead of reading each file again for
+                 every par file.  Fragments are cached like any other
+                 action output, so libraries shared by many par files are
+                 only processed once.  The aspect building them is only
+                 applied to par files that set this.
 
-  compiler: Internal use only.
+      zip_inputs: Wheels or zip files to store in the par file, mapped to
+                  the directory to store their contents under.  Entries
+                  are copied as is, without unpacking or recompressing
+                  them.  The directory is added to `sys.path`.
 
-  zip_safe: Whether to import Python code and read datafiles directly
-            from the zip archive.  Otherwise, if False, all files are
-            extracted to a temporary directory on disk each time the
-            par file executes.
+      build_report: Whether to write a JSON report of the size, compressed
+                    size and compression time of each entry, rolled up by
+                    directory and import root, along with the time spent
+                    in each phase of the compiler.  It is available in the
+                    `build_report` output group.
 
-TODO(b/27502830): A directory foo.par.runfiles is also created. This
-is a bug, don't use or depend on it.
-"""
+      dedup_content: Whether to store files with identical content once.
+                     The other copies are listed in an alias table that
+                     the runtime installs into zipimport before importing
+                     anything, and are copied when extracting.  Only
+                     Python modules are made aliases, since only the
+                     subpar runtime sees them: zipfile, pkg_resources,
+                     importlib.resources, and Python running the par
+                     file without the runtime, don't.
 
-parfile_test = rule(
+      verify_archive: Whether to check, after writing the par file, that
+                      every stored file reads back with the intended
+                      content through both zipfile and zipimport,
+                      unmodified, and that the alias table lists every
+                      alias.
+
+      dependency_archive: Whether to leave files from other workspaces
+                          than the main one, such as third-party packages,
+                          out of the par file, and write them to
+                          `<name>_deps.par` instead.  The par file records
+                          the digest of that archive, and at runtime looks
+                          for it in `$SUBPAR_DEPENDENCY_PATH`, then next to
+                          itself, under its own name or `<digest>.par`.
+                          Binaries with the same dependencies share one
+                          dependency archive, since it is built
+                          deterministically.
+
+      interpreter_flags: Command line flags to run the interpreter with,
+                         for example `["-S", "-E"]` to skip the site
+                         module and ignore PYTHON* environment variables.
+                         With more than one flag, the par file starts
+                         with a short shell script instead of a `#!` line,
+                         since Linux passes a single argument on that line.
+
+      zygote: Whether to run the par file in a resident process that
+              already has its modules imported.  The first run starts the
+              process, and later runs send it their arguments,
+              environment, working directory and standard streams, and
+              wait for a copy of it forked to run them.  Useful for
+              command line tools that run often and import a lot.  Needs
+              Python 3, and has no effect with `zip_safe = False`.  See
+              runtime/zygote.py.
+
+      bytecode_cache: Whether to keep the code of modules compiled from
+                      source at runtime, because the par file has no .pyc
+                      for them, in a per-user cache directory, and load it
+                      from there on later runs.  The cache is in
+                      `$SUBPAR_BYTECODE_CACHE`, or else
+                      `~/.cache/subpar/bytecode`, and is trimmed to
+                      `$SUBPAR_BYTECODE_CACHE_SIZE` bytes, 256 MiB by
+                      default.  Nothing is written to it under `python -B`
+                      or `PYTHONDONTWRITEBYTECODE`.  Needs Python 3.10 or
+                      later at runtime, and has no effect with
+                      `zip_safe = False`.
+
+      freeze_modules: Whether to store the code objects of the par file's
+                      pure Python modules in a single entry, which is read
+                      once at startup.  Modules are then imported from it
+                      without a lookup, read and decompression each, and
+                      keep the `__file__`, `__path__` and `__spec__` they
+                      get from zipimport.  The code must be compiled for
+                      the Python version the par file runs under: either
+                      set `@subpar//:pyc_interpreter`, or build with that
+                      version.  Otherwise the bundle is ignored.  Needs
+                      Python 3.10 or later at runtime.
+
+      frozen_modules: Modules and packages to freeze with
+                      `freeze_modules`.  By default, all of them.
+
+      prefetch_modules: Modules and packages to load in the background at
+                        startup.  Threads read, decompress and compile
+                        them while `__main__` runs, so importing them
+                        later only waits for whatever isn't done yet.
+                        `$SUBPAR_PREFETCH_THREADS` sets the number of
+                        threads, 2 by default, and 0 turns prefetching
+                        off.  Needs Python 3.10 or later at runtime, and
+                        has no effect with `zip_safe = False`.
+
+      prefetch_profile: Whether to also prefetch the modules imported in
+                        `layout_profile`, in the order they were imported.
+
+      lazy_import_packages: Modules and packages to import lazily.  Each
+                            module in them is run only when one of its
+                            attributes is first used, with importlib's
+                            LazyLoader, so `import big.module` costs
+                            almost nothing until `big.module` is used.
+                            Importing a submodule uses its package.  Set
+                            `$SUBPAR_LAZY_IMPORT_REPORT` to a filename to
+                            have a report written to it at exit, listing
+                            the lazy modules that were loaded anyway, and
+                            where they were first used.  Needs Python 3.10
+                            or later at runtime for `zip_safe` par files.
+
+    If the `@subpar//:pyc_interpreter` build setting names an interpreter,
+    each Python library's sources are compiled to .pyc files by that
+    interpreter in an action of its own, and the .pyc files are stored
+    next to the sources.  The interpreter must be the same Python version
+    the par file runs under, but needn't be the one Bazel runs tools with.
+    `@subpar//:pyc_optimize` sets the optimization level.  With
+    `minify_sources`, the .pyc files of minified sources are compiled
+    again from the minified source, when building the par file.
+
+    If the `@subpar//:dev_mode` build setting is on, a short launcher
+    script is built instead of the par file, for a quicker edit, build
+    and run cycle.  The launcher runs the program from the
+    `foo.par.runfiles` tree Bazel builds next to it, with the same
+    `sys.path` and `setup()` arguments as the par file, so rebuilding
+    only copies the files that changed.  Options that only affect the
+    archive, such as `prune_imports` or `dependency_archive`, are
+    ignored, and their output groups are empty.  Release builds should
+    leave it off:
+
+        bazel run --@subpar//:dev_mode //package:foo.par
+
+    TODO(b/27502830): A directory foo.par.runfiles is always created.
+    Launchers built in dev_mode run from it, so it must stay next to
+    them.  A par file built without dev_mode doesn't use it; don't
+    depend on it in that case.
+    """
+    parfile_rule = _parfile_with_fragments if fragments else _parfile
+    parfile_rule(name = name, fragments = fragments, **kwargs)
+
+_parfile_test = rule(
     attrs = parfile_attrs,
     executable = True,
     implementation = _parfile_impl,
     test = True,
 )
-"""Identical to par_binary, but the rule is marked as being a test.
 
-You probably want to use par_test() instead of this.
-"""
+_parfile_test_with_fragments = rule(
+    attrs = _parfile_attrs(fragments = True),
+    executable = True,
+    implementation = _parfile_impl,
+    test = True,
+)
+
+def parfile_test(name, fragments = False, **kwargs):
+    """Identical to par_binary, but the rule is marked as being a test.
+
+    You probably want to use par_test() instead of this.
+    """
+    parfile_rule = _parfile_test_with_fragments if fragments else _parfile_test
+    parfile_rule(name = name, fragments = fragments, **kwargs)
+
+def _parfile_from_deps_attrs(fragments):
+    """Return the attributes of a parfile_from_deps() rule"""
+    return dict(
+        _common_attrs,
+        srcs = attr.label_list(allow_files = [".py"]),
+        deps = attr.label_list(
+            providers = [PyInfo],
+            aspects = _library_aspects(fragments),
+        ),
+        data = attr.label_list(allow_files = True),
+        interpreter = attr.string(default = "/usr/bin/env python3"),
+        legacy_create_init = attr.bool(default = True),
+    )
+
+_parfile_from_deps = rule(
+    attrs = _parfile_from_deps_attrs(fragments = False),
+    executable = True,
+    implementation = _parfile_from_deps_impl,
+    test = False,
+)
+
+_parfile_from_deps_with_fragments = rule(
+    attrs = _parfile_from_deps_attrs(fragments = True),
+    executable = True,
+    implementation = _parfile_from_deps_impl,
+    test = False,
+)
+
+def parfile_from_deps(name, fragments = False, **kwargs):
+    """A .par file built straight from Python libraries, without a py_binary().
+
+    parfile() reads everything from the runfiles tree of a py_binary(),
+    so the tree and its manifest are inputs of the compile action.  This
+    rule instead collects the sources and data of its `deps` and hands the
+    compiler a list of files, which is much cheaper to set up for large
+    programs, especially with remote execution.
+
+    The target name is the name of the output file, and should end in
+    `.par`.
+
+    Args:
+      main: The source file that is the main entry point of the
+        application.  It needn't be listed in `srcs`.
+      srcs: Other Python sources of the application itself.
+      deps: `py_library` targets, and other targets providing `PyInfo`.
+      data: Files needed at runtime.
+      imports: List of import directories to be added to the PYTHONPATH,
+        relative to this package.
+      interpreter: Interpreter path for the first line of the .par file.
+      legacy_create_init: Whether to add an empty `__init__.py` to each
+        directory of Python files that lacks one, like
+        [py_binary.legacy_create_init](https://bazel.build/reference/be/python#py_binary.legacy_create_init).
+
+    All other arguments are as for parfile().
+    """
+    parfile_rule = _parfile_from_deps_with_fragments if fragments else _parfile_from_deps
+    parfile_rule(name = name, fragments = fragments, **kwargs)
 
 def par_binary(name, **kwargs):
     """An executable Python program.
@@ -206,6 +930,28 @@ def par_binary(name, **kwargs):
     compiler = kwargs.pop("compiler", None)
     compiler_args = kwargs.pop("compiler_args", [])
     zip_safe = kwargs.pop("zip_safe", True)
+    layout_profile = kwargs.pop("layout_profile", None)
+    prune_imports = kwargs.pop("prune_imports", False)
+    keep_modules = kwargs.pop("keep_modules", [])
+    strip_elf = kwargs.pop("strip_elf", False)
+    strip_tool = kwargs.pop("strip_tool", None)
+    elf_debug_info = kwargs.pop("elf_debug_info", False)
+    minify_sources = kwargs.pop("minify_sources", False)
+    keep_docstrings = kwargs.pop("keep_docstrings", [])
+    fragments = kwargs.pop("fragments", False)
+    zip_inputs = kwargs.pop("zip_inputs", {})
+    build_report = kwargs.pop("build_report", False)
+    dedup_content = kwargs.pop("dedup_content", False)
+    verify_archive = kwargs.pop("verify_archive", False)
+    dependency_archive = kwargs.pop("dependency_archive", False)
+    interpreter_flags = kwargs.pop("interpreter_flags", [])
+    zygote = kwargs.pop("zygote", False)
+    bytecode_cache = kwargs.pop("bytecode_cache", False)
+    freeze_modules = kwargs.pop("freeze_modules", False)
+    frozen_modules = kwargs.pop("frozen_modules", [])
+    prefetch_modules = kwargs.pop("prefetch_modules", [])
+    prefetch_profile = kwargs.pop("prefetch_profile", False)
+    lazy_import_packages = kwargs.pop("lazy_import_packages", [])
     py_binary(name = name, **kwargs)
 
     main = kwargs.get("main", name + ".py")
@@ -215,16 +961,38 @@ def par_binary(name, **kwargs):
     testonly = kwargs.get("testonly", False)
     tags = kwargs.get("tags", [])
     parfile(
+        build_report = build_report,
         compiler = compiler,
+        dedup_content = dedup_content,
+        dependency_archive = dependency_archive,
         compiler_args = compiler_args,
         default_python_version = default_python_version,
+        elf_debug_info = elf_debug_info,
+        fragments = fragments,
         imports = imports,
+        interpreter_flags = interpreter_flags,
+        keep_docstrings = keep_docstrings,
+        keep_modules = keep_modules,
+        layout_profile = layout_profile,
         main = main,
+        minify_sources = minify_sources,
         name = name + ".par",
+        prune_imports = prune_imports,
         src = name,
+        strip_elf = strip_elf,
+        strip_tool = strip_tool,
         testonly = testonly,
         visibility = visibility,
+        zip_inputs = zip_inputs,
         zip_safe = zip_safe,
+        verify_archive = verify_archive,
+        zygote = zygote,
+        bytecode_cache = bytecode_cache,
+        freeze_modules = freeze_modules,
+        frozen_modules = frozen_modules,
+        prefetch_modules = prefetch_modules,
+        prefetch_profile = prefetch_profile,
+        lazy_import_packages = lazy_import_packages,
         tags = tags,
     )
 
@@ -236,6 +1004,28 @@ def par_test(name, **kwargs):
     """
     compiler = kwargs.pop("compiler", None)
     zip_safe = kwargs.pop("zip_safe", True)
+    layout_profile = kwargs.pop("layout_profile", None)
+    prune_imports = kwargs.pop("prune_imports", False)
+    keep_modules = kwargs.pop("keep_modules", [])
+    strip_elf = kwargs.pop("strip_elf", False)
+    strip_tool = kwargs.pop("strip_tool", None)
+    elf_debug_info = kwargs.pop("elf_debug_info", False)
+    minify_sources = kwargs.pop("minify_sources", False)
+    keep_docstrings = kwargs.pop("keep_docstrings", [])
+    fragments = kwargs.pop("fragments", False)
+    zip_inputs = kwargs.pop("zip_inputs", {})
+    build_report = kwargs.pop("build_report", False)
+    dedup_content = kwargs.pop("dedup_content", False)
+    verify_archive = kwargs.pop("verify_archive", False)
+    dependency_archive = kwargs.pop("dependency_archive", False)
+    interpreter_flags = kwargs.pop("interpreter_flags", [])
+    zygote = kwargs.pop("zygote", False)
+    bytecode_cache = kwargs.pop("bytecode_cache", False)
+    freeze_modules = kwargs.pop("freeze_modules", False)
+    frozen_modules = kwargs.pop("frozen_modules", [])
+    prefetch_modules = kwargs.pop("prefetch_modules", [])
+    prefetch_profile = kwargs.pop("prefetch_profile", False)
+    lazy_import_packages = kwargs.pop("lazy_import_packages", [])
     py_test(name = name, **kwargs)
 
     main = kwargs.get("main", name + ".py")
@@ -245,14 +1035,36 @@ def par_test(name, **kwargs):
     testonly = kwargs.get("testonly", True)
     tags = kwargs.get("tags", [])
     parfile_test(
+        build_report = build_report,
         compiler = compiler,
+        dedup_content = dedup_content,
+        dependency_archive = dependency_archive,
         default_python_version = default_python_version,
+        elf_debug_info = elf_debug_info,
+        fragments = fragments,
         imports = imports,
+        interpreter_flags = interpreter_flags,
+        keep_docstrings = keep_docstrings,
+        keep_modules = keep_modules,
+        layout_profile = layout_profile,
         main = main,
+        minify_sources = minify_sources,
         name = name + ".par",
+        prune_imports = prune_imports,
         src = name,
+        strip_elf = strip_elf,
+        strip_tool = strip_tool,
         testonly = testonly,
         visibility = visibility,
+        zip_inputs = zip_inputs,
         zip_safe = zip_safe,
+        verify_archive = verify_archive,
+        zygote = zygote,
+        bytecode_cache = bytecode_cache,
+        freeze_modules = freeze_modules,
+        frozen_modules = frozen_modules,
+        prefetch_modules = prefetch_modules,
+        prefetch_profile = prefetch_profile,
+        lazy_import_packages = lazy_import_packages,
         tags = tags,
     )
@@ -0,0 +1,30 @@
+# Copyright 2016 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Integration test program for Subpar.
+
+Test a module generated at build time, whose path in the output tree
+differs from its stored path.
+"""
+
+from subpar.tests.package_generated import generated
+
+
+def main():
+    assert generated.MESSAGE == 'In generated.py', generated.MESSAGE
+    print('In main.py main()')
+
+
+if __name__ == '__main__':
+    main()